@@ -0,0 +1,110 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Runs benchmark stages and compares them with the stored baseline.
+
+    python -m benchmarks                      # all stages against in-process stand-ins
+    python -m benchmarks consumer_ingest --codec binary
+    python -m benchmarks --postgres           # database stages against a local PostgreSQL (POSTGRES_* variables)
+    python -m benchmarks --update-baseline    # store results as the new baseline
+
+Exits with status 1 if any stage is slower than its baseline by more than the tolerance.
+"""
+import argparse
+import os
+import sys
+from functools import partial
+from pathlib import Path
+
+from benchmarks.harness import find_regressions, format_results, load_baseline, measure, save_baseline
+from benchmarks.stages import STAGES, BenchmarkConfig
+from db.client import PostgresClient
+from db.migrations import (
+    TIMERS_COMPONENT,
+    TIMERS_MIGRATIONS,
+    TIMERS_TO_FIRE_COMPONENT,
+    migrate,
+    timers_to_fire_migrations,
+)
+from timer_queue.codec import BINARY_CODEC, JSON_CODEC, Codec
+
+POSTGRES_HOST = os.environ.get("POSTGRES_HOST", "localhost")
+POSTGRES_PORT = int(os.environ.get("POSTGRES_PORT", "5432"))
+POSTGRES_USER = os.environ.get("POSTGRES_USER", "postgres")
+POSTGRES_PASSWORD = os.environ.get("POSTGRES_PASSWORD", "postgres")
+POSTGRES_DB = os.environ.get("POSTGRES_DB", "postgres")
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+CODECS: dict[str, Codec] = {"json": JSON_CODEC, "binary": BINARY_CODEC}
+
+
+def postgres_database() -> PostgresClient:
+    """Retrieves a client of the local PostgreSQL, all stages and shards share the same database."""
+    return PostgresClient(
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        database=POSTGRES_DB,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        pool_size=4,
+    )
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("stages", nargs="*", metavar="stage", help=f"stages to run, all by default: {', '.join(STAGES)}")
+    parser.add_argument("--batch", type=int, default=500, help="items processed by a single run")
+    parser.add_argument("--iterations", type=int, default=20, help="measured runs of every stage")
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured runs before measuring")
+    parser.add_argument("--codec", choices=CODECS, default="json", help="codec of queue messages")
+    parser.add_argument("--postgres", action="store_true", help="use the local PostgreSQL instead of a stand-in")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH, help="baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="relative slowdown reported as regression")
+    parser.add_argument("--update-baseline", action="store_true", help="store results as the new baseline")
+    args = parser.parse_args(argv)
+    if unknown := [name for name in args.stages if name not in STAGES]:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+    return args
+
+
+def main(argv: list[str]) -> int:
+    args = parse_args(argv)
+    config = BenchmarkConfig(batch=args.batch, codec=CODECS[args.codec])
+    if args.postgres:
+        db_client = postgres_database()
+        migrate(db_client, component=TIMERS_COMPONENT, migrations=TIMERS_MIGRATIONS)
+        migrate(db_client, component=TIMERS_TO_FIRE_COMPONENT, migrations=timers_to_fire_migrations())
+        config = config._replace(database=postgres_database)
+    backend = "postgres" if args.postgres else "fake"
+
+    results = []
+    for name in args.stages or STAGES:
+        stage = STAGES[name](config)
+        measure_stage = partial(measure, iterations=args.iterations, warmup=args.warmup)
+        results.append(measure_stage(f"{name}[{args.codec},{backend}]", stage))
+    print(format_results(results))
+
+    baseline = load_baseline(args.baseline)
+    if args.update_baseline:
+        save_baseline(args.baseline, results, baseline)
+        print(f"Baseline stored in {args.baseline}")
+        return 0
+    regressions = find_regressions(results, baseline, tolerance=args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
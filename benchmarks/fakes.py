@@ -0,0 +1,239 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+In-process stand-ins for RabbitMQ and PostgreSQL.
+
+Stand-ins implement just the client methods the services call and keep state in memory, so benchmarks measure the
+services' own work: serialisation, batching and bookkeeping. Messages are still encoded by the configured codec.
+"""
+import heapq
+import re
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, UTC
+from itertools import islice
+from typing import Any, Callable, Iterator, Mapping, Optional, Sequence
+
+from db.client import Statement
+from timer_queue.codec import JSON_CODEC, Codec
+from timer_queue.trace import PUBLISHED_AT, new_trace, record_hop
+
+_INSERT_TABLE = re.compile(r"INSERT\s+INTO\s+(\w+)", re.IGNORECASE)
+
+
+class FakeQueueClient:
+    """Stand-in for ``AsyncRabbitMQClient``, every message is confirmed right away."""
+    def __init__(self, codec: Codec = JSON_CODEC) -> None:
+        self.codec = codec
+        self.published: list[bytes] = []
+
+    async def push_message(self, queue_name: str, message: Mapping[str, Any]) -> None:
+        self.published.append(self.codec.encode(message))
+
+
+class FakePublisher:
+    """Stand-in for ``RabbitMQPublisher``, every message is confirmed right away."""
+    def __init__(self, codec: Codec = JSON_CODEC) -> None:
+        self.codec = codec
+        self.published: list[bytes] = []
+
+    def push_messages(self, queue_name: str, messages: Sequence[Mapping[str, Any]]) -> list[bool]:
+        self.published.extend(self.codec.encode(message) for message in messages)
+        return [True] * len(messages)
+
+
+class FakeChannel:
+    """Stand-in for a pika channel whose thread-safe callbacks run right away, as if on the connection thread."""
+    def __init__(self) -> None:
+        self.connection = self
+        self.acked = 0
+        self.nacked = 0
+
+    def add_callback_threadsafe(self, callback: Callable[[], None]) -> None:
+        callback()
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False) -> None:
+        self.acked += 1
+
+    def basic_nack(self, delivery_tag: int, requeue: bool = True) -> None:
+        self.nacked += 1
+
+
+class FakeDeliver:
+    """Stand-in for ``pika.spec.Basic.Deliver``."""
+    def __init__(self, delivery_tag: int) -> None:
+        self.delivery_tag = delivery_tag
+
+
+class FakeProperties:
+    """Stand-in for ``pika.BasicProperties``."""
+    def __init__(self, content_type: Optional[str] = None, headers: Optional[dict[str, Any]] = None) -> None:
+        self.content_type = content_type
+        self.headers = headers
+
+
+class FakeOutboxCursor:
+    """
+    Stand-in for a cursor of the outbox relay, locking hands out the oldest rows of a shard and deleting drops them.
+    Rows always belong to configured shards.
+    """
+    def __init__(self, outbox: dict[int, tuple[Any, ...]]) -> None:
+        self.outbox = outbox
+        self.rows: list[tuple[Any, ...]] = []
+
+    def execute(self, query: str, params: Sequence[Any] = ()) -> None:
+        if "<> ALL" in query:
+            self.rows = []
+        elif "FOR UPDATE" in query:
+            shard, limit = params
+            rows = ((position, *row[:-1]) for position, row in sorted(self.outbox.items()) if row[-1] == shard)
+            self.rows = list(islice(rows, limit))
+        elif query.startswith("DELETE"):
+            for position in params[0]:
+                self.outbox.pop(position, None)
+        else:
+            raise ValueError(f"Unsupported query: {query}")
+
+    def fetchall(self) -> list[tuple[Any, ...]]:
+        return self.rows
+
+
+class FakeDatabase:
+    """
+    Stand-in for ``PostgresClient`` of the ``timers``, ``timers_outbox`` and ``timers_to_fire`` tables.
+
+    Inserts skip existing ids like ``ON CONFLICT DO NOTHING``, claims hand out due timers in ``fire_at`` order and
+    claimed timers stay claimed until deleted, leases never expire.
+    """
+    def __init__(self) -> None:
+        self.tables: dict[str, dict[Any, tuple[Any, ...]]] = {}
+        self._due: list[tuple[datetime, str]] = []
+        self._positions = 0
+
+    def _insert(self, table: str, rows: Sequence[Sequence[Any]]) -> None:
+        stored = self.tables.setdefault(table, {})
+        for row in rows:
+            if row[0] in stored:
+                continue
+            stored[row[0]] = tuple(row)
+            if table == "timers_to_fire":
+                heapq.heappush(self._due, (_as_datetime(row[1]), str(row[0])))
+
+    def _record(self, rows: Sequence[Sequence[Any]]) -> None:
+        """Records timers like the consumer does, new ones not fired by the broker are put into the outbox."""
+        timers = self.tables.setdefault("timers", {})
+        outbox = self.tables.setdefault("timers_outbox", {})
+        for row in rows:
+            if row[0] in timers:
+                continue
+            timers[row[0]] = tuple(row[:7])
+            if not row[8]:
+                self._positions += 1
+                outbox[self._positions] = (row[0], row[6], row[4], row[7], row[9])
+
+    def insert_many(self, query: str, rows: Sequence[Sequence[Any]]) -> None:
+        if "timers_outbox" in query:
+            self._record(rows)
+            return
+        match = _INSERT_TABLE.search(query)
+        if match is None:
+            raise ValueError(f"Unsupported query: {query}")
+        self._insert(match.group(1), rows)
+
+    def copy_rows(
+        self,
+        table: str,
+        columns: Sequence[str],
+        rows: Sequence[Sequence[Any]],
+        on_conflict: Optional[str] = None,
+    ) -> None:
+        self._insert(table, rows)
+
+    def copy_and_run(
+        self,
+        staging: str,
+        definition: str,
+        columns: Sequence[str],
+        rows: Sequence[Sequence[Any]],
+        query: str,
+    ) -> None:
+        if "timers_outbox" not in query:
+            raise ValueError(f"Unsupported query: {query}")
+        self._record(rows)
+
+    @contextmanager
+    def transaction(self) -> Iterator[FakeOutboxCursor]:
+        yield FakeOutboxCursor(self.tables.setdefault("timers_outbox", {}))
+
+    def _claim(self, horizon: float, limit: int) -> list[tuple[Any, ...]]:
+        timers = self.tables.get("timers_to_fire", {})
+        deadline = datetime.now(UTC) + timedelta(seconds=horizon)
+        claimed: list[tuple[Any, ...]] = []
+        while self._due and len(claimed) < limit and self._due[0][0] <= deadline:
+            _, timer_id = heapq.heappop(self._due)
+            if timer_id in timers:
+                claimed.append(timers[timer_id])
+        return claimed
+
+    def _next_fire_in(self) -> list[tuple[float]]:
+        timers = self.tables.get("timers_to_fire", {})
+        while self._due and self._due[0][1] not in timers:
+            heapq.heappop(self._due)
+        return [((self._due[0][0] - datetime.now(UTC)).total_seconds(),)] if self._due else []
+
+    def _delete(self, ids: Sequence[str]) -> None:
+        timers = self.tables.get("timers_to_fire", {})
+        for timer_id in ids:
+            timers.pop(timer_id, None)
+
+    def run_prepared(self, name: str, query: str, params: Sequence[Any] = ()) -> Optional[list[Any]]:
+        if name == "claim_timers_to_fire":
+            _, horizon, limit = params
+            return self._claim(horizon, limit)
+        if name == "delete_fired_timers":
+            self._delete(params[0])
+            return None
+        if name == "next_fire_in":
+            return self._next_fire_in()
+        raise ValueError(f"Unsupported statement: {name}")
+
+    def run_pipeline(self, statements: Sequence[Statement]) -> Optional[list[Any]]:
+        rows = None
+        for statement in statements:
+            if statement.name is None:
+                raise ValueError(f"Unsupported query: {statement.query}")
+            rows = self.run_prepared(statement.name, statement.query, statement.params or ())
+        return rows
+
+    def close(self) -> None:
+        pass
+
+
+def _as_datetime(value: Any) -> datetime:
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+def make_timer(fire_at: datetime, url: str = "http://example.com/hook") -> dict[str, Any]:
+    """Retrieves a queue message of a new timer firing at a given moment, as published by the webserver."""
+    created_at = fire_at - timedelta(seconds=62)
+    return {
+        "id": uuid.uuid4(),
+        "hours": 0,
+        "minutes": 1,
+        "seconds": 2,
+        "url": url,
+        "created_at": created_at,
+        "fire_at": fire_at,
+        "trace": record_hop(new_trace(), PUBLISHED_AT, at=created_at),
+    }
@@ -0,0 +1,154 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""Measurement of benchmark stages and comparison with a stored baseline"""
+import json
+import math
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+from typing import Callable, NamedTuple, Optional, Sequence
+
+
+class Stage(NamedTuple):
+    """
+    Single benchmarked operation.
+
+    ``run`` processes a batch of items and returns their number. ``prepare`` is called before every run outside of
+    the measurement, e.g. to refill a database, and ``close`` releases resources once the stage is measured.
+    """
+    run: Callable[[], int]
+    prepare: Optional[Callable[[], None]] = None
+    close: Optional[Callable[[], None]] = None
+
+
+class Result(NamedTuple):
+    """Measurements of a stage: processed items, latencies of single runs and memory allocated by a run."""
+    name: str
+    items: int
+    seconds: float
+    p50_ms: float
+    p99_ms: float
+    peak_alloc_kib: float
+
+    @property
+    def throughput(self) -> float:
+        """Items processed per second."""
+        return self.items / self.seconds if self.seconds else 0.0
+
+
+def percentile(samples: Sequence[float], q: float) -> float:
+    """Retrieves the ``q``-th percentile of given samples with the nearest-rank method."""
+    if not samples:
+        raise ValueError("Percentile of no samples")
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(q / 100 * len(ordered)), 1) - 1]
+
+
+def measure(name: str, stage: Stage, iterations: int, warmup: int = 1) -> Result:
+    """
+    Runs a stage ``warmup`` times unmeasured, then ``iterations`` times measured.
+
+    Allocations are measured by an extra run with ``tracemalloc``, so tracing doesn't slow down timed runs.
+    """
+    def run_once() -> tuple[int, float]:
+        if stage.prepare is not None:
+            stage.prepare()
+        started_at = perf_counter()
+        items = stage.run()
+        return items, perf_counter() - started_at
+
+    try:
+        for _ in range(warmup):
+            run_once()
+        items, latencies = 0, []
+        for _ in range(iterations):
+            run_items, latency = run_once()
+            items += run_items
+            latencies.append(latency)
+        if stage.prepare is not None:
+            stage.prepare()
+        tracemalloc.start()
+        try:
+            stage.run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    finally:
+        if stage.close is not None:
+            stage.close()
+    return Result(
+        name=name,
+        items=items,
+        seconds=sum(latencies),
+        p50_ms=percentile(latencies, 50) * 1000,
+        p99_ms=percentile(latencies, 99) * 1000,
+        peak_alloc_kib=peak / 1024,
+    )
+
+
+def load_baseline(path: Path) -> dict[str, dict[str, float]]:
+    """Loads stored results keyed by stage name, an empty baseline if there is none yet."""
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def save_baseline(path: Path, results: Sequence[Result], baseline: Optional[dict[str, dict[str, float]]] = None) -> None:
+    """Stores given results into a baseline, results of other stages are kept."""
+    baseline = dict(baseline or {})
+    for result in results:
+        baseline[result.name] = {
+            "throughput": round(result.throughput, 1),
+            "p50_ms": round(result.p50_ms, 3),
+            "p99_ms": round(result.p99_ms, 3),
+            "peak_alloc_kib": round(result.peak_alloc_kib, 1),
+        }
+    path.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+
+
+def find_regressions(
+    results: Sequence[Result],
+    baseline: dict[str, dict[str, float]],
+    tolerance: float,
+) -> list[str]:
+    """
+    Compares results with a baseline and describes every metric worse than its baseline by more than ``tolerance``.
+
+    Throughput regresses when it drops, latencies and allocations regress when they grow. Stages missing from the
+    baseline are skipped.
+    """
+    regressions = []
+    for result in results:
+        expected = baseline.get(result.name)
+        if expected is None:
+            continue
+        if result.throughput < expected["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{result.name}: throughput {result.throughput:.1f}/s, baseline {expected['throughput']:.1f}/s"
+            )
+        for metric in ("p50_ms", "p99_ms", "peak_alloc_kib"):
+            actual = getattr(result, metric)
+            if actual > expected[metric] * (1 + tolerance):
+                regressions.append(f"{result.name}: {metric} {actual:.3f}, baseline {expected[metric]:.3f}")
+    return regressions
+
+
+def format_results(results: Sequence[Result]) -> str:
+    """Formats results as a table."""
+    header = f"{'stage':<32} {'items/s':>12} {'p50 ms':>10} {'p99 ms':>10} {'peak KiB':>10}"
+    rows = [
+        f"{r.name:<32} {r.throughput:>12.1f} {r.p50_ms:>10.3f} {r.p99_ms:>10.3f} {r.peak_alloc_kib:>10.1f}"
+        for r in results
+    ]
+    return "\n".join([header, "-" * len(header), *rows])
@@ -0,0 +1,246 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Benchmark stages, each driving one service's code path in isolation.
+
+Stages take their broker and databases from a ``BenchmarkConfig``: by default in-process stand-ins, optionally
+a local PostgreSQL (see ``benchmarks.__main__``).
+"""
+import asyncio
+import threading
+import uuid
+from datetime import datetime, timedelta, UTC
+from functools import partial
+from typing import Any, Callable, NamedTuple
+
+import httpx
+
+from benchmarks.fakes import (
+    FakeChannel,
+    FakeDatabase,
+    FakeDeliver,
+    FakeProperties,
+    FakePublisher,
+    FakeQueueClient,
+    make_timer,
+)
+from benchmarks.harness import Stage
+from consumer.main import save_deliveries
+from consumer.outbox import SQL_INSERT_TIMERS_TO_FIRE, relay_outbox
+from db.sharding import HashRing, Shard, ShardRouter
+from timer.main import poll_timers_to_fire
+from timer_queue.client import ack_threadsafe
+from timer_queue.codec import JSON_CODEC, Codec, decode_message
+from timer_queue.trace import CLAIMED_AT, DISPATCHED_AT, RECEIVED_AT, dump_trace, parse_time, record_hop
+from trigger.engine import DeliveryResult, TriggerEngine
+from trigger.main import report_firing
+from webserver.broker.client import get_queue_client
+from webserver.cache.timers import TimerCache, get_timer_cache
+from webserver.database.engine import get_async_session
+from webserver.main import app
+from webserver.models.timers import Timers
+
+TEST_TIMER = {"hours": 0, "minutes": 1, "seconds": 2, "url": "http://example.com/hook"}
+TIMER_DB_SHARDS = [Shard("timer-db-1", 5432), Shard("timer-db-2", 5432)]
+
+
+class BenchmarkConfig(NamedTuple):
+    """Settings shared by all stages: items per run, codec of queue messages and factory of database clients."""
+    batch: int = 500
+    codec: Codec = JSON_CODEC
+    database: Callable[[], Any] = FakeDatabase
+
+
+class FakeSession:
+    """Stand-in for the webserver's ``AsyncSession`` serving timers from memory."""
+    def __init__(self, timers: dict[uuid.UUID, Timers]) -> None:
+        self.timers = timers
+
+    async def get(self, model: type, timer_id: uuid.UUID) -> Any:
+        return self.timers.get(timer_id)
+
+
+def encode_deliveries(config: BenchmarkConfig, messages: list[dict[str, Any]]) -> list[tuple[Any, Any, bytes]]:
+    """Encodes messages into deliveries as received from the broker."""
+    properties = FakeProperties(content_type=config.codec.content_type)
+    return [
+        (FakeDeliver(tag), properties, config.codec.encode(message)) for tag, message in enumerate(messages, start=1)
+    ]
+
+
+class AppClient:
+    """
+    Client sending requests to the webserver app in-process on its own event loop, without the app's lifespan.
+
+    Requests of a run are sent one after another, so latencies aren't skewed by queueing.
+    """
+    def __init__(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://webserver")
+
+    def send(self, method: str, urls: list[str], **kwargs: Any) -> None:
+        async def send_all() -> None:
+            for url in urls:
+                response = await self.client.request(method, url, **kwargs)
+                response.raise_for_status()
+
+        self.loop.run_until_complete(send_all())
+
+    def close(self) -> None:
+        self.loop.run_until_complete(self.client.aclose())
+        self.loop.close()
+        app.dependency_overrides.clear()
+
+
+def webserver_create(config: BenchmarkConfig) -> Stage:
+    """``POST /timer`` through the ASGI app with a broker stand-in confirming every message."""
+    queue_client = FakeQueueClient(codec=config.codec)
+    timer_cache = TimerCache(max_size=config.batch)
+    app.dependency_overrides[get_queue_client] = lambda: queue_client
+    app.dependency_overrides[get_timer_cache] = lambda: timer_cache
+    client = AppClient()
+
+    def run() -> int:
+        client.send("POST", ["/timer/"] * config.batch, json=TEST_TIMER)
+        return config.batch
+
+    return Stage(run=run, prepare=queue_client.published.clear, close=client.close)
+
+
+def webserver_get(config: BenchmarkConfig) -> Stage:
+    """``GET /timer/{id}`` through the ASGI app, timers are served by the cache after the first run."""
+    timers = [Timers(**TEST_TIMER) for _ in range(config.batch)]
+    session = FakeSession({timer.id: timer for timer in timers})
+    timer_cache = TimerCache(max_size=config.batch)
+    app.dependency_overrides[get_async_session] = lambda: session
+    app.dependency_overrides[get_timer_cache] = lambda: timer_cache
+    client = AppClient()
+    urls = [f"/timer/{timer.id}" for timer in timers]
+
+    def run() -> int:
+        client.send("GET", urls)
+        return len(urls)
+
+    return Stage(run=run, close=client.close)
+
+
+def consumer_ingest(config: BenchmarkConfig) -> Stage:
+    """Decoding a batch of incoming messages and saving it to ``timers`` and the outbox with a single commit."""
+    postgres_client = config.database()
+    timer_db_router = ShardRouter(HashRing(TIMER_DB_SHARDS), lambda shard: config.database())
+    deliveries: list[tuple[Any, Any, bytes]] = []
+
+    def prepare() -> None:
+        fire_at = datetime.now(UTC) + timedelta(hours=1)
+        deliveries[:] = encode_deliveries(config, [make_timer(fire_at) for _ in range(config.batch)])
+
+    def run() -> int:
+        save_deliveries(postgres_client=postgres_client, timer_db_router=timer_db_router, deliveries=deliveries)
+        return len(deliveries)
+
+    return Stage(run=run, prepare=prepare)
+
+
+def outbox_relay(config: BenchmarkConfig) -> Stage:
+    """Moving a batch of outbox rows of each of two timer-db shards to it and deleting them from the outbox."""
+    postgres_client = config.database()
+    timer_db_router = ShardRouter(HashRing(TIMER_DB_SHARDS), lambda shard: config.database())
+    deliveries: list[tuple[Any, Any, bytes]] = []
+
+    def prepare() -> None:
+        fire_at = datetime.now(UTC) + timedelta(hours=1)
+        deliveries[:] = encode_deliveries(config, [make_timer(fire_at) for _ in range(config.batch)])
+        save_deliveries(postgres_client=postgres_client, timer_db_router=timer_db_router, deliveries=deliveries)
+
+    def run() -> int:
+        return relay_outbox(postgres_client=postgres_client, timer_db_router=timer_db_router, limit=config.batch)
+
+    return Stage(run=run, prepare=prepare)
+
+
+def timer_dispatch(config: BenchmarkConfig) -> Stage:
+    """Claiming a batch of due timers, publishing them with confirms and deleting them."""
+    db_client = config.database()
+    # Stands in for RabbitMQPublisher, like the database of the config stands in for PostgresClient.
+    publisher: Any = FakePublisher(codec=config.codec)
+
+    def prepare() -> None:
+        fire_at = datetime.now(UTC) - timedelta(seconds=1)
+        timers = [make_timer(fire_at) for _ in range(config.batch)]
+        db_client.insert_many(
+            SQL_INSERT_TIMERS_TO_FIRE,
+            [(str(timer["id"]), timer["fire_at"], timer["url"], dump_trace(timer["trace"])) for timer in timers],
+        )
+        publisher.published.clear()
+
+    def run() -> int:
+        poll_timers_to_fire(db_client=db_client, rabbitmq_client=publisher)
+        return len(publisher.published)
+
+    return Stage(run=run, prepare=prepare)
+
+
+def trigger_delivery(config: BenchmarkConfig) -> Stage:
+    """Decoding messages, delivering their webhooks to an in-process HTTP endpoint, reporting lateness and acking."""
+    engine = TriggerEngine(
+        concurrency=500,
+        per_host_concurrency=50,
+        transport=httpx.MockTransport(lambda request: httpx.Response(200)),
+    )
+    engine.start()
+    channel = FakeChannel()
+    fire_at = datetime.now(UTC)
+    messages = []
+    for timer in (make_timer(fire_at) for _ in range(config.batch)):
+        trace = record_hop(record_hop(timer["trace"], CLAIMED_AT, at=fire_at), DISPATCHED_AT, at=fire_at)
+        messages.append({"id": timer["id"], "url": timer["url"], "fire_at": fire_at, "trace": trace})
+    deliveries = encode_deliveries(config, messages)
+
+    def run() -> int:
+        pending = len(deliveries)
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def on_done(delivery_tag: int, message: dict[str, Any], result: DeliveryResult) -> None:
+            nonlocal pending
+            report_firing(message["id"], parse_time(message["fire_at"]) or fire_at, message["trace"], result)
+            ack_threadsafe(channel, delivery_tag=delivery_tag)
+            with lock:
+                pending -= 1
+                if not pending:
+                    done.set()
+
+        for method, properties, body in deliveries:
+            message = decode_message(properties, body)
+            message["id"] = str(message["id"])
+            message["trace"] = record_hop(message["trace"], RECEIVED_AT)
+            engine.submit(
+                url=message["url"],
+                payload={"id": message["id"]},
+                on_done=partial(on_done, method.delivery_tag, message),
+            )
+        done.wait()
+        return len(deliveries)
+
+    return Stage(run=run, close=engine.stop)
+
+
+STAGES: dict[str, Callable[[BenchmarkConfig], Stage]] = {
+    "webserver_create": webserver_create,
+    "webserver_get": webserver_get,
+    "consumer_ingest": consumer_ingest,
+    "outbox_relay": outbox_relay,
+    "timer_dispatch": timer_dispatch,
+    "trigger_delivery": trigger_delivery,
+}
@@ -12,125 +12,288 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 """Consumer microservice listens for messages from RabbitMQ and saves them in PostgreSQL database."""
-import json
 import logging
 import os
+import threading
+from datetime import datetime, UTC
 from time import sleep
+from typing import Any, Callable, Sequence
 
+from consumer.outbox import run_outbox_relay
 from db.client import (
     PostgresClient,
     PostgresClientException,
 )
-from timer_queue.client import RabbitMQClient
+from db.migrations import (
+    TIMERS_COMPONENT,
+    TIMERS_MIGRATIONS,
+    TIMERS_TO_FIRE_COMPONENT,
+    Migration,
+    migrate,
+    timers_to_fire_migrations,
+)
+from db.sharding import HashRing, Shard, ShardRouter, parse_shards
+from metrics.registry import BATCH_SIZE, start_metrics_server
+from timer_queue.client import Delivery, RabbitMQClient
+from timer_queue.codec import decode_message
+from timer_queue.delay import FIRED_BY_BROKER_FIELD
 from timer_queue.exceptions import RabbitMqConnectionException
+from timer_queue.trace import CONSUMED_AT, TRACE_FIELD, dump_trace, record_hop
 
 RABBIT_MQ_HOST = os.environ.get("RABBIT_MQ_HOST", "rabbitmq")
 RABBIT_MQ_PORT = int(os.environ.get("RABBIT_MQ_PORT", "5672"))
 RABBIT_MQ_INCOMING = os.environ.get("RABBIT_MQ_INCOMING", "unknown_incoming")
 RABBIT_MQ_RECONNECTING_INTERVAL = int(os.environ.get("RABBIT_MQ_RECONNECTING_INTERVAL", "2"))
+RABBIT_MQ_PREFETCH = int(os.environ.get("RABBIT_MQ_PREFETCH", "1000"))
+
+CONSUMER_BATCH_SIZE = int(os.environ.get("CONSUMER_BATCH_SIZE", "500"))
+CONSUMER_BATCH_TIMEOUT_MS = int(os.environ.get("CONSUMER_BATCH_TIMEOUT_MS", "100"))
+# Number of batches saved concurrently, each worker holds a connection of the postgres pool while saving.
+CONSUMER_WORKERS = int(os.environ.get("CONSUMER_WORKERS", "1"))
+# "values" saves a batch with a multi-row INSERT, "copy" streams it with COPY, which is cheaper for large batches.
+CONSUMER_INSERT_METHOD = os.environ.get("CONSUMER_INSERT_METHOD", "values")
+# Maximum number of outbox rows relayed to timer-db at once and the pause of the relay once the outbox is drained.
+CONSUMER_OUTBOX_BATCH_SIZE = int(os.environ.get("CONSUMER_OUTBOX_BATCH_SIZE", "5000"))
+CONSUMER_OUTBOX_INTERVAL_MS = int(os.environ.get("CONSUMER_OUTBOX_INTERVAL_MS", "100"))
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9100"))
 
 POSTGRES_HOST = os.environ.get("POSTGRES_HOST", "postgres")
 POSTGRES_PORT = int(os.environ.get("POSTGRES_PORT", "5432"))
 POSTGRES_USER = os.environ.get("POSTGRES_USER", "postgres")
 POSTGRES_PASSWORD =os.environ.get("POSTGRES_PASSWORD", "postgres")
 POSTGRES_DB = os.environ.get("POSTGRES_DB", "postgres")
+POSTGRES_POOL_SIZE = int(os.environ.get("POSTGRES_POOL_SIZE", "2"))
+POSTGRES_POOL_MAX_IDLE = float(os.environ.get("POSTGRES_POOL_MAX_IDLE", "300"))
 
 TIMER_DB_HOST = os.environ.get("TIMER_DB_HOST", "postgres")
 TIMER_DB_PORT = int(os.environ.get("TIMER_DB_PORT", "5432"))
 TIMER_DB_USER = os.environ.get("TIMER_DB_USER", "postgres")
 TIMER_DB_PASSWORD =os.environ.get("TIMER_DB_PASSWORD", "postgres")
 TIMER_DB_DB = os.environ.get("TIMER_DB_DB", "postgres")
+TIMER_DB_PARTITIONED = os.environ.get("TIMER_DB_PARTITIONED", "false").lower() == "true"
+# Comma separated list of timer-db shards as host[:port], timers are spread across them by consistent hashing of their
+# ids. If empty, then all timers are stored in TIMER_DB_HOST.
+TIMER_DB_SHARDS = os.environ.get("TIMER_DB_SHARDS", "")
 
-
-SQL_CREATE_TIMERS_TABLE = """
-CREATE TABLE IF NOT EXISTS timers (
-    id UUID PRIMARY KEY,
+# Records timers and puts the newly recorded ones that aren't fired by the broker into the outbox with a single
+# statement, so both are committed at once and redelivered timers aren't relayed twice. The source of the timers is
+# either a multi-row VALUES list or a staging table loaded with COPY.
+SQL_RECORD_TIMERS_TEMPLATE = """
+WITH incoming (id, hours, minutes, seconds, url, created_at, fire_at, trace, fired_by_broker, shard) AS (
+    {source}
+), inserted AS (
+    INSERT INTO timers (id, hours, minutes, seconds, url, created_at, fire_at)
+    SELECT id::uuid, hours, minutes, seconds, url, created_at::timestamptz, fire_at::timestamptz
+    FROM incoming
+    ON CONFLICT (id) DO NOTHING
+    RETURNING id
+)
+INSERT INTO timers_outbox (id, fire_at, url, trace, shard)
+SELECT DISTINCT ON (inserted.id)
+    inserted.id, incoming.fire_at::timestamptz, incoming.url, incoming.trace::jsonb, incoming.shard
+FROM incoming JOIN inserted ON inserted.id = incoming.id::uuid
+WHERE NOT incoming.fired_by_broker
+"""
+SQL_RECORD_TIMERS = SQL_RECORD_TIMERS_TEMPLATE.format(source="VALUES %s")
+TIMERS_STAGING_TABLE = "incoming_timers"
+TIMERS_STAGING_DEFINITION = """(
+    id UUID,
     hours INTEGER,
     minutes INTEGER,
     seconds INTEGER,
     url TEXT,
     created_at TIMESTAMP WITH TIME ZONE,
-    fire_at TIMESTAMP WITH TIME ZONE
-)
-"""
-SQL_INSERT_TIMER = """
-INSERT INTO timers (id, hours, minutes, seconds, url, created_at, fire_at)
-VALUES ('{}', {}, {}, {}, '{}', '{}', '{}')
-"""
-SQL_CREATE_TIMERS_TO_FIRE_TABLE = """
-CREATE TABLE IF NOT EXISTS timers_to_fire (
-    id UUID PRIMARY KEY,
     fire_at TIMESTAMP WITH TIME ZONE,
-    url TEXT
-)
-"""
-SQL_INSERT_TIMER_TO_FIRE = """
-INSERT INTO timers_to_fire (id, fire_at, url)
-VALUES ('{}', '{}', '{}')
-"""
+    trace JSONB,
+    fired_by_broker BOOLEAN,
+    shard TEXT
+)"""
+SQL_RECORD_STAGED_TIMERS = SQL_RECORD_TIMERS_TEMPLATE.format(source=f"SELECT * FROM {TIMERS_STAGING_TABLE}")
 
 
 logger = logging.getLogger(__name__)
 
 
-def consume_messages():
-    def run_queries(db_client: PostgresClient, queries: list[str]) -> None:
-        while True:
-            logger.info("Attempting to save message to database")
+TIMER_FIELDS = ("id", "hours", "minutes", "seconds", "url", "created_at", "fire_at")
+PARSED_FIELDS = (*TIMER_FIELDS, "trace", FIRED_BY_BROKER_FIELD)
+# Columns of rows recording timers, the shard is the name of the timer-db shard the timer is relayed to.
+RECORD_FIELDS = (*PARSED_FIELDS, "shard")
+
+
+def parse_timers(deliveries: Sequence[Delivery]) -> list[dict[str, Any]]:
+    """
+    Decodes incoming messages, malformed ones are logged and skipped.
+
+    A message is either a single timer or a batch envelope ``{"timers": [...]}`` carrying multiple timers. Ids are
+    normalised to strings, since binary messages carry them as UUIDs. Traces get the moment the batch was consumed and
+    are kept in their JSON form stored in ``timers_to_fire``. Timers fired by the broker are flagged, they are only
+    recorded.
+    """
+    timers = []
+    consumed_at = datetime.now(UTC)
+    for _, properties, body in deliveries:
+        try:
+            payload = decode_message(properties, body)
+            payloads = payload["timers"] if isinstance(payload, dict) and "timers" in payload else [payload]
+            if not isinstance(payloads, list):
+                raise TypeError(f"timers of a batch envelope must be a list, not {type(payloads).__name__}")
+        except (ValueError, TypeError) as ex:
+            logger.error("Skipping malformed message %r: %s", body, str(ex))
+            continue
+        for payload in payloads:
             try:
-                db_client.run_queries(queries)
-            except PostgresClientException as ex:
-                logger.error("Error occurred while saving message to database: %s. Retry in 1 sec...", str(ex))
-                sleep(1)
-                continue
-            else:
+                timer = {key: payload[key] for key in TIMER_FIELDS}
+                timer["id"] = str(timer["id"])
+                timer["trace"] = dump_trace(record_hop(payload.get(TRACE_FIELD), CONSUMED_AT, at=consumed_at))
+                timer[FIRED_BY_BROKER_FIELD] = bool(payload.get(FIRED_BY_BROKER_FIELD))
+                timers.append(timer)
+            except (KeyError, TypeError) as ex:
+                logger.error("Skipping malformed timer %r: %s", payload, str(ex))
+    return timers
+
+
+def migrate_database(db_client: PostgresClient, component: str, migrations: list[Migration]) -> None:
+    """Brings the database schema up to date, retrying until it succeeds."""
+    while True:
+        try:
+            migrate(db_client, component=component, migrations=migrations)
+        except PostgresClientException as ex:
+            logger.error("Error occurred while migrating database schema: %s. Retry in 1 sec...", str(ex))
+            sleep(1)
+            continue
+        else:
+            return
+
+
+def save_rows(
+    db_client: PostgresClient,
+    save: Callable[[list[tuple[Any, ...]]], None],
+    rows: list[tuple[Any, ...]],
+) -> None:
+    """
+    Saves rows with a given function in a single transaction, retrying until it succeeds.
+
+    If the database rejects the data itself, e.g. a malformed ``fire_at``, then retrying can't help. The rows are split
+    in halves saved separately instead, until the rejected rows are isolated and skipped, so they never block a batch.
+    """
+    while True:
+        logger.info("Attempting to save %d timers to database", len(rows))
+        try:
+            save(rows)
+        except PostgresClientException as ex:
+            if ex.is_data_error:
+                if len(rows) == 1:
+                    logger.error("Skipping timer rejected by database %r: %s", rows[0], str(ex.__cause__))
+                    return
+                middle = len(rows) // 2
+                save_rows(db_client, save, rows[:middle])
+                save_rows(db_client, save, rows[middle:])
                 return
+            logger.error("Error occurred while saving timers to database: %s. Retry in 1 sec...", str(ex))
+            db_client.close()
+            sleep(1)
+            continue
+        else:
+            return
 
-    def callback(ch, method, properties, body):
-        """Callback for saving incoming messages to database."""
-        payload = json.loads(body.decode())
-        postgres_client = PostgresClient(
-            host=POSTGRES_HOST,
-            port=POSTGRES_PORT,
-            database=POSTGRES_DB,
-            user=POSTGRES_USER,
-            password=POSTGRES_PASSWORD,
-        )
-        run_queries(
-            db_client=postgres_client,
-            queries=[
-                SQL_CREATE_TIMERS_TABLE,
-                SQL_INSERT_TIMER.format(
-                    payload["id"],
-                    payload["hours"],
-                    payload["minutes"],
-                    payload["seconds"],
-                    payload["url"],
-                    payload["created_at"],
-                    payload["fire_at"]
-                )
-            ]
-        )
-        timer_db_client = PostgresClient(
-            host=TIMER_DB_HOST,
-            port=TIMER_DB_PORT,
+
+def save_deliveries(
+    postgres_client: PostgresClient,
+    timer_db_router: ShardRouter,
+    deliveries: Sequence[Delivery],
+) -> None:
+    """
+    Records timers of a batch of incoming messages in the ``timers`` table and puts the ones to be scheduled into the
+    outbox along with their timer-db shards, the outbox is relayed to timer-db in the background.
+    """
+    timers = parse_timers(deliveries)
+    # Batch envelopes carry many timers each, so inserts are split to keep every statement reasonably sized.
+    # Already recorded chunks are skipped on redelivery thanks to ON CONFLICT.
+    for start in range(0, len(timers), CONSUMER_BATCH_SIZE):
+        chunk = timers[start:start + CONSUMER_BATCH_SIZE]
+        BATCH_SIZE.labels("insert").observe(len(chunk))
+        rows = [
+            (*(timer[key] for key in PARSED_FIELDS), timer_db_router.ring.shard_for(timer["id"]).name)
+            for timer in chunk
+        ]
+        if CONSUMER_INSERT_METHOD == "copy":
+            save_rows(
+                postgres_client,
+                lambda rows: postgres_client.copy_and_run(
+                    TIMERS_STAGING_TABLE, TIMERS_STAGING_DEFINITION, RECORD_FIELDS, rows, SQL_RECORD_STAGED_TIMERS
+                ),
+                rows,
+            )
+        else:
+            save_rows(postgres_client, lambda rows: postgres_client.insert_many(SQL_RECORD_TIMERS, rows), rows)
+
+
+def consume_messages():
+    postgres_client = PostgresClient(
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        database=POSTGRES_DB,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+        pool_size=POSTGRES_POOL_SIZE,
+        pool_max_idle=POSTGRES_POOL_MAX_IDLE,
+    )
+    timer_db_router = ShardRouter(
+        HashRing(parse_shards(TIMER_DB_SHARDS, TIMER_DB_PORT) or [Shard(TIMER_DB_HOST, TIMER_DB_PORT)]),
+        lambda shard: PostgresClient(
+            host=shard.host,
+            port=shard.port,
             database=TIMER_DB_DB,
             user=TIMER_DB_USER,
             password=TIMER_DB_PASSWORD,
-        )
-        run_queries(
-            db_client=timer_db_client,
-            queries=[
-                SQL_CREATE_TIMERS_TO_FIRE_TABLE,
-                SQL_INSERT_TIMER_TO_FIRE.format(payload["id"], payload["fire_at"], payload["url"]),
-            ]
+            pool_size=POSTGRES_POOL_SIZE,
+            pool_max_idle=POSTGRES_POOL_MAX_IDLE,
+        ),
+    )
+    migrate_database(db_client=postgres_client, component=TIMERS_COMPONENT, migrations=TIMERS_MIGRATIONS)
+    for shard in timer_db_router.shards:
+        migrate_database(
+            db_client=timer_db_router.client(shard),
+            component=TIMERS_TO_FIRE_COMPONENT,
+            migrations=timers_to_fire_migrations(partitioned=TIMER_DB_PARTITIONED),
         )
 
+    start_metrics_server(METRICS_PORT)
+
+    def callback(deliveries: list[Delivery]) -> None:
+        """Callback for saving a batch of incoming messages to databases, the batch is acked after it returns."""
+        save_deliveries(postgres_client=postgres_client, timer_db_router=timer_db_router, deliveries=deliveries)
+
+    stop_relay = threading.Event()
+    relay = threading.Thread(
+        target=run_outbox_relay,
+        name="outbox-relay",
+        kwargs={
+            "postgres_client": postgres_client,
+            "timer_db_router": timer_db_router,
+            "stop": stop_relay,
+            "batch_size": CONSUMER_OUTBOX_BATCH_SIZE,
+            "interval": CONSUMER_OUTBOX_INTERVAL_MS / 1000,
+            "insert_method": CONSUMER_INSERT_METHOD,
+        },
+        daemon=True,
+    )
+    relay.start()
+
     while True:
         queue_client = RabbitMQClient(host=RABBIT_MQ_HOST, port=RABBIT_MQ_PORT)
         try:
-            queue_client.consume_messages(queue_name=RABBIT_MQ_INCOMING, call_back=callback)
+            queue_client.consume_batches(
+                queue_name=RABBIT_MQ_INCOMING,
+                call_back=callback,
+                batch_size=CONSUMER_BATCH_SIZE,
+                batch_timeout=CONSUMER_BATCH_TIMEOUT_MS / 1000,
+                prefetch_count=RABBIT_MQ_PREFETCH,
+                workers=CONSUMER_WORKERS,
+            )
         except KeyboardInterrupt:
+            stop_relay.set()
+            relay.join()
             return
         except RabbitMqConnectionException as ex:
             logger.warning(
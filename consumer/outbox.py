@@ -0,0 +1,167 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Transactional outbox of timers to be scheduled in timer-db.
+
+The consumer records a timer in ``timers`` and its outbox row with a single statement, so both are committed at once
+or not at all and ingestion depends on the ``postgres`` database only. The relay moves outbox rows to their timer-db
+shards in bulk. Inserts into ``timers_to_fire`` skip already scheduled timers, and outbox rows are deleted in the
+transaction that locked them once their shard has committed them, so relaying resumes where it stopped after any
+failure. Locked rows are skipped by concurrent relays, so every consumer may run one.
+
+Outbox rows carry the name of their shard and every shard is relayed separately, so rows piling up for an unavailable
+shard never hold up the others.
+"""
+import logging
+import threading
+from typing import Sequence
+
+from db.client import PostgresClient, PostgresClientException
+from db.sharding import Shard, ShardRouter
+
+logger = logging.getLogger(__name__)
+
+TIMER_TO_FIRE_FIELDS = ("id", "fire_at", "url", "trace")
+SQL_INSERT_TIMERS_TO_FIRE = """
+INSERT INTO timers_to_fire (id, fire_at, url, trace)
+VALUES %s
+ON CONFLICT DO NOTHING
+"""
+# Parameters: shard name, limit.
+SQL_LOCK_OUTBOX = """
+SELECT position, id, fire_at, url, trace::text
+FROM timers_outbox
+WHERE shard = %s
+ORDER BY position
+LIMIT %s
+FOR UPDATE SKIP LOCKED
+"""
+# Parameters: list of positions.
+SQL_DELETE_OUTBOX = "DELETE FROM timers_outbox WHERE position = ANY(%s::bigint[])"
+# Rows of shards which are no longer configured, e.g. written before TIMER_DB_SHARDS changed.
+# Parameters: list of shard names, limit.
+SQL_LOCK_UNROUTED_OUTBOX = """
+SELECT position, id
+FROM timers_outbox
+WHERE shard <> ALL(%s::text[])
+LIMIT %s
+FOR UPDATE SKIP LOCKED
+"""
+# Parameters: shard name, list of positions.
+SQL_ROUTE_OUTBOX = "UPDATE timers_outbox SET shard = %s WHERE position = ANY(%s::bigint[])"
+
+
+def save_to_shard(db_client: PostgresClient, rows: Sequence[Sequence], insert_method: str) -> None:
+    """Saves rows of ``timers_to_fire`` to a shard with a given insert method, skipping already saved timers."""
+    if insert_method == "copy":
+        db_client.copy_rows("timers_to_fire", TIMER_TO_FIRE_FIELDS, rows, on_conflict="ON CONFLICT DO NOTHING")
+    else:
+        db_client.insert_many(SQL_INSERT_TIMERS_TO_FIRE, rows)
+
+
+def relay_shard(
+    postgres_client: PostgresClient,
+    timer_db_router: ShardRouter,
+    shard: Shard,
+    limit: int,
+    insert_method: str = "values",
+) -> int:
+    """
+    Moves up to ``limit`` oldest outbox rows of a shard to it and returns how many were moved.
+
+    If the shard fails to save them, then they stay in the outbox and are retried by the next call.
+    """
+    db_client = timer_db_router.client(shard)
+    with postgres_client.transaction() as cur:
+        cur.execute(SQL_LOCK_OUTBOX, (shard.name, limit))
+        rows = cur.fetchall()
+        if not rows:
+            return 0
+        try:
+            save_to_shard(db_client, [row[1:] for row in rows], insert_method)
+        except PostgresClientException as ex:
+            logger.error("Error occurred while relaying %d timers to %s: %s", len(rows), shard.name, ex)
+            db_client.close()
+            return 0
+        cur.execute(SQL_DELETE_OUTBOX, ([row[0] for row in rows],))
+    logger.info("Relayed %d timers to %s", len(rows), shard.name)
+    return len(rows)
+
+
+def relay_outbox(
+    postgres_client: PostgresClient,
+    timer_db_router: ShardRouter,
+    limit: int,
+    insert_method: str = "values",
+) -> int:
+    """Moves up to ``limit`` oldest outbox rows of every shard to it and returns how many were moved in total."""
+    return sum(
+        relay_shard(postgres_client, timer_db_router, shard, limit=limit, insert_method=insert_method)
+        for shard in timer_db_router.shards
+    )
+
+
+def route_outbox(postgres_client: PostgresClient, timer_db_router: ShardRouter, limit: int) -> int:
+    """
+    Assigns outbox rows of shards which are no longer configured to their current shards, ``limit`` rows at a time,
+    and returns how many were assigned.
+    """
+    routed = 0
+    while True:
+        with postgres_client.transaction() as cur:
+            cur.execute(SQL_LOCK_UNROUTED_OUTBOX, ([shard.name for shard in timer_db_router.shards], limit))
+            rows = cur.fetchall()
+            for shard, shard_rows in timer_db_router.group_by_shard(rows, key=lambda row: row[1]).items():
+                cur.execute(SQL_ROUTE_OUTBOX, (shard.name, [row[0] for row in shard_rows]))
+        routed += len(rows)
+        if len(rows) < limit:
+            break
+    if routed:
+        logger.info("Routed %d outbox timers of removed shards", routed)
+    return routed
+
+
+def run_outbox_relay(
+    postgres_client: PostgresClient,
+    timer_db_router: ShardRouter,
+    stop: threading.Event,
+    batch_size: int,
+    interval: float,
+    insert_method: str = "values",
+) -> None:
+    """
+    Relays the outbox until ``stop`` is set. Batches follow each other right away while the outbox has a backlog,
+    otherwise the relay waits ``interval`` seconds before looking again.
+
+    Rows left for shards which are no longer configured are assigned to the current ones first.
+    """
+    while not stop.is_set():
+        try:
+            route_outbox(postgres_client, timer_db_router, limit=batch_size)
+        except PostgresClientException as ex:
+            logger.error("Error occurred while routing the outbox: %s. Retry in 1 sec...", ex)
+            postgres_client.close()
+            stop.wait(1)
+            continue
+        break
+    while not stop.is_set():
+        try:
+            relayed = relay_outbox(postgres_client, timer_db_router, limit=batch_size, insert_method=insert_method)
+        except PostgresClientException as ex:
+            logger.error("Error occurred while reading the outbox: %s. Retry in 1 sec...", ex)
+            postgres_client.close()
+            stop.wait(1)
+            continue
+        if relayed < batch_size:
+            stop.wait(interval)
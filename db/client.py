@@ -13,25 +13,317 @@
 #  limitations under the License.
 """Helper class for interacting with PostgreSQL"""
 import logging
-from functools import cached_property
-from typing import Sequence, Any
+import re
+import threading
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from functools import cached_property, lru_cache
+from time import monotonic
+from typing import Sequence, Any, Iterable, Iterator, NamedTuple, Optional
 
 import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_batch, execute_values
+
+from metrics.registry import observe_query
 
 logger = logging.getLogger(__name__)
 
 
-class PostgresClientException(Exception): ...
+class PostgresClientException(Exception):
+    @property
+    def is_data_error(self) -> bool:
+        """Whether the database rejected the data itself, so running the same statement again fails again."""
+        return isinstance(self.__cause__, (psycopg2.DataError, psycopg2.IntegrityError))
+
+
+# Names of server-side prepared statements of every connection. Prepared statements live as long as the connection,
+# so they are tracked per connection rather than per client, and forgotten together with the connection.
+_prepared_statements: weakref.WeakKeyDictionary[Any, set[str]] = weakref.WeakKeyDictionary()
+_prepared_statements_lock = threading.Lock()
+_PLACEHOLDER = re.compile(r"%%|%s")
+
+
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"")
+
+
+@lru_cache(maxsize=1024)
+def _strip_query(query: str) -> str:
+    """Removes comments, string literals and quoted identifiers from a query, so keywords are only matched in SQL."""
+    return _COMMENTS.sub(" ", _LITERALS.sub("''", query)).upper()
+
+
+def leading_keyword(query: str) -> str:
+    """Retrieves the upper-cased first keyword of a query, e.g. SELECT or CREATE."""
+    words = _strip_query(query).lstrip(" \t\r\n(").split(None, 1)
+    return words[0] if words else ""
+
+
+def statement_kind(query: str) -> str:
+    """Retrieves the kind of a query reported in metrics, e.g. ``insert``."""
+    return leading_keyword(query).lower() or "unknown"
+
+
+def has_returning_clause(query: str) -> bool:
+    """Checks whether a query has a RETURNING clause."""
+    return re.search(r"\bRETURNING\b", _strip_query(query)) is not None
+
+
+def to_server_placeholders(query: str) -> str:
+    """Converts ``%s`` placeholders of a query into the ``$1``, ``$2``, ... placeholders of PREPARE."""
+    counter = iter(range(1, query.count("%s") + 1))
+    return _PLACEHOLDER.sub(lambda match: "%" if match.group() == "%%" else f"${next(counter)}", query)
+
+
+def encode_copy_value(value: Any) -> str:
+    """Encodes a value into the text format of COPY."""
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class Statement(NamedTuple):
+    """Query with its bound parameters, run as a server-side prepared statement if it's given a name."""
+    query: str
+    params: Optional[Sequence[Any]] = None
+    name: Optional[str] = None
+
+
+class CopyRowsReader:
+    """File-like object streaming rows in the text format of COPY, so rows are never materialised all at once."""
+    def __init__(self, rows: Iterable[Sequence[Any]]) -> None:
+        self._rows = iter(rows)
+        self._buffer = ""
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._buffer += "\t".join(encode_copy_value(value) for value in row) + "\n"
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+def rollback(connection: psycopg2.extensions.connection) -> None:
+    """Rolls back the current transaction, a broken connection is left as is to be discarded or reopened later."""
+    try:
+        connection.rollback()
+    except psycopg2.Error:
+        pass
+
+
+class PostgresConnectionPool:
+    """
+    Thread-safe pool of PostgreSQL connections.
+
+    The pool opens up to ``max_size`` connections on demand. Connections idle for longer than ``max_idle``
+    seconds are closed (never going below ``min_size``), connections idle for longer than ``ping_after`` seconds are
+    checked with a trivial query before use, and connections broken while in use are discarded.
+    """
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        database: str,
+        user: str,
+        password: str,
+        max_size: int = 10,
+        min_size: int = 1,
+        max_idle: float = 300.0,
+        ping_after: float = 30.0,
+        acquire_timeout: Optional[float] = None,
+    ) -> None:
+        if not 0 <= min_size <= max_size or max_size < 1:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1")
+        self.host = host
+        self.port = port
+        self.database = database
+        self.user = user
+        self.password = password
+        self.max_size = max_size
+        self.min_size = min_size
+        self.max_idle = max_idle
+        self.ping_after = ping_after
+        self.acquire_timeout = acquire_timeout
+        self._idle: deque[tuple[psycopg2.extensions.connection, float]] = deque()
+        self._size = 0
+        self._condition = threading.Condition()
+
+    @property
+    def size(self) -> int:
+        """Number of currently opened connections, both idle and in use."""
+        return self._size
+
+    def _connect(self) -> psycopg2.extensions.connection:
+        try:
+            logger.info("Opening pooled connection to PostgreSQL on %s:%d", self.host, self.port)
+            return psycopg2.connect(
+                host=self.host,
+                port=self.port,
+                database=self.database,
+                user=self.user,
+                password=self.password,
+            )
+        except psycopg2.Error as ex:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise PostgresClientException from ex
+
+    def _discard(self, connection: psycopg2.extensions.connection) -> None:
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    @staticmethod
+    def _is_alive(connection: psycopg2.extensions.connection) -> bool:
+        try:
+            with connection.cursor() as cur:
+                cur.execute("SELECT 1")
+            connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def evict_idle(self) -> None:
+        """Closes connections that have been idle for too long, keeping at least ``min_size`` opened."""
+        expired: list[psycopg2.extensions.connection] = []
+        with self._condition:
+            now = monotonic()
+            # Idle connections are returned to the right end, so the oldest ones are on the left.
+            while self._idle and self._size - len(expired) > self.min_size and now - self._idle[0][1] > self.max_idle:
+                expired.append(self._idle.popleft()[0])
+        for connection in expired:
+            logger.info("Closing idle connection to PostgreSQL on %s:%d", self.host, self.port)
+            self._discard(connection)
+
+    def acquire(self) -> psycopg2.extensions.connection:
+        """Takes a healthy connection from the pool, opening a new one if there is room for it."""
+        deadline = None if self.acquire_timeout is None else monotonic() + self.acquire_timeout
+        while True:
+            with self._condition:
+                while not self._idle and self._size >= self.max_size:
+                    timeout = None if deadline is None else deadline - monotonic()
+                    if timeout is not None and timeout <= 0:
+                        raise PostgresClientException("Timed out waiting for a free PostgreSQL connection")
+                    self._condition.wait(timeout)
+                if self._idle:
+                    connection, idle_since = self._idle.pop()
+                else:
+                    self._size += 1
+                    connection, idle_since = None, 0.0
+
+            if connection is None:
+                return self._connect()
+            if connection.closed or (monotonic() - idle_since > self.ping_after and not self._is_alive(connection)):
+                logger.warning("Discarding broken connection to PostgreSQL on %s:%d", self.host, self.port)
+                self._discard(connection)
+                continue
+            return connection
+
+    def release(self, connection: psycopg2.extensions.connection) -> None:
+        """Returns a connection to the pool, the connection is discarded if it can't be reset to a clean state."""
+        try:
+            if not connection.closed:
+                connection.rollback()
+        except psycopg2.Error:
+            pass
+        if connection.closed:
+            self._discard(connection)
+        else:
+            with self._condition:
+                self._idle.append((connection, monotonic()))
+                self._condition.notify()
+        self.evict_idle()
+
+    @contextmanager
+    def connection(self) -> Iterator[psycopg2.extensions.connection]:
+        """Borrows a connection for the duration of the block."""
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self) -> None:
+        """Closes all idle connections."""
+        with self._condition:
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+        for connection in idle:
+            self._discard(connection)
+
+
+_pools: dict[tuple[str, int, str, str], PostgresConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(
+    host: str,
+    port: int,
+    database: str,
+    user: str,
+    password: str,
+    **kwargs: Any,
+) -> PostgresConnectionPool:
+    """Returns the process-wide connection pool for a given database, creating it on the first call."""
+    key = (host, port, database, user)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = PostgresConnectionPool(
+                host=host, port=port, database=database, user=user, password=password, **kwargs,
+            )
+        return _pools[key]
 
 
 class PostgresClient:
-    """Helper class for interacting with PostgreSQL."""
-    def __init__(self, host: str, port: int, database: str, user: str, password: str) -> None:
+    """
+    Helper class for interacting with PostgreSQL.
+
+    By default the client holds a single connection of its own. If ``pool_size`` is given, then every call borrows
+    a connection from the process-wide pool for this database, shared by all clients and threads.
+    """
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        database: str,
+        user: str,
+        password: str,
+        pool_size: int = 0,
+        pool_min_size: int = 1,
+        pool_max_idle: float = 300.0,
+    ) -> None:
         self.host = host
         self.port = port
         self.database = database
         self.user = user
         self.password = password
+        self.pool = get_connection_pool(
+            host=host,
+            port=port,
+            database=database,
+            user=user,
+            password=password,
+            max_size=pool_size,
+            min_size=min(pool_min_size, pool_size),
+            max_idle=pool_max_idle,
+        ) if pool_size else None
 
     @cached_property
     def connection(self) -> psycopg2.extensions.connection:
@@ -48,33 +340,208 @@ class PostgresClient:
         except psycopg2.Error as ex:
             raise PostgresClientException from ex
 
-    def run_queries(self, queries: Sequence[str]) -> list[Any]:
-        """Run multiple queries and return results as a list."""
+    @contextmanager
+    def connect(self) -> Iterator[psycopg2.extensions.connection]:
+        """Provides a connection for the duration of the block, either the own one or a pooled one."""
+        if self.pool is None:
+            yield self.connection
+        else:
+            with self.pool.connection() as connection:
+                yield connection
+
+    def close(self) -> None:
+        """Close own connection to PostgreSQL, a new one is opened on the next query."""
+        if connection := self.__dict__.pop("connection", None):
+            connection.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[psycopg2.extensions.cursor]:
+        """
+        Provides a cursor whose statements run in a single transaction, committed once at the end of the block.
+
+        The transaction is rolled back if the block fails, psycopg2 errors are raised as PostgresClientException.
+        """
+        with self.connect() as connection:
+            try:
+                with connection.cursor() as cur:
+                    yield cur
+                connection.commit()
+            except psycopg2.Error as ex:
+                rollback(connection)
+                raise PostgresClientException from ex
+            except BaseException:
+                rollback(connection)
+                raise
+
+    def run_queries(self, queries: Sequence[str], single_transaction: bool = False) -> list[Any]:
+        """
+        Run multiple queries and return results as a list.
+
+        Every query is committed separately, unless ``single_transaction`` is set, then all of them are committed at
+        once or none at all. Rows are fetched for the queries that return them, and None is returned for the others.
+        """
         results = []
-        with self.connection.cursor() as cur:
+        with self.connect() as connection, connection.cursor() as cur:
             logger.info(f"Attempting to query data from database.")
             for query in queries:
                 try:
-                    cur.execute(query)
+                    with observe_query(statement_kind(query)):
+                        cur.execute(query)
                 except psycopg2.Error as ex:
+                    rollback(connection)
                     raise PostgresClientException from ex
 
-                if self.is_ddl_query(query):
-                    self.connection.commit()
-
-                result = cur.fetchall() if self.is_dql_query(query) else None
-                results.append(result)
-                self.connection.commit()
+                results.append(cur.fetchall() if cur.description is not None else None)
+                if not single_transaction:
+                    connection.commit()
+            if single_transaction:
+                connection.commit()
         logger.info(f"Successfully completed queues execution.")
         return results
 
+    def run_query(self, query: str, params: Optional[Sequence[Any]] = None) -> Optional[list[Any]]:
+        """
+        Run a single query with bound parameters and commit it.
+
+        Parameters are passed separately from the query using ``%s`` placeholders, so values never need quoting.
+        Returns rows if the query returns any, otherwise None.
+        """
+        with observe_query(statement_kind(query)), self.transaction() as cur:
+            cur.execute(query, params)
+            return cur.fetchall() if cur.description is not None else None
+
+    @staticmethod
+    def _prepared(
+        cur: psycopg2.extensions.cursor, name: str, query: str, params: Optional[Sequence[Any]],
+    ) -> sql.Composable:
+        """Prepares a named statement on the cursor's connection unless done before, and returns its EXECUTE."""
+        with _prepared_statements_lock:
+            prepared = _prepared_statements.setdefault(cur.connection, set())
+        if name not in prepared:
+            cur.execute(
+                sql.SQL("PREPARE {} AS {}").format(
+                    sql.Identifier(name), sql.SQL(to_server_placeholders(query)),
+                )
+            )
+            # PREPARE is not transactional, so the statement exists even if the transaction is rolled back later.
+            prepared.add(name)
+        execute = sql.SQL("EXECUTE {}").format(sql.Identifier(name))
+        if params:
+            execute += sql.SQL(" ({})").format(sql.SQL(", ").join(sql.Placeholder() * len(params)))
+        return execute
+
+    def run_prepared(self, name: str, query: str, params: Sequence[Any] = ()) -> Optional[list[Any]]:
+        """
+        Run a query as a server-side prepared statement and commit it.
+
+        The query is prepared once per connection under a given name with ``%s`` placeholders for ``params``, then
+        every call only executes it, so PostgreSQL parses and plans the query once rather than on every call. The
+        name must identify the query, different queries must never share a name.
+        """
+        with observe_query(name), self.transaction() as cur:
+            cur.execute(self._prepared(cur, name, query, params), params)
+            return cur.fetchall() if cur.description is not None else None
+
+    def run_pipeline(self, statements: Sequence[Statement]) -> Optional[list[Any]]:
+        """
+        Run statements in a single transaction sending them to the server at once.
+
+        Parameters are bound on the client side and all statements go out as a single request, so the whole sequence
+        costs one round-trip instead of one per statement. Named statements are run as prepared statements (see
+        ``run_prepared``). Only rows of the last statement are returned, if it returns any.
+        """
+        kind = "+".join(statement.name or statement_kind(statement.query) for statement in statements)
+        with observe_query(kind), self.transaction() as cur:
+            request = b";\n".join(
+                cur.mogrify(
+                    self._prepared(cur, statement.name, statement.query, statement.params)
+                    if statement.name else statement.query,
+                    statement.params,
+                )
+                for statement in statements
+            )
+            cur.execute(request)
+            return cur.fetchall() if cur.description is not None else None
+
+    def execute_many(self, query: str, params_list: Sequence[Sequence[Any]], page_size: int = 100) -> None:
+        """
+        Run a query once for every set of parameters and commit them at once.
+
+        Statements are sent to the server in pages of ``page_size`` statements, rather than one round-trip each.
+        """
+        logger.info("Attempting to run a query %d times.", len(params_list))
+        with observe_query(statement_kind(query)), self.transaction() as cur:
+            execute_batch(cur, query, params_list, page_size=page_size)
+
+    def copy_rows(
+        self,
+        table: str,
+        columns: Sequence[str],
+        rows: Iterable[Sequence[Any]],
+        on_conflict: Optional[str] = None,
+    ) -> None:
+        """
+        Load rows into a table with COPY and commit them at once.
+
+        COPY can't skip conflicting rows, so if ``on_conflict`` is given (e.g. ``"ON CONFLICT DO NOTHING"``), then rows
+        are copied into a temporary table first and moved to the target table with a single INSERT using that clause.
+        """
+        columns_sql = sql.SQL(", ").join(map(sql.Identifier, columns))
+        target = sql.Identifier(table)
+        with observe_query("copy"), self.transaction() as cur:
+            if on_conflict is not None:
+                staging = sql.Identifier(f"{table}_copy")
+                cur.execute(sql.SQL("CREATE TEMPORARY TABLE {} (LIKE {}) ON COMMIT DROP").format(staging, target))
+            else:
+                staging = target
+            cur.copy_expert(sql.SQL("COPY {} ({}) FROM STDIN").format(staging, columns_sql), CopyRowsReader(rows))
+            logger.info("Copied %d rows into %s.", cur.rowcount, table)
+            if on_conflict is not None:
+                cur.execute(
+                    sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {} {}").format(
+                        target, columns_sql, columns_sql, staging, sql.SQL(on_conflict),
+                    )
+                )
+
+    def copy_and_run(
+        self,
+        staging: str,
+        definition: str,
+        columns: Sequence[str],
+        rows: Iterable[Sequence[Any]],
+        query: str,
+    ) -> None:
+        """
+        Load rows with COPY into a temporary table and run a query reading them from it, committing both at once.
+
+        The table named ``staging`` is created with a given column ``definition``, e.g. ``"(id UUID, url TEXT)"``, and
+        dropped on commit, so the query can spread the rows over several tables with a single statement.
+        """
+        columns_sql = sql.SQL(", ").join(map(sql.Identifier, columns))
+        staging_sql = sql.Identifier(staging)
+        with observe_query("copy"), self.transaction() as cur:
+            cur.execute(sql.SQL("CREATE TEMPORARY TABLE {} {} ON COMMIT DROP").format(staging_sql, sql.SQL(definition)))
+            cur.copy_expert(sql.SQL("COPY {} ({}) FROM STDIN").format(staging_sql, columns_sql), CopyRowsReader(rows))
+            logger.info("Copied %d rows into %s.", cur.rowcount, staging)
+            cur.execute(query)
+
+    def insert_many(self, query: str, rows: Sequence[Sequence[Any]]) -> None:
+        """
+        Insert all given rows with a single multi-row statement and commit them at once.
+
+        The query must contain a single ``VALUES %s`` placeholder which is expanded into the rows.
+        """
+        logger.info("Attempting to insert %d rows into database.", len(rows))
+        with observe_query(statement_kind(query)), self.transaction() as cur:
+            execute_values(cur, query, rows, page_size=max(len(rows), 1))
+        logger.info("Successfully inserted %d rows.", len(rows))
+
     @staticmethod
     def is_ddl_query(query: str) -> bool:
         """Checks whether the query is a DDL query."""
-        ddl_keywords = ["CREATE", "ALTER", "DROP", "TRUNCATE"]
-        return next((True for keyword in ddl_keywords if keyword in query.upper()), False)
+        return leading_keyword(query) in {"CREATE", "ALTER", "DROP", "TRUNCATE"}
 
     @staticmethod
     def is_dql_query(query: str) -> bool:
-        """Checks whether the query is a DQL query."""
-        return query.upper().strip().startswith("SELECT")
\ No newline at end of file
+        """Checks whether the query returns rows: either a DQL query or a DML query with a RETURNING clause."""
+        return leading_keyword(query) == "SELECT" or has_returning_clause(query)
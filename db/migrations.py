@@ -0,0 +1,214 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""Versioned schema migrations applied once at service startup"""
+import logging
+from typing import NamedTuple, Sequence
+
+import psycopg2
+
+from db.client import PostgresClient, PostgresClientException
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary application-wide key of the advisory lock serialising concurrent migrations of the same database.
+MIGRATIONS_LOCK_ID = 7_140_521
+
+SQL_LOCK_MIGRATIONS = "SELECT pg_advisory_xact_lock(%s)"
+SQL_CREATE_SCHEMA_MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    component TEXT,
+    version INTEGER,
+    description TEXT,
+    applied_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (component, version)
+)
+"""
+SQL_SELECT_APPLIED_MIGRATIONS = "SELECT version FROM schema_migrations WHERE component = %s"
+SQL_INSERT_APPLIED_MIGRATION = "INSERT INTO schema_migrations (component, version, description) VALUES (%s, %s, %s)"
+
+SQL_CREATE_TIMERS_TABLE = """
+CREATE TABLE IF NOT EXISTS timers (
+    id UUID PRIMARY KEY,
+    hours INTEGER,
+    minutes INTEGER,
+    seconds INTEGER,
+    url TEXT,
+    created_at TIMESTAMP WITH TIME ZONE,
+    fire_at TIMESTAMP WITH TIME ZONE
+)
+"""
+# Timers to be scheduled in timer-db, written in the same transaction as their records in timers and moved to their
+# timer-db shards, named by shard, by the outbox relay of the consumer.
+SQL_CREATE_TIMERS_OUTBOX_TABLE = """
+CREATE TABLE IF NOT EXISTS timers_outbox (
+    position BIGSERIAL PRIMARY KEY,
+    id UUID NOT NULL,
+    fire_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    url TEXT,
+    trace JSONB,
+    shard TEXT NOT NULL
+)
+"""
+SQL_CREATE_TIMERS_OUTBOX_SHARD_INDEX = """
+CREATE INDEX IF NOT EXISTS timers_outbox_shard_idx ON timers_outbox (shard, position)
+"""
+SQL_CREATE_TIMERS_TO_FIRE_TABLE = """
+CREATE TABLE IF NOT EXISTS timers_to_fire (
+    id UUID PRIMARY KEY,
+    fire_at TIMESTAMP WITH TIME ZONE,
+    url TEXT
+)
+"""
+SQL_CREATE_PARTITIONED_TIMERS_TO_FIRE_TABLE = """
+CREATE TABLE IF NOT EXISTS timers_to_fire (
+    id UUID,
+    fire_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    url TEXT,
+    PRIMARY KEY (id, fire_at)
+) PARTITION BY RANGE (fire_at)
+"""
+SQL_CREATE_TIMERS_TO_FIRE_DEFAULT_PARTITION = """
+CREATE TABLE IF NOT EXISTS timers_to_fire_default PARTITION OF timers_to_fire DEFAULT
+"""
+SQL_ADD_TIMERS_TO_FIRE_CLAIMED_UNTIL = """
+ALTER TABLE timers_to_fire ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMP WITH TIME ZONE
+"""
+SQL_CREATE_TIMERS_TO_FIRE_FIRE_AT_INDEX = """
+CREATE INDEX IF NOT EXISTS timers_to_fire_fire_at_idx ON timers_to_fire (fire_at)
+"""
+SQL_ADD_TIMERS_TO_FIRE_TRACE = """
+ALTER TABLE timers_to_fire ADD COLUMN IF NOT EXISTS trace JSONB
+"""
+# Channel notified about timers inserted into timers_to_fire, the payload is the earliest firing moment of the inserted
+# timers in seconds since the epoch. Notifications are sent once per statement and only on commit.
+TIMERS_TO_FIRE_CHANNEL = "timers_to_fire"
+SQL_CREATE_NOTIFY_TIMERS_TO_FIRE_FUNCTION = """
+CREATE OR REPLACE FUNCTION notify_timers_to_fire() RETURNS TRIGGER AS $$
+DECLARE
+    earliest TIMESTAMP WITH TIME ZONE;
+BEGIN
+    SELECT min(fire_at) INTO earliest FROM inserted;
+    IF earliest IS NOT NULL THEN
+        PERFORM pg_notify('timers_to_fire', extract(epoch FROM earliest)::text);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+SQL_DROP_NOTIFY_TIMERS_TO_FIRE_TRIGGER = """
+DROP TRIGGER IF EXISTS timers_to_fire_notify ON timers_to_fire
+"""
+SQL_CREATE_NOTIFY_TIMERS_TO_FIRE_TRIGGER = """
+CREATE TRIGGER timers_to_fire_notify AFTER INSERT ON timers_to_fire
+REFERENCING NEW TABLE AS inserted
+FOR EACH STATEMENT EXECUTE FUNCTION notify_timers_to_fire()
+"""
+SQL_CREATE_TIMER_DISPATCHERS_TABLE = """
+CREATE TABLE IF NOT EXISTS timer_dispatchers (
+    owner TEXT PRIMARY KEY,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+)
+"""
+SQL_CREATE_TIMER_DISPATCH_SLOTS_TABLE = """
+CREATE TABLE IF NOT EXISTS timer_dispatch_slots (
+    slot INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+)
+"""
+
+
+class Migration(NamedTuple):
+    """Single schema change identified by its version within a component."""
+    version: int
+    description: str
+    queries: Sequence[str]
+
+
+TIMERS_COMPONENT = "timers"
+TIMERS_MIGRATIONS = [
+    Migration(1, "Create timers table", [SQL_CREATE_TIMERS_TABLE]),
+    Migration(2, "Create timers outbox", [SQL_CREATE_TIMERS_OUTBOX_TABLE, SQL_CREATE_TIMERS_OUTBOX_SHARD_INDEX]),
+]
+TIMERS_TO_FIRE_COMPONENT = "timers_to_fire"
+
+
+def timers_to_fire_migrations(partitioned: bool = False) -> list[Migration]:
+    """
+    Retrieves migrations of the ``timers_to_fire`` table.
+
+    If ``partitioned`` is set, then the table is created range-partitioned by ``fire_at`` with a default partition
+    catching timers outside of existing partitions (see ``db.partitions``). The flag only affects creation of the
+    table, an already existing table keeps its layout.
+    """
+    if partitioned:
+        create_table = Migration(
+            1,
+            "Create partitioned timers_to_fire table",
+            [SQL_CREATE_PARTITIONED_TIMERS_TO_FIRE_TABLE, SQL_CREATE_TIMERS_TO_FIRE_DEFAULT_PARTITION],
+        )
+    else:
+        create_table = Migration(1, "Create timers_to_fire table", [SQL_CREATE_TIMERS_TO_FIRE_TABLE])
+    return [
+        create_table,
+        Migration(2, "Add claim lease to timers_to_fire", [SQL_ADD_TIMERS_TO_FIRE_CLAIMED_UNTIL]),
+        Migration(3, "Index timers_to_fire by fire_at", [SQL_CREATE_TIMERS_TO_FIRE_FIRE_AT_INDEX]),
+        Migration(4, "Add trace to timers_to_fire", [SQL_ADD_TIMERS_TO_FIRE_TRACE]),
+        Migration(
+            5,
+            "Notify about inserted timers_to_fire",
+            [
+                SQL_CREATE_NOTIFY_TIMERS_TO_FIRE_FUNCTION,
+                SQL_DROP_NOTIFY_TIMERS_TO_FIRE_TRIGGER,
+                SQL_CREATE_NOTIFY_TIMERS_TO_FIRE_TRIGGER,
+            ],
+        ),
+        Migration(
+            6,
+            "Create leases of timer dispatchers",
+            [SQL_CREATE_TIMER_DISPATCHERS_TABLE, SQL_CREATE_TIMER_DISPATCH_SLOTS_TABLE],
+        ),
+    ]
+
+
+TIMERS_TO_FIRE_MIGRATIONS = timers_to_fire_migrations()
+
+
+def migrate(db_client: PostgresClient, component: str, migrations: Sequence[Migration]) -> list[int]:
+    """
+    Applies migrations of a given component that haven't been applied to the database yet.
+
+    All pending migrations run in a single transaction under an advisory lock, so several services starting at once
+    neither apply the same migration twice nor observe a half-migrated schema. Returns applied versions.
+    """
+    applied_versions = []
+    with db_client.connect() as connection:
+        try:
+            with connection, connection.cursor() as cur:
+                cur.execute(SQL_LOCK_MIGRATIONS, (MIGRATIONS_LOCK_ID,))
+                cur.execute(SQL_CREATE_SCHEMA_MIGRATIONS_TABLE)
+                cur.execute(SQL_SELECT_APPLIED_MIGRATIONS, (component,))
+                already_applied = {row[0] for row in cur.fetchall()}
+                for migration in sorted(migrations, key=lambda m: m.version):
+                    if migration.version in already_applied:
+                        continue
+                    logger.info("Applying migration %s #%d: %s", component, migration.version, migration.description)
+                    for query in migration.queries:
+                        cur.execute(query)
+                    cur.execute(SQL_INSERT_APPLIED_MIGRATION, (component, migration.version, migration.description))
+                    applied_versions.append(migration.version)
+        except psycopg2.Error as ex:
+            raise PostgresClientException from ex
+    logger.info("Schema of %s is up to date", component)
+    return applied_versions
@@ -0,0 +1,100 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""Waiting for PostgreSQL notifications sent with NOTIFY"""
+import logging
+import select
+from typing import Optional, Sequence
+
+import psycopg2
+from psycopg2 import sql
+
+from db.client import PostgresClientException
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationListener:
+    """
+    Connection listening to notifications of a channel.
+
+    LISTEN binds the channel to a session, so the listener holds a dedicated connection instead of a pooled one. The
+    connection is opened on first use and reopened after it breaks, notifications sent meanwhile are lost.
+    """
+    def __init__(self, host: str, port: int, database: str, user: str, password: str, channel: str) -> None:
+        self.host = host
+        self.port = port
+        self.database = database
+        self.user = user
+        self.password = password
+        self.channel = channel
+        self._connection: Optional[psycopg2.extensions.connection] = None
+
+    def _connect(self) -> psycopg2.extensions.connection:
+        if self._connection is None:
+            logger.info("Listening to %s on %s:%d", self.channel, self.host, self.port)
+            try:
+                connection = psycopg2.connect(
+                    host=self.host,
+                    port=self.port,
+                    database=self.database,
+                    user=self.user,
+                    password=self.password,
+                )
+                # Notifications are delivered between transactions only, so the session must not stay in one.
+                connection.autocommit = True
+                with connection.cursor() as cur:
+                    cur.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+            except psycopg2.Error as ex:
+                raise PostgresClientException from ex
+            self._connection = connection
+        return self._connection
+
+    def fileno(self) -> int:
+        """Retrieves the socket of the connection, so the listener can be waited for with ``select``."""
+        return self._connect().fileno()
+
+    def poll(self) -> list[str]:
+        """Retrieves payloads of notifications received so far without waiting for new ones."""
+        connection = self._connect()
+        try:
+            connection.poll()
+        except psycopg2.Error as ex:
+            self.close()
+            raise PostgresClientException from ex
+        payloads = [notify.payload for notify in connection.notifies]
+        connection.notifies.clear()
+        return payloads
+
+    def close(self) -> None:
+        """Closes the connection, a new one is opened on next use."""
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            try:
+                connection.close()
+            except psycopg2.Error:
+                pass
+
+
+def wait_for_notifications(listeners: Sequence[NotificationListener], timeout: float) -> list[tuple[int, str]]:
+    """
+    Waits up to ``timeout`` seconds for notifications of any of given listeners.
+
+    Returns indexes of the listeners that received notifications along with their payloads, or nothing on timeout.
+    """
+    ready, _, _ = select.select(listeners, [], [], timeout)
+    return [
+        (index, payload)
+        for index, listener in enumerate(listeners) if listener in ready
+        for payload in listener.poll()
+    ]
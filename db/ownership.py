@@ -0,0 +1,136 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Lease-based ownership of ``timers_to_fire`` slots shared by timer processes of the same database.
+
+Timers are spread over a fixed number of slots by their ids. Every live process leases an equal share of the slots,
+renews the leases with heartbeats and fires only timers of its slots, so the processes of a database neither compete
+for the same rows nor fire the same timers in the lookahead mode. Once a process stops renewing its leases, they
+expire and the others take its slots over; a process joining later gets its share from the ones above their share.
+Ownership only splits the work, claims of timers keep guarding them from being fired twice while slots change hands.
+"""
+import logging
+import uuid
+from time import monotonic
+from typing import Any
+
+from db.client import PostgresClient
+
+logger = logging.getLogger(__name__)
+
+# Slot of a timer, the last two bytes of its id modulo the number of slots. Parameters: number of slots.
+SQL_TIMER_SLOT = "mod(get_byte(uuid_send(id), 14) * 256 + get_byte(uuid_send(id), 15), %s)"
+# Parameters: owner, lease in seconds.
+SQL_HEARTBEAT = """
+INSERT INTO timer_dispatchers (owner, expires_at) VALUES (%s, NOW() + make_interval(secs => %s))
+ON CONFLICT (owner) DO UPDATE SET expires_at = EXCLUDED.expires_at
+"""
+SQL_DELETE_EXPIRED_DISPATCHERS = "DELETE FROM timer_dispatchers WHERE expires_at < NOW()"
+SQL_COUNT_DISPATCHERS = "SELECT count(*) FROM timer_dispatchers"
+# Parameters: lease in seconds, owner.
+SQL_RENEW_SLOTS = """
+UPDATE timer_dispatch_slots
+SET expires_at = NOW() + make_interval(secs => %s)
+WHERE owner = %s AND expires_at >= NOW()
+RETURNING slot
+"""
+# Parameters: owner, list of slots.
+SQL_RELEASE_SLOTS = "DELETE FROM timer_dispatch_slots WHERE owner = %s AND slot = ANY(%s::int[])"
+# Slots that are free or whose lease has expired are taken in random order, so processes joining at once take different
+# ones. A slot leased by another process meanwhile is left to it. Parameters: owner, lease in seconds, number of
+# slots, limit.
+SQL_ACQUIRE_SLOTS = """
+INSERT INTO timer_dispatch_slots (slot, owner, expires_at)
+SELECT candidate.slot, %s, NOW() + make_interval(secs => %s)
+FROM generate_series(0, %s - 1) AS candidate(slot)
+WHERE NOT EXISTS (
+    SELECT 1 FROM timer_dispatch_slots held WHERE held.slot = candidate.slot AND held.expires_at >= NOW()
+)
+ORDER BY random()
+LIMIT %s
+ON CONFLICT (slot) DO UPDATE SET owner = EXCLUDED.owner, expires_at = EXCLUDED.expires_at
+WHERE timer_dispatch_slots.expires_at < NOW()
+RETURNING slot
+"""
+# Parameters: owner.
+SQL_RELEASE_ALL_SLOTS = "DELETE FROM timer_dispatch_slots WHERE owner = %s"
+SQL_DELETE_DISPATCHER = "DELETE FROM timer_dispatchers WHERE owner = %s"
+
+
+def timer_slot(timer_id: Any, slots: int) -> int:
+    """Retrieves the slot of a timer, the same as ``SQL_TIMER_SLOT`` does."""
+    return int.from_bytes(uuid.UUID(str(timer_id)).bytes[14:]) % slots
+
+
+class SlotOwnership:
+    """
+    Slots of a database leased by a timer process named ``owner``.
+
+    Leases last ``lease`` seconds, ``heartbeat`` should be called well within that time to keep them. Owned slots are
+    trusted only until the lease taken by the last successful heartbeat would expire.
+    """
+    def __init__(self, db_client: PostgresClient, owner: str, slots: int, lease: float) -> None:
+        if not 0 < slots <= 65536:
+            raise ValueError("Number of slots must be within 1..65536")
+        self.db_client = db_client
+        self.owner = owner
+        self.slots = slots
+        self.lease = lease
+        self._owned: list[int] = []
+        self._valid_until = 0.0
+        # Moment of the last successful heartbeat, on the monotonic clock.
+        self.renewed_at = 0.0
+
+    @property
+    def owned(self) -> list[int]:
+        """Retrieves slots leased by the process in ascending order, none once the leases may have expired."""
+        return self._owned if monotonic() < self._valid_until else []
+
+    def heartbeat(self) -> list[int]:
+        """
+        Renews the leases and rebalances slots: slots above the fair share of the live processes are released and
+        missing ones are taken from the free or expired slots. Returns owned slots, raises PostgresClientException.
+        """
+        started_at = monotonic()
+        with self.db_client.transaction() as cur:
+            cur.execute(SQL_HEARTBEAT, (self.owner, self.lease))
+            cur.execute(SQL_DELETE_EXPIRED_DISPATCHERS)
+            cur.execute(SQL_COUNT_DISPATCHERS)
+            (dispatchers,), = cur.fetchall()
+            share = -(-self.slots // max(dispatchers, 1))
+            cur.execute(SQL_RENEW_SLOTS, (self.lease, self.owner))
+            renewed = [slot for slot, in cur.fetchall()]
+            owned = sorted(slot for slot in renewed if slot < self.slots)
+            # Slots beyond the configured number are left over from a different configuration.
+            released = [slot for slot in renewed if slot >= self.slots] + owned[share:]
+            owned = owned[:share]
+            if released:
+                cur.execute(SQL_RELEASE_SLOTS, (self.owner, released))
+            if len(owned) < share:
+                cur.execute(SQL_ACQUIRE_SLOTS, (self.owner, self.lease, self.slots, share - len(owned)))
+                owned = sorted(owned + [slot for slot, in cur.fetchall()])
+        if owned != self._owned:
+            logger.info("Timer dispatcher %s owns %d of %d slots", self.owner, len(owned), self.slots)
+        self._owned = owned
+        self._valid_until = started_at + self.lease
+        self.renewed_at = started_at
+        return owned
+
+    def release(self) -> None:
+        """Gives up all slots at once, so other processes take them over without waiting for the leases to expire."""
+        self._owned = []
+        self._valid_until = 0.0
+        with self.db_client.transaction() as cur:
+            cur.execute(SQL_RELEASE_ALL_SLOTS, (self.owner,))
+            cur.execute(SQL_DELETE_DISPATCHER, (self.owner,))
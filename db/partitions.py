@@ -0,0 +1,136 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""Maintenance of the time-partitioned ``timers_to_fire`` table"""
+import logging
+from datetime import datetime, timedelta, UTC
+from typing import Optional
+
+import psycopg2
+from psycopg2 import sql
+
+from db.client import PostgresClient, PostgresClientException
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary application-wide key of the advisory lock serialising concurrent maintenance of the same database.
+PARTITIONS_LOCK_ID = 7_140_522
+PARTITION_PREFIX = "timers_to_fire_p"
+PARTITION_BOUND_FORMAT = "%Y%m%d%H%M"
+EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+
+SQL_LOCK_PARTITIONS = "SELECT pg_advisory_xact_lock(%s)"
+SQL_SELECT_PARTITIONS = """
+SELECT child.relname
+FROM pg_inherits
+JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+WHERE parent.relname = 'timers_to_fire'
+"""
+SQL_CREATE_PARTITION = """
+CREATE TABLE {partition} (LIKE timers_to_fire INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+"""
+# Timers that were scheduled before their partition existed are stored in the default partition. They are moved
+# into the new partition before attaching it, otherwise PostgreSQL refuses to attach an overlapping range.
+SQL_MOVE_FROM_DEFAULT_PARTITION = """
+WITH moved AS (
+    DELETE FROM timers_to_fire_default
+    WHERE fire_at >= %(start)s AND fire_at < %(end)s
+    RETURNING *
+)
+INSERT INTO {partition} SELECT * FROM moved
+"""
+SQL_ATTACH_PARTITION = """
+ALTER TABLE timers_to_fire ATTACH PARTITION {partition} FOR VALUES FROM (%(start)s) TO (%(end)s)
+"""
+SQL_PARTITION_HAS_ROWS = "SELECT EXISTS (SELECT 1 FROM {partition})"
+SQL_DROP_PARTITION = "DROP TABLE {partition}"
+
+
+def bucket_start(moment: datetime, interval: timedelta) -> datetime:
+    """Retrieves the beginning of the partition bucket the given moment belongs to."""
+    return EPOCH + (moment - EPOCH) // interval * interval
+
+
+def partition_name(start: datetime, end: datetime) -> str:
+    """Retrieves the name of the partition holding timers firing within ``[start, end)``."""
+    return f"{PARTITION_PREFIX}{start:{PARTITION_BOUND_FORMAT}}_{end:{PARTITION_BOUND_FORMAT}}"
+
+
+def partition_bounds(name: str) -> Optional[tuple[datetime, datetime]]:
+    """Retrieves bounds of a partition by its name, or None if the table is not a time bucket partition."""
+    if not name.startswith(PARTITION_PREFIX):
+        return None
+    try:
+        start, end = name.removeprefix(PARTITION_PREFIX).split("_")
+        return (
+            datetime.strptime(start, PARTITION_BOUND_FORMAT).replace(tzinfo=UTC),
+            datetime.strptime(end, PARTITION_BOUND_FORMAT).replace(tzinfo=UTC),
+        )
+    except ValueError:
+        return None
+
+
+def maintain_partitions(
+    db_client: PostgresClient,
+    interval: timedelta,
+    ahead: int,
+    now: Optional[datetime] = None,
+) -> tuple[list[str], list[str]]:
+    """
+    Creates partitions for the current and ``ahead`` upcoming buckets and drops drained ones.
+
+    A partition is drained once its whole range is in the past and all of its timers have been fired. Returns names of
+    created and dropped partitions.
+    """
+    if interval < timedelta(minutes=1):
+        raise ValueError("Partition interval must be at least one minute")
+    now = now or datetime.now(UTC)
+    created, dropped = [], []
+    with db_client.connect() as connection:
+        try:
+            with connection, connection.cursor() as cur:
+                cur.execute(SQL_LOCK_PARTITIONS, (PARTITIONS_LOCK_ID,))
+                cur.execute(SQL_SELECT_PARTITIONS)
+                existing = {
+                    name: bounds for (name,) in cur.fetchall() if (bounds := partition_bounds(name)) is not None
+                }
+
+                first_start = bucket_start(now, interval)
+                for i in range(ahead + 1):
+                    start = first_start + i * interval
+                    end = start + interval
+                    if any(start < other_end and other_start < end for other_start, other_end in existing.values()):
+                        continue
+                    name = partition_name(start, end)
+                    partition = sql.Identifier(name)
+                    params = {"start": start, "end": end}
+                    cur.execute(sql.SQL(SQL_CREATE_PARTITION).format(partition=partition))
+                    cur.execute(sql.SQL(SQL_MOVE_FROM_DEFAULT_PARTITION).format(partition=partition), params)
+                    cur.execute(sql.SQL(SQL_ATTACH_PARTITION).format(partition=partition), params)
+                    existing[name] = (start, end)
+                    created.append(name)
+
+                for name, (_, end) in sorted(existing.items()):
+                    if end > now:
+                        continue
+                    partition = sql.Identifier(name)
+                    cur.execute(sql.SQL(SQL_PARTITION_HAS_ROWS).format(partition=partition))
+                    if not cur.fetchone()[0]:
+                        cur.execute(sql.SQL(SQL_DROP_PARTITION).format(partition=partition))
+                        dropped.append(name)
+        except psycopg2.Error as ex:
+            raise PostgresClientException from ex
+    if created or dropped:
+        logger.info("Created partitions: %s; dropped drained partitions: %s", created, dropped)
+    return created, dropped
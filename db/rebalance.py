@@ -0,0 +1,123 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Online rebalancing of pending timers across timer-db shards.
+
+Run it after changing the list of shards: every timer stored on a shard that no longer owns it according to the
+consistent hash ring of ``TIMER_DB_SHARDS`` is moved to its owner. Shards being removed are listed in
+``TIMER_DB_DRAINED_SHARDS`` and are drained completely. Services keep running meanwhile: timers claimed for firing
+are left in place, and every timer is inserted into its new shard before it's deleted from the old one, so a timer is
+never lost (though it may fire twice if the tool is killed in between).
+
+    TIMER_DB_SHARDS=timer-db-1,timer-db-2,timer-db-3 python -m db.rebalance
+"""
+import logging
+import os
+from typing import Iterable
+
+from db.client import PostgresClient
+from db.migrations import TIMERS_TO_FIRE_COMPONENT, migrate, timers_to_fire_migrations
+from db.sharding import HashRing, Shard, ShardRouter, parse_shards
+
+TIMER_DB_SHARDS = os.environ.get("TIMER_DB_SHARDS", "")
+TIMER_DB_DRAINED_SHARDS = os.environ.get("TIMER_DB_DRAINED_SHARDS", "")
+TIMER_DB_PORT = int(os.environ.get("TIMER_DB_PORT", "5432"))
+TIMER_DB_USER = os.environ.get("TIMER_DB_USER", "postgres")
+TIMER_DB_PASSWORD =os.environ.get("TIMER_DB_PASSWORD", "postgres")
+TIMER_DB_DB = os.environ.get("TIMER_DB_DB", "postgres")
+TIMER_DB_PARTITIONED = os.environ.get("TIMER_DB_PARTITIONED", "false").lower() == "true"
+REBALANCE_BATCH_SIZE = int(os.environ.get("REBALANCE_BATCH_SIZE", "1000"))
+
+MIN_TIMER_ID = "00000000-0000-0000-0000-000000000000"
+# Parameters: last seen id, limit.
+SQL_SELECT_TIMER_IDS = """
+SELECT id
+FROM timers_to_fire
+WHERE id > %s
+ORDER BY id
+LIMIT %s
+"""
+# Timers claimed by a timer process are about to be fired and deleted, so they are not moved. Traces are returned as
+# text, which is inserted into the target as is.
+SQL_TAKE_TIMERS = """
+DELETE FROM timers_to_fire
+WHERE id = ANY(%s::uuid[]) AND (claimed_until IS NULL OR claimed_until < NOW())
+RETURNING id, fire_at, url, trace::text
+"""
+SQL_INSERT_TIMERS_TO_FIRE = """
+INSERT INTO timers_to_fire (id, fire_at, url, trace)
+VALUES %s
+ON CONFLICT DO NOTHING
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def move_timers(source: PostgresClient, target: PostgresClient, ids: list[str]) -> int:
+    """
+    Moves given timers from one shard to another and returns how many of them were moved.
+
+    Timers are deleted from the source in a transaction that commits only after they were inserted into the target.
+    """
+    with source.transaction() as cur:
+        cur.execute(SQL_TAKE_TIMERS, (ids,))
+        if rows := cur.fetchall():
+            target.insert_many(SQL_INSERT_TIMERS_TO_FIRE, rows)
+    return len(rows)
+
+
+def rebalance(router: ShardRouter, sources: Iterable[Shard], batch_size: int = REBALANCE_BATCH_SIZE) -> int:
+    """Moves timers stored on given shards to the shards owning them, returns the number of moved timers."""
+    moved = 0
+    for source in sources:
+        source_client = router.client(source)
+        logger.info("Rebalancing timers stored on %s", source.name)
+        last_id = MIN_TIMER_ID
+        while rows := source_client.run_query(SQL_SELECT_TIMER_IDS, (last_id, batch_size)):
+            last_id = rows[-1][0]
+            misplaced = router.group_by_shard([row[0] for row in rows], key=str)
+            misplaced.pop(source, None)
+            for target, ids in misplaced.items():
+                count = move_timers(source_client, router.client(target), ids)
+                logger.info("Moved %d timers from %s to %s", count, source.name, target.name)
+                moved += count
+    return moved
+
+
+def main() -> None:
+    shards = parse_shards(TIMER_DB_SHARDS, TIMER_DB_PORT)
+    drained = [shard for shard in parse_shards(TIMER_DB_DRAINED_SHARDS, TIMER_DB_PORT) if shard not in shards]
+    router = ShardRouter(
+        HashRing(shards),
+        lambda shard: PostgresClient(
+            host=shard.host,
+            port=shard.port,
+            database=TIMER_DB_DB,
+            user=TIMER_DB_USER,
+            password=TIMER_DB_PASSWORD,
+        ),
+    )
+    for shard in shards:
+        migrate(
+            router.client(shard),
+            component=TIMERS_TO_FIRE_COMPONENT,
+            migrations=timers_to_fire_migrations(partitioned=TIMER_DB_PARTITIONED),
+        )
+    moved = rebalance(router, sources=[*shards, *drained])
+    logger.info("Rebalancing finished, %d timers moved", moved)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,101 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""Placement of timers across timer-db shards with consistent hashing"""
+import bisect
+import hashlib
+import threading
+from typing import Any, Callable, Iterable, NamedTuple, TypeVar
+
+from db.client import PostgresClient
+
+T = TypeVar("T")
+
+
+class Shard(NamedTuple):
+    """Single timer-db instance."""
+    host: str
+    port: int
+
+    @property
+    def name(self) -> str:
+        return f"{self.host}:{self.port}"
+
+
+def parse_shards(spec: str, default_port: int = 5432) -> list[Shard]:
+    """Parses a comma separated list of ``host[:port]`` shards, e.g. ``timer-db-1,timer-db-2:5433``."""
+    shards = []
+    for item in filter(None, (item.strip() for item in spec.split(","))):
+        host, _, port = item.partition(":")
+        shards.append(Shard(host=host, port=int(port) if port else default_port))
+    if len(set(shards)) != len(shards):
+        raise ValueError(f"Duplicated shards in {spec!r}")
+    return shards
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping keys to shards.
+
+    Every shard is placed on the ring ``replicas`` times, so keys spread evenly, and adding or removing a shard only
+    moves the keys of that shard, about ``1 / len(shards)`` of all keys.
+    """
+    def __init__(self, shards: Iterable[Shard], replicas: int = 512) -> None:
+        self.shards = list(shards)
+        if not self.shards:
+            raise ValueError("Hash ring needs at least one shard")
+        points = sorted(
+            (_hash(f"{shard.name}#{replica}"), shard) for shard in self.shards for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, key: Any) -> Shard:
+        """Retrieves the shard owning a given key, e.g. a timer id."""
+        index = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._shards[index]
+
+
+class ShardRouter:
+    """Routes timers to clients of their timer-db shards, clients are created on first use and reused."""
+    def __init__(self, ring: HashRing, client_factory: Callable[[Shard], PostgresClient]) -> None:
+        self.ring = ring
+        self.client_factory = client_factory
+        self._clients: dict[Shard, PostgresClient] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def shards(self) -> list[Shard]:
+        return self.ring.shards
+
+    def client(self, shard: Shard) -> PostgresClient:
+        """Retrieves the client of a given shard."""
+        with self._lock:
+            if shard not in self._clients:
+                self._clients[shard] = self.client_factory(shard)
+            return self._clients[shard]
+
+    def client_for(self, timer_id: Any) -> PostgresClient:
+        """Retrieves the client of the shard owning a given timer."""
+        return self.client(self.ring.shard_for(timer_id))
+
+    def group_by_shard(self, items: Iterable[T], key: Callable[[T], Any]) -> dict[Shard, list[T]]:
+        """Groups items by shards owning them, ``key`` retrieves the timer id of an item."""
+        groups: dict[Shard, list[T]] = {}
+        for item in items:
+            groups.setdefault(self.ring.shard_for(key(item)), []).append(item)
+        return groups
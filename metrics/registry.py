@@ -0,0 +1,96 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Runtime metrics shared by all services, exposed in the Prometheus text format.
+
+The webserver serves them on ``GET /metrics``, the other services on a plain HTTP port started with
+``start_metrics_server``. Every process exposes only its own measurements, so e.g. publish latency of the webserver and
+of the timer are told apart by the scraped target.
+"""
+import logging
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from urllib.parse import urlsplit
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE = "timers"
+# Batch size buckets, from single messages up to the largest batch envelopes.
+BATCH_SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Firing lateness buckets in seconds, from on time up to timers stuck behind a backlog.
+LATENESS_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+MESSAGES_PUBLISHED = Counter(
+    "messages_published", "Messages published to RabbitMQ by outcome", ["queue", "outcome"], namespace=NAMESPACE,
+)
+PUBLISH_LATENCY = Histogram(
+    "publish_latency_seconds", "Time to publish a message and get it confirmed", ["queue"], namespace=NAMESPACE,
+)
+MESSAGES_CONSUMED = Counter(
+    "messages_consumed", "Messages delivered to consumers by RabbitMQ", ["queue"], namespace=NAMESPACE,
+)
+BATCH_SIZE = Histogram(
+    "batch_size", "Number of items processed at once", ["stage"], buckets=BATCH_SIZE_BUCKETS, namespace=NAMESPACE,
+)
+DB_QUERY_LATENCY = Histogram(
+    "db_query_latency_seconds", "Time to run a database statement", ["statement"], namespace=NAMESPACE,
+)
+DUE_TIMERS = Gauge(
+    "due_timers", "Timers due to fire but not fired yet, capped by the counting limit", ["shard"], namespace=NAMESPACE,
+)
+WEBHOOK_LATENCY = Histogram(
+    "webhook_latency_seconds", "Time to deliver a webhook", ["host"], namespace=NAMESPACE,
+)
+WEBHOOKS = Counter(
+    "webhooks", "Delivered webhooks by target host and response status", ["host", "status"], namespace=NAMESPACE,
+)
+FIRING_LATENESS = Histogram(
+    "firing_lateness_seconds", "Time from the firing moment of a timer until its hook was sent",
+    buckets=LATENESS_BUCKETS, namespace=NAMESPACE,
+)
+FIRING_STAGE = Histogram(
+    "firing_stage_seconds", "Time a timer spent in a stage of the pipeline", ["stage"],
+    buckets=LATENESS_BUCKETS, namespace=NAMESPACE,
+)
+
+
+@contextmanager
+def observe_query(statement: str) -> Iterator[None]:
+    """Measures the latency of a database statement of a given kind, e.g. a prepared statement name."""
+    with DB_QUERY_LATENCY.labels(statement).time():
+        yield
+
+
+def observe_webhook(url: str, status_code: Optional[int], elapsed: float) -> None:
+    """Records a webhook delivery, failures without a response are recorded with the status ``error``."""
+    host = urlsplit(url).netloc
+    WEBHOOK_LATENCY.labels(host).observe(elapsed)
+    WEBHOOKS.labels(host, str(status_code) if status_code is not None else "error").inc()
+
+
+def observe_firing(lateness: float, stages: dict[str, float]) -> None:
+    """Records how late a timer fired and how long it spent in each stage, in seconds."""
+    FIRING_LATENESS.observe(lateness)
+    for stage, seconds in stages.items():
+        FIRING_STAGE.labels(stage).observe(seconds)
+
+
+def start_metrics_server(port: int) -> None:
+    """Serves metrics of this process on a given port in a background thread, ``0`` disables it."""
+    if not port:
+        return
+    start_http_server(port)
+    logger.info("Serving metrics on port %d", port)
@@ -0,0 +1,83 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from unittest import mock
+
+import pytest
+
+from benchmarks.harness import (
+    Result,
+    Stage,
+    find_regressions,
+    load_baseline,
+    measure,
+    percentile,
+    save_baseline,
+)
+
+TEST_RESULT = Result(name="stage", items=1000, seconds=0.5, p50_ms=10.0, p99_ms=20.0, peak_alloc_kib=100.0)
+
+
+class TestHarness:
+    def test_percentile(self):
+        samples = [float(value) for value in range(100, 0, -1)]
+
+        assert percentile(samples, 50) == 50
+        assert percentile(samples, 99) == 99
+        assert percentile([3.0], 99) == 3.0
+        with pytest.raises(ValueError):
+            percentile([], 50)
+
+    def test_measure(self):
+        stage = Stage(run=mock.MagicMock(return_value=10), prepare=mock.MagicMock(), close=mock.MagicMock())
+
+        result = measure("stage", stage, iterations=3, warmup=2)
+
+        assert result.name == "stage"
+        assert result.items == 30
+        assert result.throughput > 0
+        assert result.p50_ms <= result.p99_ms
+        # Warmup, measured runs and the run tracing allocations.
+        assert stage.run.call_count == 6
+        assert stage.prepare.call_count == 6
+        stage.close.assert_called_once()
+
+    def test_measure_closes_failed_stage(self):
+        stage = Stage(run=mock.MagicMock(side_effect=RuntimeError), close=mock.MagicMock())
+
+        with pytest.raises(RuntimeError):
+            measure("stage", stage, iterations=1)
+
+        stage.close.assert_called_once()
+
+    def test_baseline_round_trip(self, tmp_path):
+        path = tmp_path / "baseline.json"
+        assert load_baseline(path) == {}
+
+        save_baseline(path, [TEST_RESULT], baseline={"other": {"throughput": 1.0}})
+
+        assert load_baseline(path) == {
+            "other": {"throughput": 1.0},
+            "stage": {"throughput": 2000.0, "p50_ms": 10.0, "p99_ms": 20.0, "peak_alloc_kib": 100.0},
+        }
+
+    def test_find_regressions(self):
+        baseline = {"stage": {"throughput": 2000.0, "p50_ms": 10.0, "p99_ms": 20.0, "peak_alloc_kib": 100.0}}
+        slower = TEST_RESULT._replace(seconds=1.0, p99_ms=30.0)
+
+        assert find_regressions([TEST_RESULT], baseline, tolerance=0.1) == []
+        assert find_regressions([slower._replace(name="new")], baseline, tolerance=0.1) == []
+        regressions = find_regressions([slower], baseline, tolerance=0.1)
+        assert len(regressions) == 2
+        assert regressions[0].startswith("stage: throughput")
+        assert regressions[1].startswith("stage: p99_ms")
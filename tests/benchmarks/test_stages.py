@@ -0,0 +1,29 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import pytest
+
+from benchmarks.harness import measure
+from benchmarks.stages import STAGES, BenchmarkConfig
+from timer_queue.codec import BINARY_CODEC, JSON_CODEC
+
+
+class TestStages:
+    @pytest.mark.parametrize("codec", [JSON_CODEC, BINARY_CODEC])
+    @pytest.mark.parametrize("name", list(STAGES))
+    def test_stage(self, name, codec):
+        stage = STAGES[name](BenchmarkConfig(batch=5, codec=codec))
+
+        result = measure(name, stage, iterations=2, warmup=1)
+
+        assert result.items == 10
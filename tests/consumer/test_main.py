@@ -0,0 +1,278 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import uuid
+from datetime import datetime
+from unittest import mock
+
+import psycopg2
+import pytest
+
+from consumer.main import (
+    RECORD_FIELDS,
+    SQL_RECORD_STAGED_TIMERS,
+    SQL_RECORD_TIMERS,
+    TIMERS_STAGING_DEFINITION,
+    TIMERS_STAGING_TABLE,
+    consume_messages,
+    parse_timers,
+    save_rows,
+)
+from db.client import PostgresClientException
+from db.sharding import HashRing, Shard
+from timer_queue.codec import BINARY_CODEC, BINARY_CONTENT_TYPE
+from timer_queue.trace import dump_trace
+
+TEST_ID = str(uuid.uuid4())
+TEST_URL = "http://example.com"
+TEST_CREATED_AT = "2024-12-01 10:00:00+00:00"
+TEST_FIRE_AT = "2024-12-01 10:01:02+00:00"
+TEST_CONSUMED_AT = datetime.fromisoformat("2024-12-01 10:00:01+00:00")
+TEST_TRACE = {"id": "test-trace", "published_at": TEST_CREATED_AT}
+TEST_STORED_TRACE = dump_trace({**TEST_TRACE, "consumed_at": TEST_CONSUMED_AT})
+TEST_PAYLOAD = {
+    "id": TEST_ID,
+    "hours": 0,
+    "minutes": 1,
+    "seconds": 2,
+    "url": TEST_URL,
+    "created_at": TEST_CREATED_AT,
+    "fire_at": TEST_FIRE_AT,
+    "trace": TEST_TRACE,
+}
+TEST_TIMER = {**TEST_PAYLOAD, "trace": TEST_STORED_TRACE, "fired_by_broker": False}
+TEST_SHARD = "postgres:5432"
+TEST_RECORD_ROW = (TEST_ID, 0, 1, 2, TEST_URL, TEST_CREATED_AT, TEST_FIRE_AT, TEST_STORED_TRACE, False, TEST_SHARD)
+CONSUMER_PATH = "consumer.main.{}"
+FROZEN_DATETIME = mock.MagicMock(now=mock.MagicMock(return_value=TEST_CONSUMED_AT))
+
+
+def make_delivery(payload) -> tuple:
+    body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+    return mock.MagicMock(), mock.MagicMock(), body
+
+
+@mock.patch(CONSUMER_PATH.format("METRICS_PORT"), 0)
+@mock.patch(CONSUMER_PATH.format("datetime"), FROZEN_DATETIME)
+@mock.patch(CONSUMER_PATH.format("run_outbox_relay"), mock.MagicMock())
+class TestConsumer:
+    def test_parse_timers(self):
+        deliveries = [make_delivery(TEST_PAYLOAD), make_delivery(b"not a json"), make_delivery({"id": TEST_ID})]
+
+        assert parse_timers(deliveries) == [TEST_TIMER]
+
+    def test_parse_timers_untraced(self):
+        payload = {key: value for key, value in TEST_PAYLOAD.items() if key != "trace"}
+
+        timer, = parse_timers([make_delivery(payload)])
+
+        trace = json.loads(timer["trace"])
+        assert trace["id"]
+        assert trace["consumed_at"] == str(TEST_CONSUMED_AT)
+
+    def test_parse_timers_binary(self):
+        payload = {
+            **TEST_PAYLOAD,
+            "id": uuid.UUID(TEST_ID),
+            "created_at": datetime.fromisoformat(TEST_CREATED_AT),
+            "fire_at": datetime.fromisoformat(TEST_FIRE_AT),
+        }
+        properties = mock.MagicMock(content_type=BINARY_CONTENT_TYPE)
+        deliveries = [(mock.MagicMock(), properties, BINARY_CODEC.encode({"timers": [payload]}))]
+
+        assert parse_timers(deliveries) == [
+            {**payload, "id": TEST_ID, "trace": TEST_STORED_TRACE, "fired_by_broker": False},
+        ]
+
+    def test_parse_timers_fired_by_broker(self):
+        timer, = parse_timers([make_delivery({**TEST_PAYLOAD, "fired_by_broker": True})])
+
+        assert timer == {**TEST_TIMER, "fired_by_broker": True}
+
+    def test_parse_timers_batch_envelope(self):
+        other_id = str(uuid.uuid4())
+        other_payload = {**TEST_PAYLOAD, "id": other_id}
+        deliveries = [
+            make_delivery({"timers": [TEST_PAYLOAD, {"id": TEST_ID}, other_payload]}),
+            make_delivery(TEST_PAYLOAD),
+        ]
+
+        assert parse_timers(deliveries) == [TEST_TIMER, {**TEST_TIMER, "id": other_id}, TEST_TIMER]
+
+    @pytest.mark.parametrize("timers", [5, None])
+    def test_parse_timers_malformed_batch_envelope(self, timers):
+        deliveries = [make_delivery({"timers": timers}), make_delivery(TEST_PAYLOAD)]
+
+        assert parse_timers(deliveries) == [TEST_TIMER]
+
+    @mock.patch(CONSUMER_PATH.format("sleep"))
+    def test_save_rows_retries(self, mock_sleep):
+        mock_db_client = mock.MagicMock()
+        save = mock.MagicMock(side_effect=[PostgresClientException, None])
+
+        save_rows(mock_db_client, save, [("row",)])
+
+        assert save.call_args_list == [mock.call([("row",)])] * 2
+        mock_db_client.close.assert_called_once()
+        mock_sleep.assert_called_once_with(1)
+
+    @mock.patch(CONSUMER_PATH.format("sleep"))
+    def test_save_rows_skips_rejected_rows(self, mock_sleep):
+        mock_db_client = mock.MagicMock()
+        rows = [(i,) for i in range(5)]
+        saved = []
+
+        def save(chunk):
+            if (1,) in chunk or (4,) in chunk:
+                raise PostgresClientException from psycopg2.DataError("invalid input syntax for type timestamp")
+            saved.extend(chunk)
+
+        save_rows(mock_db_client, save, rows)
+
+        assert saved == [(0,), (2,), (3,)]
+        mock_db_client.close.assert_not_called()
+        mock_sleep.assert_not_called()
+
+    @mock.patch(CONSUMER_PATH.format("migrate"))
+    @mock.patch(CONSUMER_PATH.format("RabbitMQClient"))
+    @mock.patch(CONSUMER_PATH.format("PostgresClient"))
+    def test_consume_messages(self, mock_db_client, mock_rabbit_client, mock_migrate):
+        mock_db = mock_db_client.return_value
+        mock_mq = mock_rabbit_client.return_value
+
+        def consume_batches(queue_name, call_back, **kwargs):
+            assert kwargs["workers"] == 1
+            call_back([make_delivery(TEST_PAYLOAD), make_delivery(b"broken")])
+            raise KeyboardInterrupt
+
+        mock_mq.consume_batches.side_effect = consume_batches
+
+        consume_messages()
+
+        assert mock_db_client.call_count == 2
+        assert mock_migrate.call_count == 2
+        mock_db.insert_many.assert_called_once_with(SQL_RECORD_TIMERS, [TEST_RECORD_ROW])
+
+    @mock.patch(CONSUMER_PATH.format("migrate"))
+    @mock.patch(CONSUMER_PATH.format("RabbitMQClient"))
+    @mock.patch(CONSUMER_PATH.format("PostgresClient"))
+    def test_consume_messages_fired_by_broker(self, mock_db_client, mock_rabbit_client, mock_migrate):
+        mock_db = mock_db_client.return_value
+        other_id = str(uuid.uuid4())
+        fired_by_broker = {**TEST_PAYLOAD, "id": other_id, "fired_by_broker": True}
+
+        def consume_batches(queue_name, call_back, **kwargs):
+            call_back([make_delivery({"timers": [fired_by_broker, TEST_PAYLOAD]})])
+            raise KeyboardInterrupt
+
+        mock_rabbit_client.return_value.consume_batches.side_effect = consume_batches
+
+        consume_messages()
+
+        mock_db.insert_many.assert_called_once_with(
+            SQL_RECORD_TIMERS,
+            [
+                (other_id, 0, 1, 2, TEST_URL, TEST_CREATED_AT, TEST_FIRE_AT, TEST_STORED_TRACE, True, TEST_SHARD),
+                TEST_RECORD_ROW,
+            ],
+        )
+
+    @mock.patch(CONSUMER_PATH.format("migrate"))
+    @mock.patch(CONSUMER_PATH.format("RabbitMQClient"))
+    @mock.patch(CONSUMER_PATH.format("PostgresClient"))
+    def test_consume_messages_skips_empty_batch(self, mock_db_client, mock_rabbit_client, mock_migrate):
+        mock_db = mock_db_client.return_value
+
+        def consume_batches(queue_name, call_back, **kwargs):
+            call_back([make_delivery(b"broken")])
+            raise KeyboardInterrupt
+
+        mock_rabbit_client.return_value.consume_batches.side_effect = consume_batches
+
+        consume_messages()
+
+        mock_db.insert_many.assert_not_called()
+
+    @mock.patch(CONSUMER_PATH.format("CONSUMER_BATCH_SIZE"), 2)
+    @mock.patch(CONSUMER_PATH.format("migrate"))
+    @mock.patch(CONSUMER_PATH.format("RabbitMQClient"))
+    @mock.patch(CONSUMER_PATH.format("PostgresClient"))
+    def test_consume_messages_splits_batch_envelopes(self, mock_db_client, mock_rabbit_client, mock_migrate):
+        mock_db = mock_db_client.return_value
+
+        def consume_batches(queue_name, call_back, **kwargs):
+            call_back([make_delivery({"timers": [TEST_PAYLOAD] * 3})])
+            raise KeyboardInterrupt
+
+        mock_rabbit_client.return_value.consume_batches.side_effect = consume_batches
+
+        consume_messages()
+
+        assert mock_db.insert_many.call_args_list == [
+            mock.call(SQL_RECORD_TIMERS, [TEST_RECORD_ROW] * 2),
+            mock.call(SQL_RECORD_TIMERS, [TEST_RECORD_ROW]),
+        ]
+
+    @mock.patch(CONSUMER_PATH.format("CONSUMER_INSERT_METHOD"), "copy")
+    @mock.patch(CONSUMER_PATH.format("migrate"))
+    @mock.patch(CONSUMER_PATH.format("RabbitMQClient"))
+    @mock.patch(CONSUMER_PATH.format("PostgresClient"))
+    def test_consume_messages_copy(self, mock_db_client, mock_rabbit_client, mock_migrate):
+        mock_db = mock_db_client.return_value
+
+        def consume_batches(queue_name, call_back, **kwargs):
+            call_back([make_delivery(TEST_PAYLOAD)])
+            raise KeyboardInterrupt
+
+        mock_rabbit_client.return_value.consume_batches.side_effect = consume_batches
+
+        consume_messages()
+
+        mock_db.insert_many.assert_not_called()
+        mock_db.copy_and_run.assert_called_once_with(
+            TIMERS_STAGING_TABLE, TIMERS_STAGING_DEFINITION, RECORD_FIELDS, [TEST_RECORD_ROW], SQL_RECORD_STAGED_TIMERS
+        )
+
+    @mock.patch(CONSUMER_PATH.format("TIMER_DB_SHARDS"), "timer-db-1,timer-db-2:5433")
+    @mock.patch(CONSUMER_PATH.format("migrate"))
+    @mock.patch(CONSUMER_PATH.format("RabbitMQClient"))
+    @mock.patch(CONSUMER_PATH.format("PostgresClient"))
+    def test_consume_messages_sharded(self, mock_db_client, mock_rabbit_client, mock_migrate):
+        clients = {}
+        mock_db_client.side_effect = lambda host, port, **kwargs: clients.setdefault((host, port), mock.MagicMock())
+        payloads = [{**TEST_PAYLOAD, "id": str(uuid.UUID(int=i))} for i in range(20)]
+
+        def consume_batches(queue_name, call_back, **kwargs):
+            call_back([make_delivery({"timers": payloads})])
+            raise KeyboardInterrupt
+
+        mock_rabbit_client.return_value.consume_batches.side_effect = consume_batches
+
+        with mock.patch(CONSUMER_PATH.format("run_outbox_relay")) as mock_relay:
+            consume_messages()
+
+        assert mock_migrate.call_count == 3
+        query, rows = clients[("postgres", 5432)].insert_many.call_args.args
+        assert query == SQL_RECORD_TIMERS
+        ring = HashRing([Shard("timer-db-1", 5432), Shard("timer-db-2", 5433)])
+        assert [row[-1] for row in rows] == [ring.shard_for(payload["id"]).name for payload in payloads]
+        assert {row[-1] for row in rows} == {"timer-db-1:5432", "timer-db-2:5433"}
+        assert not clients[("timer-db-1", 5432)].method_calls
+        assert not clients[("timer-db-2", 5433)].method_calls
+        relay_kwargs = mock_relay.call_args.kwargs
+        assert relay_kwargs["postgres_client"] is clients[("postgres", 5432)]
+        shards = relay_kwargs["timer_db_router"].shards
+        assert [shard.name for shard in shards] == ["timer-db-1:5432", "timer-db-2:5433"]
+        assert relay_kwargs["stop"].is_set()
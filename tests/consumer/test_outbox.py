@@ -0,0 +1,168 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import threading
+import uuid
+from unittest import mock
+
+from consumer.outbox import (
+    SQL_DELETE_OUTBOX,
+    SQL_INSERT_TIMERS_TO_FIRE,
+    SQL_LOCK_OUTBOX,
+    SQL_LOCK_UNROUTED_OUTBOX,
+    SQL_ROUTE_OUTBOX,
+    relay_outbox,
+    relay_shard,
+    route_outbox,
+    run_outbox_relay,
+)
+from db.client import PostgresClientException
+from db.sharding import HashRing, Shard, ShardRouter
+
+TEST_FIRE_AT = "2024-12-01 10:01:02+00:00"
+TEST_URL = "http://example.com"
+TEST_TRACE = '{"id": "test-trace"}'
+OUTBOX_PATH = "consumer.outbox.{}"
+SHARDS = [Shard("timer-db-1", 5432), Shard("timer-db-2", 5432)]
+RING = HashRing(SHARDS)
+
+
+def make_outbox(count: int, shard_for=lambda timer_id: RING.shard_for(timer_id).name) -> dict[int, tuple]:
+    """Retrieves outbox rows by position, ids are routed by ``shard_for``."""
+    ids = [str(uuid.UUID(int=position)) for position in range(count)]
+    return {
+        position: (timer_id, TEST_FIRE_AT, TEST_URL, TEST_TRACE, shard_for(timer_id))
+        for position, timer_id in enumerate(ids)
+    }
+
+
+def make_postgres_client(outbox: dict[int, tuple]) -> mock.MagicMock:
+    """Retrieves a client whose transactions run the relay's queries against a given outbox."""
+    postgres_client = mock.MagicMock()
+    cursor = postgres_client.transaction.return_value.__enter__.return_value
+    locked: list[tuple] = []
+
+    def execute(query, params):
+        if query == SQL_LOCK_OUTBOX:
+            shard, limit = params
+            rows = [(position, *row[:-1]) for position, row in sorted(outbox.items()) if row[-1] == shard]
+            locked[:] = rows[:limit]
+        elif query == SQL_LOCK_UNROUTED_OUTBOX:
+            shards, limit = params
+            rows = [(position, row[0]) for position, row in sorted(outbox.items()) if row[-1] not in shards]
+            locked[:] = rows[:limit]
+        elif query == SQL_DELETE_OUTBOX:
+            for position in params[0]:
+                del outbox[position]
+        elif query == SQL_ROUTE_OUTBOX:
+            shard, positions = params
+            for position in positions:
+                outbox[position] = (*outbox[position][:-1], shard)
+        else:
+            raise AssertionError(f"Unexpected query: {query}")
+
+    cursor.execute.side_effect = execute
+    cursor.fetchall.side_effect = lambda: list(locked)
+    return postgres_client
+
+
+def make_router() -> tuple[ShardRouter, dict[Shard, mock.MagicMock]]:
+    clients = {shard: mock.MagicMock() for shard in SHARDS}
+    return ShardRouter(RING, clients.__getitem__), clients
+
+
+def relayed_ids(client: mock.MagicMock) -> list[str]:
+    return [row[0] for call in client.insert_many.call_args_list for row in call.args[1]]
+
+
+class TestOutbox:
+    def test_relay_outbox(self):
+        outbox = make_outbox(20)
+        expected = {shard: [row[0] for row in outbox.values() if row[-1] == shard.name] for shard in SHARDS}
+        router, clients = make_router()
+
+        assert relay_outbox(make_postgres_client(outbox), router, limit=100) == 20
+
+        assert outbox == {}
+        for shard, client in clients.items():
+            assert client.insert_many.call_args.args[0] == SQL_INSERT_TIMERS_TO_FIRE
+            assert relayed_ids(client) == expected[shard]
+
+    def test_relay_shard_copy(self):
+        outbox = make_outbox(1, shard_for=lambda timer_id: SHARDS[0].name)
+        row = outbox[0]
+        router, clients = make_router()
+
+        assert relay_shard(make_postgres_client(outbox), router, SHARDS[0], limit=100, insert_method="copy") == 1
+
+        clients[SHARDS[0]].copy_rows.assert_called_once_with(
+            "timers_to_fire", ("id", "fire_at", "url", "trace"), [row[:-1]], on_conflict="ON CONFLICT DO NOTHING"
+        )
+        assert outbox == {}
+
+    def test_relay_shard_empty(self):
+        router, clients = make_router()
+
+        assert relay_shard(make_postgres_client({}), router, SHARDS[0], limit=100) == 0
+
+        assert not clients[SHARDS[0]].method_calls
+
+    def test_relay_outbox_failed_shard_holds_up_no_other(self):
+        failed, healthy = SHARDS
+        # Rows of the failed shard come first and outnumber the limit, so they fill every batch if mixed with others.
+        outbox = make_outbox(30, shard_for=lambda timer_id: failed.name)
+        outbox.update({
+            position: (str(uuid.UUID(int=position)), TEST_FIRE_AT, TEST_URL, TEST_TRACE, healthy.name)
+            for position in range(30, 40)
+        })
+        postgres_client = make_postgres_client(outbox)
+        router, clients = make_router()
+        clients[failed].insert_many.side_effect = PostgresClientException
+
+        relayed = [relay_outbox(postgres_client, router, limit=4) for _ in range(4)]
+
+        assert relayed == [4, 4, 2, 0]
+        assert relayed_ids(clients[healthy]) == [str(uuid.UUID(int=position)) for position in range(30, 40)]
+        assert sorted(outbox) == list(range(30))
+        assert clients[failed].insert_many.call_count == 4
+        assert clients[failed].close.call_count == 4
+
+    def test_route_outbox(self):
+        outbox = make_outbox(7, shard_for=lambda timer_id: "removed-db:5432")
+        outbox[7] = (str(uuid.UUID(int=7)), TEST_FIRE_AT, TEST_URL, TEST_TRACE, SHARDS[0].name)
+        router, clients = make_router()
+
+        assert route_outbox(make_postgres_client(outbox), router, limit=3) == 7
+
+        assert {position: row[-1] for position, row in outbox.items()} == {
+            position: RING.shard_for(row[0]).name for position, row in outbox.items()
+        }
+        assert not any(client.method_calls for client in clients.values())
+
+    @mock.patch(OUTBOX_PATH.format("route_outbox"))
+    @mock.patch(OUTBOX_PATH.format("relay_outbox"))
+    def test_run_outbox_relay(self, mock_relay, mock_route):
+        postgres_client, router, stop = mock.MagicMock(), mock.MagicMock(), mock.MagicMock(spec=threading.Event)
+        stop.is_set.side_effect = [False, False, False, False, False, True]
+        mock_route.side_effect = [PostgresClientException, 0]
+        mock_relay.side_effect = [10, PostgresClientException, 3]
+
+        run_outbox_relay(postgres_client, router, stop, batch_size=10, interval=0.1)
+
+        assert mock_route.call_args_list == [mock.call(postgres_client, router, limit=10)] * 2
+        assert mock_relay.call_args_list == [
+            mock.call(postgres_client, router, limit=10, insert_method="values"),
+        ] * 3
+        assert postgres_client.close.call_count == 2
+        assert stop.wait.call_args_list == [mock.call(1), mock.call(1), mock.call(0.1)]
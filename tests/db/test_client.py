@@ -17,7 +17,15 @@ from unittest import mock
 import psycopg2
 import pytest
 
-from db.client import PostgresClient, PostgresClientException
+from db.client import (
+    CopyRowsReader,
+    PostgresClient,
+    PostgresClientException,
+    PostgresConnectionPool,
+    Statement,
+    to_server_placeholders,
+)
+from tests.db.utils import render
 
 TEST_HOST = 'test-host'
 TEST_PORT = 80
@@ -41,6 +49,11 @@ ADD COLUMN hire_date DATE;
 TEST_QUERY_DROP = "DROP TABLE salary;"
 TEST_QUERY_TRUNCATE = "TRUNCATE TABLE employees;"
 TEST_QUERY_SELECT = "SELECT * FROM employees;"
+TEST_QUERY_RETURNING = "DELETE FROM employees WHERE salary > 100 RETURNING id;"
+TEST_QUERY_INSERT = "INSERT INTO employees (name) VALUES ('Guest');"
+TEST_QUERY_INSERT_RETURNING_LITERAL = "INSERT INTO employees (name) VALUES ('Returning Guest');"
+TEST_QUERY_CREATE_URL = "INSERT INTO timers (url) VALUES ('http://example.com/CREATE');"
+TEST_QUERY_SELECT_COMMENTED = "-- all of them\nSELECT * FROM employees;"
 CLIENT_PATH = "db.client.{}"
 
 class TestPostgresClient:
@@ -84,42 +97,32 @@ class TestPostgresClient:
         )
 
     @pytest.mark.parametrize(
-        "query, is_ddl, fetch_result, expected_results",
+        "returns_rows, expected_results",
         [
-            (TEST_QUERY, True, None, [None]),
-            (TEST_QUERY, False, EXPECTED_RESULT, [EXPECTED_RESULT]),
+            (False, [None]),
+            (True, [EXPECTED_RESULT]),
         ]
     )
-    @mock.patch(CLIENT_PATH.format("PostgresClient.is_dql_query"))
-    @mock.patch(CLIENT_PATH.format("PostgresClient.is_ddl_query"))
-    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
-    def test_run_queries(
-        self,
-        mock_connect,
-        mock_is_ddl_query,
-        mock_is_dql_query,
-        query,
-        is_ddl,
-        fetch_result,
-        expected_results,
-    ):
-        mock_is_ddl_query.return_value = is_ddl
-        mock_is_dql_query.return_value = not is_ddl
-        commits_count = 2 if is_ddl else 1
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_run_queries(self, mock_connect, returns_rows, expected_results):
         mock_cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
-        mock_cursor.fetchall.return_value = fetch_result
+        mock_cursor.description = mock.MagicMock() if returns_rows else None
+        mock_cursor.fetchall.return_value = EXPECTED_RESULT
 
-        results = self.client.run_queries([query])
+        results = self.client.run_queries([TEST_QUERY])
 
         assert expected_results == results
         mock_connect.return_value.cursor.assert_called_once()
-        mock_cursor.execute.assert_called_once_with(query)
-        mock_is_ddl_query.assert_called_once_with(query)
-        mock_is_dql_query.assert_called_once_with(query)
+        mock_cursor.execute.assert_called_once_with(TEST_QUERY)
+        mock_connect.return_value.commit.assert_called_once()
+        assert mock_cursor.fetchall.call_count == int(returns_rows)
+
+    @pytest.mark.parametrize("single_transaction, commits_count", [(False, 2), (True, 1)])
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_run_queries_single_transaction(self, mock_connect, single_transaction, commits_count):
+        self.client.run_queries([TEST_QUERY, TEST_QUERY], single_transaction=single_transaction)
 
         assert mock_connect.return_value.commit.call_count == commits_count
-        if not is_ddl:
-            mock_cursor.fetchall.assert_called_once()
 
     @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
     def test_run_queries_exception(self, mock_connect):
@@ -130,6 +133,49 @@ class TestPostgresClient:
             self.client.run_queries([TEST_QUERY])
 
         mock_execute.assert_called_once_with(TEST_QUERY)
+        mock_connect.return_value.rollback.assert_called_once()
+        mock_connect.return_value.commit.assert_not_called()
+
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_transaction(self, mock_connect):
+        with self.client.transaction() as cur:
+            cur.execute(TEST_QUERY)
+            cur.execute(TEST_QUERY)
+
+        mock_connect.return_value.commit.assert_called_once()
+        mock_connect.return_value.rollback.assert_not_called()
+
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_transaction_exception(self, mock_connect):
+        mock_cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        mock_cursor.execute.side_effect = [None, psycopg2.Error]
+
+        with pytest.raises(PostgresClientException):
+            with self.client.transaction() as cur:
+                cur.execute(TEST_QUERY)
+                cur.execute(TEST_QUERY)
+
+        mock_connect.return_value.commit.assert_not_called()
+        mock_connect.return_value.rollback.assert_called_once()
+
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_run_pipeline(self, mock_connect):
+        mock_cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        executed = []
+        mock_cursor.execute.side_effect = lambda query, params=None: executed.append(render(query))
+        mock_cursor.mogrify.side_effect = lambda query, params: (render(query) % tuple(params or ())).encode()
+
+        result = self.client.run_pipeline([
+            Statement("DELETE FROM employees WHERE id = %s", (1,)),
+            Statement("SELECT %s", (2,), name="test_pipelined_statement"),
+        ])
+
+        assert result == mock_cursor.fetchall.return_value
+        assert executed == [
+            "PREPARE test_pipelined_statement AS SELECT $1",
+            b"DELETE FROM employees WHERE id = 1;\nEXECUTE test_pipelined_statement (2)",
+        ]
+        mock_connect.return_value.commit.assert_called_once()
 
     @pytest.mark.parametrize(
         "query, expected_value",
@@ -139,7 +185,7 @@ class TestPostgresClient:
             (TEST_QUERY_DROP, True),
             (TEST_QUERY_TRUNCATE, True),
             (TEST_QUERY_SELECT, False),
-
+            (TEST_QUERY_CREATE_URL, False),
         ]
     )
     def test_is_ddl_query(self, query, expected_value):
@@ -154,9 +200,298 @@ class TestPostgresClient:
             (TEST_QUERY_DROP, False),
             (TEST_QUERY_TRUNCATE, False),
             (TEST_QUERY_SELECT, True),
-
+            (TEST_QUERY_RETURNING, True),
+            (TEST_QUERY_INSERT, False),
+            (TEST_QUERY_INSERT_RETURNING_LITERAL, False),
+            (TEST_QUERY_SELECT_COMMENTED, True),
         ]
     )
     def test_is_dql_query(self, query, expected_value):
         result = self.client.is_dql_query(query)
         assert result == expected_value
+
+    @mock.patch(CLIENT_PATH.format("execute_values"))
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_insert_many(self, mock_connect, mock_execute_values):
+        rows = [(1, "a"), (2, "b")]
+        mock_cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+
+        self.client.insert_many(TEST_QUERY, rows)
+
+        mock_execute_values.assert_called_once_with(mock_cursor, TEST_QUERY, rows, page_size=len(rows))
+        mock_connect.return_value.commit.assert_called_once()
+
+    @mock.patch(CLIENT_PATH.format("execute_values"))
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_insert_many_exception(self, mock_connect, mock_execute_values):
+        mock_execute_values.side_effect = psycopg2.Error
+
+        with pytest.raises(PostgresClientException):
+            self.client.insert_many(TEST_QUERY, [(1, "a")])
+
+        mock_connect.return_value.commit.assert_not_called()
+        mock_connect.return_value.rollback.assert_called_once()
+
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_run_query(self, mock_connect):
+        mock_cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+
+        result = self.client.run_query(TEST_QUERY, ("it's",))
+
+        assert result == mock_cursor.fetchall.return_value
+        mock_cursor.execute.assert_called_once_with(TEST_QUERY, ("it's",))
+        mock_connect.return_value.commit.assert_called_once()
+
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_run_query_without_rows(self, mock_connect):
+        mock_cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        mock_cursor.description = None
+
+        assert self.client.run_query(TEST_QUERY) is None
+        mock_cursor.fetchall.assert_not_called()
+
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_run_prepared(self, mock_connect):
+        mock_cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        executed = []
+        mock_cursor.execute.side_effect = lambda query, params=None: executed.append(render(query))
+
+        self.client.run_prepared("test_statement", "SELECT %s, %s", (1, 2))
+        result = self.client.run_prepared("test_statement", "SELECT %s, %s", (3, 4))
+
+        assert result == mock_cursor.fetchall.return_value
+        assert executed == [
+            "PREPARE test_statement AS SELECT $1, $2",
+            "EXECUTE test_statement (%s, %s)",
+            "EXECUTE test_statement (%s, %s)",
+        ]
+        assert mock_cursor.execute.call_args.args[1] == (3, 4)
+        assert mock_connect.return_value.commit.call_count == 2
+
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_run_prepared_exception(self, mock_connect):
+        mock_cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        mock_cursor.execute.side_effect = psycopg2.Error
+
+        with pytest.raises(PostgresClientException):
+            self.client.run_prepared("test_statement", TEST_QUERY)
+
+        mock_connect.return_value.commit.assert_not_called()
+
+    @mock.patch(CLIENT_PATH.format("execute_batch"))
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_execute_many(self, mock_connect, mock_execute_batch):
+        params_list = [(1, "a"), (2, "b")]
+        mock_cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+
+        self.client.execute_many(TEST_QUERY, params_list)
+
+        mock_execute_batch.assert_called_once_with(mock_cursor, TEST_QUERY, params_list, page_size=100)
+        mock_connect.return_value.commit.assert_called_once()
+
+    @mock.patch(CLIENT_PATH.format("execute_batch"))
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_execute_many_exception(self, mock_connect, mock_execute_batch):
+        mock_execute_batch.side_effect = psycopg2.Error
+
+        with pytest.raises(PostgresClientException):
+            self.client.execute_many(TEST_QUERY, [(1, "a")])
+
+        mock_connect.return_value.commit.assert_not_called()
+        mock_connect.return_value.rollback.assert_called_once()
+
+    @pytest.mark.parametrize("on_conflict", [None, "ON CONFLICT DO NOTHING"])
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_copy_rows(self, mock_connect, on_conflict):
+        mock_cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        executed = []
+        mock_cursor.execute.side_effect = lambda query: executed.append(render(query))
+        copied = []
+        mock_cursor.copy_expert.side_effect = lambda query, file: copied.append((render(query), file.read()))
+
+        self.client.copy_rows("employees", ["id", "name"], iter([(1, "Guest"), (2, None)]), on_conflict)
+
+        if on_conflict is None:
+            assert executed == []
+            assert copied == [("COPY employees (id, name) FROM STDIN", "1\tGuest\n2\t\\N\n")]
+        else:
+            assert executed == [
+                "CREATE TEMPORARY TABLE employees_copy (LIKE employees) ON COMMIT DROP",
+                "INSERT INTO employees (id, name) SELECT id, name FROM employees_copy ON CONFLICT DO NOTHING",
+            ]
+            assert copied == [("COPY employees_copy (id, name) FROM STDIN", "1\tGuest\n2\t\\N\n")]
+        mock_connect.return_value.commit.assert_called_once()
+
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_copy_rows_exception(self, mock_connect):
+        mock_cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        mock_cursor.copy_expert.side_effect = psycopg2.Error
+
+        with pytest.raises(PostgresClientException):
+            self.client.copy_rows("employees", ["id"], [(1,)])
+
+        mock_connect.return_value.commit.assert_not_called()
+        mock_connect.return_value.rollback.assert_called_once()
+
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_copy_and_run(self, mock_connect):
+        mock_cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        executed = []
+        mock_cursor.execute.side_effect = lambda query: executed.append(render(query))
+        copied = []
+        mock_cursor.copy_expert.side_effect = lambda query, file: copied.append((render(query), file.read()))
+
+        self.client.copy_and_run(
+            "staged", "(id INTEGER, name TEXT)", ["id", "name"], [(1, "Guest")],
+            "INSERT INTO employees SELECT * FROM staged",
+        )
+
+        assert executed == [
+            "CREATE TEMPORARY TABLE staged (id INTEGER, name TEXT) ON COMMIT DROP",
+            "INSERT INTO employees SELECT * FROM staged",
+        ]
+        assert copied == [("COPY staged (id, name) FROM STDIN", "1\tGuest\n")]
+        mock_connect.return_value.commit.assert_called_once()
+
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_copy_and_run_exception(self, mock_connect):
+        mock_cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        mock_cursor.execute.side_effect = [None, psycopg2.Error]
+
+        with pytest.raises(PostgresClientException):
+            self.client.copy_and_run("staged", "(id INTEGER)", ["id"], [(1,)], "SELECT 1")
+
+        mock_connect.return_value.commit.assert_not_called()
+        mock_connect.return_value.rollback.assert_called_once()
+
+    @pytest.mark.parametrize(
+        "error, expected_value",
+        [(psycopg2.DataError, True), (psycopg2.IntegrityError, True), (psycopg2.OperationalError, False)],
+    )
+    @mock.patch(CLIENT_PATH.format("execute_values"))
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_is_data_error(self, mock_connect, mock_execute_values, error, expected_value):
+        mock_execute_values.side_effect = error
+
+        with pytest.raises(PostgresClientException) as exc_info:
+            self.client.insert_many(TEST_QUERY, [(1, "a")])
+
+        assert exc_info.value.is_data_error is expected_value
+
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_close(self, mock_connect):
+        _ = self.client.connection
+
+        self.client.close()
+        _ = self.client.connection
+
+        mock_connect.return_value.close.assert_called_once()
+        assert mock_connect.call_count == 2
+
+
+def test_to_server_placeholders():
+    assert to_server_placeholders("SELECT %s WHERE a LIKE 'x%%' AND b = %s") == "SELECT $1 WHERE a LIKE 'x%' AND b = $2"
+
+
+def test_copy_rows_reader():
+    reader = CopyRowsReader([(1, "tab\there", None), (2, "back\\slash\nnew line", "")])
+
+    assert reader.read(4) + reader.read() == "1\ttab\\there\t\\N\n2\tback\\\\slash\\nnew line\t\n"
+    assert reader.read(8192) == ""
+
+
+class TestPostgresConnectionPool:
+    def setup_method(self):
+        self.pool = PostgresConnectionPool(
+            host=TEST_HOST,
+            port=TEST_PORT,
+            database=TEST_DATABASE,
+            user=TEST_USER,
+            password=TEST_PASSWORD,
+            max_size=2,
+            min_size=0,
+            acquire_timeout=0,
+        )
+
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_connection_reused(self, mock_connect):
+        mock_connect.return_value.closed = 0
+
+        with self.pool.connection() as first:
+            pass
+        with self.pool.connection() as second:
+            pass
+
+        assert first is second
+        mock_connect.assert_called_once()
+        assert self.pool.size == 1
+
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_max_size(self, mock_connect):
+        mock_connect.side_effect = lambda **kwargs: mock.MagicMock(closed=0)
+
+        with self.pool.connection(), self.pool.connection():
+            with pytest.raises(PostgresClientException):
+                self.pool.acquire()
+
+        assert mock_connect.call_count == 2
+
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_broken_connection_discarded(self, mock_connect):
+        mock_connect.side_effect = lambda **kwargs: mock.MagicMock(closed=0)
+
+        with self.pool.connection() as first:
+            first.closed = 2
+        with self.pool.connection() as second:
+            pass
+
+        assert first is not second
+        assert self.pool.size == 1
+
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_connect_exception(self, mock_connect):
+        mock_connect.side_effect = psycopg2.Error
+
+        with pytest.raises(PostgresClientException):
+            self.pool.acquire()
+
+        assert self.pool.size == 0
+
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_evict_idle(self, mock_connect):
+        mock_connect.return_value.closed = 0
+        self.pool.max_idle = 0
+
+        with self.pool.connection():
+            pass
+
+        mock_connect.return_value.close.assert_called_once()
+        assert self.pool.size == 0
+
+    @mock.patch(CLIENT_PATH.format("psycopg2.connect"))
+    def test_pooled_client(self, mock_connect):
+        mock_connect.return_value.closed = 0
+        mock_cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        client = PostgresClient(
+            host="pooled-host",
+            port=TEST_PORT,
+            database=TEST_DATABASE,
+            user=TEST_USER,
+            password=TEST_PASSWORD,
+            pool_size=2,
+        )
+        other_client = PostgresClient(
+            host="pooled-host",
+            port=TEST_PORT,
+            database=TEST_DATABASE,
+            user=TEST_USER,
+            password=TEST_PASSWORD,
+            pool_size=2,
+        )
+
+        client.run_queries([TEST_QUERY_SELECT])
+        other_client.run_queries([TEST_QUERY_SELECT])
+
+        assert client.pool is other_client.pool
+        mock_connect.assert_called_once()
+        assert mock_cursor.execute.call_count == 2
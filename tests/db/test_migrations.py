@@ -0,0 +1,68 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from unittest import mock
+
+import psycopg2
+import pytest
+
+from db.client import PostgresClientException
+from db.migrations import (
+    MIGRATIONS_LOCK_ID,
+    SQL_INSERT_APPLIED_MIGRATION,
+    SQL_LOCK_MIGRATIONS,
+    Migration,
+    migrate,
+)
+
+TEST_COMPONENT = "test-component"
+TEST_MIGRATIONS = [
+    Migration(2, "second", ["query-2"]),
+    Migration(1, "first", ["query-1a", "query-1b"]),
+]
+
+
+class TestMigrate:
+    def setup_method(self):
+        self.db_client = mock.MagicMock()
+        self.connection = self.db_client.connect.return_value.__enter__.return_value
+        self.cursor = self.connection.cursor.return_value.__enter__.return_value
+
+    def test_migrate(self):
+        self.cursor.fetchall.return_value = []
+
+        applied = migrate(self.db_client, component=TEST_COMPONENT, migrations=TEST_MIGRATIONS)
+
+        assert applied == [1, 2]
+        executed = [call.args[0] for call in self.cursor.execute.call_args_list]
+        assert executed[0] == SQL_LOCK_MIGRATIONS
+        assert self.cursor.execute.call_args_list[0].args[1] == (MIGRATIONS_LOCK_ID,)
+        assert executed[3:] == [
+            "query-1a", "query-1b", SQL_INSERT_APPLIED_MIGRATION, "query-2", SQL_INSERT_APPLIED_MIGRATION,
+        ]
+
+    def test_migrate_skips_applied(self):
+        self.cursor.fetchall.return_value = [(1,)]
+
+        applied = migrate(self.db_client, component=TEST_COMPONENT, migrations=TEST_MIGRATIONS)
+
+        assert applied == [2]
+        executed = [call.args[0] for call in self.cursor.execute.call_args_list]
+        assert "query-1a" not in executed
+
+    def test_migrate_exception(self):
+        self.cursor.execute.side_effect = psycopg2.Error
+
+        with pytest.raises(PostgresClientException):
+            migrate(self.db_client, component=TEST_COMPONENT, migrations=TEST_MIGRATIONS)
@@ -0,0 +1,89 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from unittest import mock
+
+import psycopg2
+import pytest
+
+from db.client import PostgresClientException
+from db.notifications import NotificationListener, wait_for_notifications
+from tests.db.utils import render
+
+NOTIFICATIONS_PATH = "db.notifications.{}"
+
+
+def make_listener() -> NotificationListener:
+    return NotificationListener(
+        host="timer-db", port=5432, database="postgres", user="postgres", password="postgres", channel="timers_to_fire",
+    )
+
+
+class TestNotificationListener:
+    @mock.patch(NOTIFICATIONS_PATH.format("psycopg2.connect"))
+    def test_listen(self, mock_connect):
+        connection = mock_connect.return_value
+        connection.fileno.return_value = 42
+        listener = make_listener()
+
+        assert listener.fileno() == 42
+        assert listener.fileno() == 42
+
+        mock_connect.assert_called_once()
+        assert connection.autocommit is True
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.execute.assert_called_once()
+        assert render(cursor.execute.call_args.args[0]) == "LISTEN timers_to_fire"
+
+    @mock.patch(NOTIFICATIONS_PATH.format("psycopg2.connect"))
+    def test_listen_exception(self, mock_connect):
+        mock_connect.side_effect = psycopg2.Error
+
+        with pytest.raises(PostgresClientException):
+            make_listener().fileno()
+
+    @mock.patch(NOTIFICATIONS_PATH.format("psycopg2.connect"))
+    def test_poll(self, mock_connect):
+        connection = mock_connect.return_value
+        connection.notifies = [mock.MagicMock(payload="1.5"), mock.MagicMock(payload="2.5")]
+        listener = make_listener()
+
+        assert listener.poll() == ["1.5", "2.5"]
+        assert listener.poll() == []
+        connection.poll.assert_called()
+
+    @mock.patch(NOTIFICATIONS_PATH.format("psycopg2.connect"))
+    def test_poll_reconnects_broken_connection(self, mock_connect):
+        broken, reopened = mock.MagicMock(), mock.MagicMock(notifies=[])
+        broken.poll.side_effect = psycopg2.OperationalError
+        mock_connect.side_effect = [broken, reopened]
+        listener = make_listener()
+
+        with pytest.raises(PostgresClientException):
+            listener.poll()
+
+        broken.close.assert_called_once()
+        assert listener.poll() == []
+        assert mock_connect.call_count == 2
+
+    @mock.patch(NOTIFICATIONS_PATH.format("select.select"))
+    def test_wait_for_notifications(self, mock_select):
+        listeners = [mock.MagicMock(), mock.MagicMock(), mock.MagicMock()]
+        listeners[0].poll.return_value = ["1.5"]
+        listeners[2].poll.return_value = ["2.5", "3.5"]
+        mock_select.return_value = ([listeners[2], listeners[0]], [], [])
+
+        assert wait_for_notifications(listeners, 5) == [(0, "1.5"), (2, "2.5"), (2, "3.5")]
+
+        mock_select.assert_called_once_with(listeners, [], [], 5)
+        listeners[1].poll.assert_not_called()
@@ -0,0 +1,91 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import uuid
+from unittest import mock
+
+import pytest
+
+from db.ownership import (
+    SQL_ACQUIRE_SLOTS,
+    SQL_COUNT_DISPATCHERS,
+    SQL_RELEASE_SLOTS,
+    SQL_RENEW_SLOTS,
+    SlotOwnership,
+    timer_slot,
+)
+
+OWNERSHIP_PATH = "db.ownership.{}"
+
+
+class TestSlotOwnership:
+    def setup_method(self):
+        self.db_client = mock.MagicMock()
+        self.cursor = self.db_client.transaction.return_value.__enter__.return_value
+        self.results = {}
+        self.cursor.execute.side_effect = lambda query, params=None: setattr(
+            self.cursor, "rows", self.results.get(query, []),
+        )
+        self.cursor.fetchall.side_effect = lambda: self.cursor.rows
+        self.ownership = SlotOwnership(self.db_client, owner="timer-1", slots=8, lease=15)
+
+    def executed(self, query: str) -> list[tuple]:
+        return [call.args[1] for call in self.cursor.execute.call_args_list if call.args[0] == query]
+
+    def test_heartbeat_acquires_share(self):
+        self.results = {SQL_COUNT_DISPATCHERS: [(3,)], SQL_RENEW_SLOTS: [(1,)], SQL_ACQUIRE_SLOTS: [(6,), (4,)]}
+
+        assert self.ownership.heartbeat() == [1, 4, 6]
+
+        assert self.executed(SQL_ACQUIRE_SLOTS) == [("timer-1", 15, 8, 2)]
+        assert self.executed(SQL_RELEASE_SLOTS) == []
+        assert self.ownership.owned == [1, 4, 6]
+
+    def test_heartbeat_releases_above_share(self):
+        self.results = {SQL_COUNT_DISPATCHERS: [(2,)], SQL_RENEW_SLOTS: [(slot,) for slot in (9, 5, 0, 1, 2, 3, 4)]}
+
+        assert self.ownership.heartbeat() == [0, 1, 2, 3]
+
+        assert self.executed(SQL_RELEASE_SLOTS) == [("timer-1", [9, 4, 5])]
+        assert self.executed(SQL_ACQUIRE_SLOTS) == []
+
+    def test_owned_expires(self):
+        self.results = {SQL_COUNT_DISPATCHERS: [(1,)], SQL_ACQUIRE_SLOTS: [(0,)]}
+
+        with mock.patch(OWNERSHIP_PATH.format("monotonic"), return_value=100):
+            self.ownership.heartbeat()
+        assert self.ownership.renewed_at == 100
+        with mock.patch(OWNERSHIP_PATH.format("monotonic"), return_value=114):
+            assert self.ownership.owned == [0]
+        with mock.patch(OWNERSHIP_PATH.format("monotonic"), return_value=115):
+            assert self.ownership.owned == []
+
+    def test_release(self):
+        self.results = {SQL_COUNT_DISPATCHERS: [(1,)], SQL_ACQUIRE_SLOTS: [(0,)]}
+        self.ownership.heartbeat()
+
+        self.ownership.release()
+
+        assert self.ownership.owned == []
+        assert [call.args[1] for call in self.cursor.execute.call_args_list[-2:]] == [("timer-1",), ("timer-1",)]
+
+    @pytest.mark.parametrize("slots", [0, 65537])
+    def test_invalid_slots(self, slots):
+        with pytest.raises(ValueError):
+            SlotOwnership(self.db_client, owner="timer-1", slots=slots, lease=15)
+
+    def test_timer_slot(self):
+        timer_id = uuid.UUID("00000000-0000-4000-8000-000000000102")
+
+        assert timer_slot(timer_id, 1024) == 258
+        assert timer_slot(str(timer_id), 256) == 2
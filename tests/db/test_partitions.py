@@ -0,0 +1,81 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from datetime import datetime, timedelta, UTC
+from unittest import mock
+
+import psycopg2
+import pytest
+
+from db.client import PostgresClientException
+from db.partitions import (
+    bucket_start,
+    maintain_partitions,
+    partition_bounds,
+    partition_name,
+)
+from tests.db.utils import render
+
+TEST_NOW = datetime(2024, 12, 1, 10, 30, tzinfo=UTC)
+TEST_INTERVAL = timedelta(hours=1)
+
+
+class TestPartitions:
+    def setup_method(self):
+        self.db_client = mock.MagicMock()
+        connection = self.db_client.connect.return_value.__enter__.return_value
+        self.cursor = connection.cursor.return_value.__enter__.return_value
+
+    def executed(self) -> list[str]:
+        return [render(call.args[0]) for call in self.cursor.execute.call_args_list]
+
+    def test_bucket_start(self):
+        assert bucket_start(TEST_NOW, TEST_INTERVAL) == datetime(2024, 12, 1, 10, tzinfo=UTC)
+        assert bucket_start(TEST_NOW, timedelta(days=1)) == datetime(2024, 12, 1, tzinfo=UTC)
+
+    def test_partition_name_and_bounds(self):
+        start, end = datetime(2024, 12, 1, 10, tzinfo=UTC), datetime(2024, 12, 1, 11, tzinfo=UTC)
+
+        name = partition_name(start, end)
+
+        assert name == "timers_to_fire_p202412011000_202412011100"
+        assert partition_bounds(name) == (start, end)
+        assert partition_bounds("timers_to_fire_default") is None
+        assert partition_bounds("timers_to_fire_pbroken") is None
+
+    def test_maintain_partitions(self):
+        existing = partition_name(datetime(2024, 12, 1, 10, tzinfo=UTC), datetime(2024, 12, 1, 11, tzinfo=UTC))
+        drained = partition_name(datetime(2024, 12, 1, 8, tzinfo=UTC), datetime(2024, 12, 1, 9, tzinfo=UTC))
+        pending = partition_name(datetime(2024, 12, 1, 9, tzinfo=UTC), datetime(2024, 12, 1, 10, tzinfo=UTC))
+        self.cursor.fetchall.return_value = [(existing,), (drained,), (pending,), ("timers_to_fire_default",)]
+        self.cursor.fetchone.side_effect = [(False,), (True,)]
+
+        created, dropped = maintain_partitions(self.db_client, interval=TEST_INTERVAL, ahead=1, now=TEST_NOW)
+
+        assert created == ["timers_to_fire_p202412011100_202412011200"]
+        assert dropped == [drained]
+        executed = self.executed()
+        assert any("ATTACH PARTITION" in query and created[0] in query for query in executed)
+        assert any(query == f"DROP TABLE {drained}" for query in executed)
+        assert not any(query == f"DROP TABLE {pending}" for query in executed)
+
+    def test_maintain_partitions_exception(self):
+        self.cursor.execute.side_effect = psycopg2.Error
+
+        with pytest.raises(PostgresClientException):
+            maintain_partitions(self.db_client, interval=TEST_INTERVAL, ahead=1, now=TEST_NOW)
+
+    def test_maintain_partitions_invalid_interval(self):
+        with pytest.raises(ValueError):
+            maintain_partitions(self.db_client, interval=timedelta(seconds=1), ahead=1, now=TEST_NOW)
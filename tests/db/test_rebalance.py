@@ -0,0 +1,83 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import uuid
+from unittest import mock
+
+from db.rebalance import (
+    MIN_TIMER_ID,
+    SQL_INSERT_TIMERS_TO_FIRE,
+    SQL_SELECT_TIMER_IDS,
+    SQL_TAKE_TIMERS,
+    move_timers,
+    rebalance,
+)
+from db.sharding import HashRing, Shard, ShardRouter
+
+TEST_SOURCE = Shard("timer-db-1", 5432)
+TEST_TARGET = Shard("timer-db-2", 5432)
+
+
+class TestRebalance:
+    def test_move_timers(self):
+        source, target = mock.MagicMock(), mock.MagicMock()
+        cur = source.transaction.return_value.__enter__.return_value
+        rows = [("id-1", "fire-at", "url", '{"traceparent": "00-trace-span-01"}'), ("id-2", "fire-at", "url", None)]
+        cur.fetchall.return_value = rows
+
+        assert move_timers(source, target, ["id-1", "id-2"]) == 2
+
+        cur.execute.assert_called_once_with(SQL_TAKE_TIMERS, (["id-1", "id-2"],))
+        target.insert_many.assert_called_once_with(SQL_INSERT_TIMERS_TO_FIRE, rows)
+        assert "trace::text" in SQL_TAKE_TIMERS
+        assert "(id, fire_at, url, trace)" in SQL_INSERT_TIMERS_TO_FIRE
+
+    def test_move_claimed_timers(self):
+        source, target = mock.MagicMock(), mock.MagicMock()
+        source.transaction.return_value.__enter__.return_value.fetchall.return_value = []
+
+        assert move_timers(source, target, ["id-1"]) == 0
+
+        target.insert_many.assert_not_called()
+
+    @mock.patch("db.rebalance.move_timers")
+    def test_rebalance_drains_removed_shard(self, mock_move_timers):
+        clients = {TEST_SOURCE: mock.MagicMock(), TEST_TARGET: mock.MagicMock()}
+        router = ShardRouter(HashRing([TEST_TARGET]), clients.__getitem__)
+        ids = sorted(str(uuid.uuid4()) for _ in range(3))
+        clients[TEST_SOURCE].run_query.side_effect = [[(ids[0],), (ids[1],)], [(ids[2],)], []]
+        mock_move_timers.side_effect = lambda source, target, batch: len(batch)
+
+        moved = rebalance(router, sources=[TEST_SOURCE], batch_size=2)
+
+        assert moved == 3
+        clients[TEST_SOURCE].run_query.assert_has_calls([
+            mock.call(SQL_SELECT_TIMER_IDS, (MIN_TIMER_ID, 2)),
+            mock.call(SQL_SELECT_TIMER_IDS, (ids[1], 2)),
+            mock.call(SQL_SELECT_TIMER_IDS, (ids[2], 2)),
+        ])
+        mock_move_timers.assert_has_calls([
+            mock.call(clients[TEST_SOURCE], clients[TEST_TARGET], ids[:2]),
+            mock.call(clients[TEST_SOURCE], clients[TEST_TARGET], ids[2:]),
+        ])
+
+    @mock.patch("db.rebalance.move_timers")
+    def test_rebalance_keeps_owned_timers(self, mock_move_timers):
+        client = mock.MagicMock()
+        router = ShardRouter(HashRing([TEST_SOURCE]), lambda shard: client)
+        client.run_query.side_effect = [[(str(uuid.uuid4()),)], []]
+
+        assert rebalance(router, sources=[TEST_SOURCE]) == 0
+
+        mock_move_timers.assert_not_called()
@@ -0,0 +1,67 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import uuid
+from collections import Counter
+from unittest import mock
+
+import pytest
+
+from db.sharding import HashRing, Shard, ShardRouter, parse_shards
+
+TEST_SHARDS = [Shard("timer-db-1", 5432), Shard("timer-db-2", 5432), Shard("timer-db-3", 5432)]
+TEST_IDS = [str(uuid.UUID(int=i * 7919)) for i in range(3000)]
+
+
+class TestSharding:
+    def test_parse_shards(self):
+        assert parse_shards(" timer-db-1, timer-db-2:5433,") == [Shard("timer-db-1", 5432), Shard("timer-db-2", 5433)]
+        assert parse_shards("") == []
+
+    def test_parse_shards_duplicated(self):
+        with pytest.raises(ValueError):
+            parse_shards("timer-db-1,timer-db-1:5432")
+
+    def test_ring_spreads_keys_evenly(self):
+        ring = HashRing(TEST_SHARDS)
+
+        counts = Counter(ring.shard_for(timer_id) for timer_id in TEST_IDS)
+
+        assert set(counts) == set(TEST_SHARDS)
+        assert all(800 < count < 1200 for count in counts.values())
+
+    def test_ring_moves_only_keys_of_added_shard(self):
+        ring = HashRing(TEST_SHARDS)
+        new_shard = Shard("timer-db-4", 5432)
+        grown_ring = HashRing([*TEST_SHARDS, new_shard])
+
+        moved = [timer_id for timer_id in TEST_IDS if ring.shard_for(timer_id) != grown_ring.shard_for(timer_id)]
+
+        assert all(grown_ring.shard_for(timer_id) == new_shard for timer_id in moved)
+        assert 500 < len(moved) < 1000
+
+    def test_ring_without_shards(self):
+        with pytest.raises(ValueError):
+            HashRing([])
+
+    def test_router(self):
+        client_factory = mock.MagicMock(side_effect=lambda shard: mock.MagicMock(name=shard.name))
+        router = ShardRouter(HashRing(TEST_SHARDS), client_factory)
+
+        groups = router.group_by_shard(TEST_IDS, key=str)
+
+        assert sum(len(ids) for ids in groups.values()) == len(TEST_IDS)
+        for shard, ids in groups.items():
+            assert all(router.client_for(timer_id) is router.client(shard) for timer_id in ids)
+        assert client_factory.call_count == len(TEST_SHARDS)
@@ -0,0 +1,76 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from unittest import mock
+
+import pytest
+from prometheus_client import REGISTRY
+
+from metrics.registry import observe_firing, observe_query, observe_webhook, start_metrics_server
+
+REGISTRY_PATH = "metrics.registry.{}"
+
+
+def sample(name: str, **labels: str) -> float:
+    return REGISTRY.get_sample_value(f"timers_{name}", labels) or 0.0
+
+
+class TestRegistry:
+    def test_observe_query(self) -> None:
+        count = sample("db_query_latency_seconds_count", statement="test_query")
+
+        with observe_query("test_query"):
+            pass
+
+        assert sample("db_query_latency_seconds_count", statement="test_query") == count + 1
+
+    def test_observe_query_exception(self) -> None:
+        count = sample("db_query_latency_seconds_count", statement="test_failing_query")
+
+        with pytest.raises(RuntimeError):
+            with observe_query("test_failing_query"):
+                raise RuntimeError
+
+        assert sample("db_query_latency_seconds_count", statement="test_failing_query") == count + 1
+
+    @pytest.mark.parametrize("status_code, status", [(200, "200"), (503, "503"), (None, "error")])
+    def test_observe_webhook(self, status_code, status) -> None:
+        host = "hooks.example.com:8080"
+        count = sample("webhooks_total", host=host, status=status)
+        latency = sample("webhook_latency_seconds_sum", host=host)
+
+        observe_webhook(f"http://{host}/path?query=1", status_code, 0.25)
+
+        assert sample("webhooks_total", host=host, status=status) == count + 1
+        assert sample("webhook_latency_seconds_sum", host=host) == latency + 0.25
+
+    def test_observe_firing(self) -> None:
+        count = sample("firing_lateness_seconds_count")
+        http = sample("firing_stage_seconds_sum", stage="http")
+
+        observe_firing(1.5, {"http": 0.25})
+
+        assert sample("firing_lateness_seconds_count") == count + 1
+        assert sample("firing_stage_seconds_sum", stage="http") == http + 0.25
+
+    @mock.patch(REGISTRY_PATH.format("start_http_server"))
+    def test_start_metrics_server(self, mock_start_http_server) -> None:
+        start_metrics_server(9100)
+
+        mock_start_http_server.assert_called_once_with(9100)
+
+    @mock.patch(REGISTRY_PATH.format("start_http_server"))
+    def test_start_metrics_server_disabled(self, mock_start_http_server) -> None:
+        start_metrics_server(0)
+
+        mock_start_http_server.assert_not_called()
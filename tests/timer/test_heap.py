@@ -0,0 +1,67 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from datetime import datetime, timedelta, UTC
+
+import pytest
+
+from timer.heap import TimerHeap
+
+TEST_NOW = datetime(2024, 12, 1, 10, 0, tzinfo=UTC)
+TEST_URL = "http://example.com"
+
+
+class TestTimerHeap:
+    def test_pop_due_in_order(self):
+        heap = TimerHeap(capacity=10)
+        heap.push("late", TEST_NOW + timedelta(seconds=2), TEST_URL)
+        heap.push("early", TEST_NOW - timedelta(seconds=1), TEST_URL)
+        heap.push("now", TEST_NOW, TEST_URL)
+
+        due = heap.pop_due(TEST_NOW)
+
+        assert [timer.id for timer in due] == ["early", "now"]
+        assert heap.next_fire_at() == TEST_NOW + timedelta(seconds=2)
+        assert len(heap) == 1
+
+    def test_push_skips_duplicates(self):
+        heap = TimerHeap(capacity=10)
+
+        assert heap.push("id", TEST_NOW, TEST_URL)
+        assert not heap.push("id", TEST_NOW, TEST_URL)
+        assert len(heap) == 1
+
+    def test_push_bounded(self):
+        heap = TimerHeap(capacity=1)
+
+        assert heap.push("first", TEST_NOW, TEST_URL)
+        assert not heap.push("second", TEST_NOW, TEST_URL)
+        assert heap.free_slots == 0
+
+    def test_popped_timer_can_be_pushed_again(self):
+        heap = TimerHeap(capacity=1)
+        heap.push("id", TEST_NOW, TEST_URL)
+        heap.pop_due(TEST_NOW)
+
+        assert heap.push("id", TEST_NOW, TEST_URL)
+
+    def test_empty(self):
+        heap = TimerHeap(capacity=1)
+
+        assert heap.next_fire_at() is None
+        assert heap.pop_due(TEST_NOW) == []
+
+    def test_invalid_capacity(self):
+        with pytest.raises(ValueError):
+            TimerHeap(capacity=0)
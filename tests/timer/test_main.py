@@ -14,75 +14,185 @@
 
 import os
 import uuid
+from datetime import datetime, timedelta, UTC
+from time import time
 from pyexpat.errors import messages
 from unittest import mock, expectedFailure
 
+from psycopg2.extensions import adapt
 from sqlalchemy.testing import expect_deprecated
 
-from db.client import PostgresClientException
-from timer.main import select_timers_to_fire, schedule_hooks_firing
+from db.client import PostgresClient, PostgresClientException, Statement
+from db.sharding import Shard
+from metrics.registry import DUE_TIMERS
+from timer.heap import TimerHeap
+from timer.main import (
+    SQL_CLAIM_OWNED_TIMERS_TO_FIRE,
+    SQL_NEXT_OWNED_FIRE_IN,
+    claim_timers_to_fire,
+    count_due_timers,
+    delete_and_claim_timers_to_fire,
+    delete_fired_timers,
+    dispatch_lookahead_timers,
+    fire_timers,
+    next_fire_in,
+    poll_timers_to_fire,
+    schedule_hooks_firing,
+    wait_for_timers,
+)
 from timer_queue.exceptions import RabbitMqConnectionException
+from tests.db.utils import render
 
 TEST_ID = str(uuid.uuid4())
 TEST_URL = "http://example.com"
 RABBIT_MQ_TO_FIRE = "timers_to_fire"
 TIMER_PATH = "timer.main.{}"
 
-SQL_CREATE_TIMERS_TO_FIRE_TABLE = """
-CREATE TABLE IF NOT EXISTS timers_to_fire (
-    id UUID PRIMARY KEY,
-    fire_at TIMESTAMP WITH TIME ZONE,
-    url TEXT
+TEST_OTHER_ID = str(uuid.uuid4())
+
+SQL_CLAIM_TIMERS_TO_FIRE = """
+UPDATE timers_to_fire
+SET claimed_until = NOW() + make_interval(secs => %s)
+WHERE id IN (
+    SELECT id
+    FROM timers_to_fire
+    WHERE fire_at <= NOW() + make_interval(secs => %s) AND (claimed_until IS NULL OR claimed_until < NOW())
+    ORDER BY fire_at
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
 )
+RETURNING id, fire_at, url, trace
 """
-SQL_SELECT_TIMERS_TO_FIRE = """
-SELECT * 
-FROM timers_to_fire
-WHERE fire_at <= NOW() AT TIME ZONE 'UTC'
-"""
-SQL_DELETE_TIMERS_TO_FIRE = f"""
+SQL_DELETE_TIMERS_TO_FIRE = """
 DELETE FROM timers_to_fire
-WHERE id = '{TEST_ID}';
+WHERE id = ANY(%s::text[]::uuid[])
 """
 
 
+TEST_TRACE = {"id": "test-trace"}
+
+
+def fired_message(timer_id: str, fire_at, trace=mock.ANY) -> dict:
+    return dict(id=uuid.UUID(timer_id), url=TEST_URL, fire_at=fire_at, trace=trace)
+
+
+def confirm_all(queue_name, messages) -> list[bool]:
+    return [True] * len(messages)
+
+
+@mock.patch(TIMER_PATH.format("METRICS_PORT"), 0)
+@mock.patch(TIMER_PATH.format("TIMER_BACKLOG_INTERVAL"), 0)
+@mock.patch(TIMER_PATH.format("TIMER_LISTEN"), False)
 class TestTimer:
 
     # def setup_method(self):
     #     ...
 
-    def test_select_timers_to_fire(self):
+    def test_claim_timers_to_fire(self):
         mock_db_client = mock.MagicMock()
         expected_result = mock.MagicMock()
-        mock_result = [mock.MagicMock(), expected_result]
-        mock_db_client.run_queries.return_value = mock_result
+        mock_db_client.run_pipeline.return_value = expected_result
 
-        result = select_timers_to_fire(mock_db_client)
+        result = claim_timers_to_fire(mock_db_client)
 
         assert result == expected_result
-        mock_db_client.run_queries.assert_called_once_with([
-            SQL_CREATE_TIMERS_TO_FIRE_TABLE,
-            SQL_SELECT_TIMERS_TO_FIRE,
-        ])
+        mock_db_client.run_pipeline.assert_called_once_with(
+            [Statement(SQL_CLAIM_TIMERS_TO_FIRE, (60, 0, 1000), name="claim_timers_to_fire")],
+        )
+
+    @mock.patch(TIMER_PATH.format("TIMER_DISPATCH_SLOTS"), 64)
+    def test_claim_timers_to_fire_owned_slots(self):
+        mock_db_client = mock.MagicMock()
+
+        claim_timers_to_fire(mock_db_client, slots=[3, 7])
+
+        mock_db_client.run_pipeline.assert_called_once_with(
+            [Statement(SQL_CLAIM_OWNED_TIMERS_TO_FIRE, (60, 0, 64, [3, 7], 1000), name="claim_owned_timers_to_fire")],
+        )
+
+    def test_claim_timers_to_fire_no_owned_slots(self):
+        mock_db_client = mock.MagicMock()
+
+        assert claim_timers_to_fire(mock_db_client, slots=[]) == []
+
+        mock_db_client.run_pipeline.assert_not_called()
 
     @mock.patch(TIMER_PATH.format("sleep"))
     @mock.patch(TIMER_PATH.format("logging"))
-    def test_select_timers_to_fire_exception(self, mock_logging, mock_slip):
+    def test_claim_timers_to_fire_exception(self, mock_logging, mock_slip):
         mock_db_client = mock.MagicMock()
         expected_result = mock.MagicMock()
-        mock_result = [mock.MagicMock(), expected_result]
-        mock_db_client.run_queries.side_effect = [
+        mock_db_client.run_pipeline.side_effect = [
             PostgresClientException,
-            mock_result
+            expected_result
         ]
 
-        result = select_timers_to_fire(mock_db_client)
+        result = claim_timers_to_fire(mock_db_client)
 
         assert result == expected_result
         mock_slip.assert_called_once_with(1)
 
-    @mock.patch(TIMER_PATH.format("select_timers_to_fire"))
-    @mock.patch(TIMER_PATH.format("RabbitMQClient"))
+    @mock.patch(TIMER_PATH.format("sleep"))
+    def test_delete_fired_timers(self, mock_sleep):
+        mock_db_client = mock.MagicMock()
+        mock_db_client.run_prepared.side_effect = [PostgresClientException, None]
+
+        delete_fired_timers(mock_db_client, [TEST_ID, TEST_OTHER_ID])
+
+        expected_call = mock.call("delete_fired_timers", SQL_DELETE_TIMERS_TO_FIRE, ([TEST_ID, TEST_OTHER_ID],))
+        mock_db_client.run_prepared.assert_has_calls([expected_call, expected_call])
+        mock_sleep.assert_called_once_with(1)
+
+    @mock.patch("db.client.psycopg2.connect")
+    def test_delete_fired_timers_prepared(self, mock_connect):
+        mock_cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        executed = []
+        mock_cursor.execute.side_effect = lambda query, params=None: executed.append((render(query), params))
+
+        delete_fired_timers(PostgresClient("test-host", 5432, "test-db", "test-user", "test-password"), [TEST_ID])
+
+        (prepare, _), (execute, params) = executed
+        # Ids are sent as a text[] array, so the prepared statement must declare its parameter as text[].
+        assert prepare.endswith("WHERE id = ANY($1::text[]::uuid[])\n")
+        assert execute == "EXECUTE delete_fired_timers (%s)"
+        assert adapt(params[0]).getquoted() == f"ARRAY['{TEST_ID}']".encode()
+
+    @mock.patch("db.client.psycopg2.connect")
+    def test_delete_and_claim_timers_to_fire_pipelined(self, mock_connect):
+        mock_cursor = mock_connect.return_value.cursor.return_value.__enter__.return_value
+        executed = []
+        mock_cursor.execute.side_effect = lambda query, params=None: executed.append(render(query))
+        mock_cursor.mogrify.side_effect = lambda query, params: (
+            render(query) % tuple(adapt(param).getquoted().decode() for param in params)
+        ).encode()
+        db_client = PostgresClient("test-host", 5432, "test-db", "test-user", "test-password")
+
+        result = delete_and_claim_timers_to_fire(db_client, [TEST_ID], limit=10)
+
+        assert result == mock_cursor.fetchall.return_value
+        prepare_delete, prepare_claim, request = executed
+        assert prepare_delete.endswith("WHERE id = ANY($1::text[]::uuid[])\n")
+        assert prepare_claim.startswith("PREPARE claim_timers_to_fire AS ")
+        assert request == (
+            f"EXECUTE delete_fired_timers (ARRAY['{TEST_ID}']);\nEXECUTE claim_timers_to_fire (60, 0, 10)".encode()
+        )
+
+    @mock.patch(TIMER_PATH.format("sleep"))
+    def test_delete_and_claim_timers_to_fire_nothing_fired(self, mock_sleep):
+        mock_db_client = mock.MagicMock()
+        mock_db_client.run_pipeline.side_effect = [PostgresClientException, None]
+
+        result = delete_and_claim_timers_to_fire(mock_db_client, [])
+
+        assert result == []
+        mock_db_client.run_pipeline.assert_called_with([
+            Statement(SQL_CLAIM_TIMERS_TO_FIRE, (60, 0, 1000), name="claim_timers_to_fire"),
+        ])
+        mock_sleep.assert_called_once_with(1)
+
+    @mock.patch(TIMER_PATH.format("migrate"))
+    @mock.patch(TIMER_PATH.format("claim_timers_to_fire"))
+    @mock.patch(TIMER_PATH.format("RabbitMQPublisher"))
     @mock.patch(TIMER_PATH.format("PostgresClient"))
     @mock.patch(TIMER_PATH.format("sleep"))
     def test_schedule_hooks_firing(
@@ -90,13 +200,17 @@ class TestTimer:
             mock_sleep,
             mock_db_client,
             mock_rabbit_client,
-            mock_select_timers_to_fire,
+            mock_claim_timers_to_fire,
+            mock_migrate,
     ):
         mock_db = mock_db_client.return_value
         mock_mq = mock_rabbit_client.return_value
-        expect_timer_timer = (TEST_ID, mock.MagicMock(), TEST_URL)
-        expected_message = dict(id=TEST_ID, url=TEST_URL)
-        mock_select_timers_to_fire.side_effect = [
+        mock_mq.push_messages.side_effect = confirm_all
+        mock_db.run_prepared.return_value = [(2,)]
+        fire_at = mock.MagicMock()
+        expect_timer_timer = (TEST_ID, fire_at, TEST_URL, TEST_TRACE)
+        expected_message = fired_message(TEST_ID, fire_at)
+        mock_claim_timers_to_fire.side_effect = [
             [expect_timer_timer],
             KeyboardInterrupt
         ]
@@ -104,13 +218,18 @@ class TestTimer:
         schedule_hooks_firing()
 
         mock_db_client.assert_called_once()
+        mock_migrate.assert_called_once()
         mock_rabbit_client.assert_called_once()
         mock_sleep.assert_called_once_with(2)
-        mock_mq.push_message.assert_called_once_with(queue_name=RABBIT_MQ_TO_FIRE, message=expected_message)
-        mock_db.run_queries.assert_called_once_with([SQL_DELETE_TIMERS_TO_FIRE])
+        mock_mq.push_messages.assert_called_once_with(queue_name=RABBIT_MQ_TO_FIRE, messages=[expected_message])
+        assert mock_db.run_prepared.call_args_list == [
+            mock.call("delete_fired_timers", SQL_DELETE_TIMERS_TO_FIRE, ([TEST_ID],)),
+            mock.call("next_fire_in", mock.ANY),
+        ]
 
-    @mock.patch(TIMER_PATH.format("select_timers_to_fire"))
-    @mock.patch(TIMER_PATH.format("RabbitMQClient"))
+    @mock.patch(TIMER_PATH.format("migrate"))
+    @mock.patch(TIMER_PATH.format("claim_timers_to_fire"))
+    @mock.patch(TIMER_PATH.format("RabbitMQPublisher"))
     @mock.patch(TIMER_PATH.format("PostgresClient"))
     @mock.patch(TIMER_PATH.format("sleep"))
     def test_schedule_hooks_firing_no_timers(
@@ -118,9 +237,11 @@ class TestTimer:
         mock_sleep,
         mock_db_client,
         mock_rabbit_client,
-        mock_select_timers_to_fire,
+        mock_claim_timers_to_fire,
+        mock_migrate,
     ):
-        mock_select_timers_to_fire.side_effect = [
+        mock_db_client.return_value.run_prepared.return_value = []
+        mock_claim_timers_to_fire.side_effect = [
             None,
             KeyboardInterrupt
         ]
@@ -129,10 +250,11 @@ class TestTimer:
 
         mock_db_client.assert_called_once()
         mock_rabbit_client.assert_called_once()
-        mock_sleep.assert_called_once_with(2)
+        mock_sleep.assert_called_once_with(30)
 
-    @mock.patch(TIMER_PATH.format("select_timers_to_fire"))
-    @mock.patch(TIMER_PATH.format("RabbitMQClient"))
+    @mock.patch(TIMER_PATH.format("migrate"))
+    @mock.patch(TIMER_PATH.format("claim_timers_to_fire"))
+    @mock.patch(TIMER_PATH.format("RabbitMQPublisher"))
     @mock.patch(TIMER_PATH.format("PostgresClient"))
     @mock.patch(TIMER_PATH.format("sleep"))
     def test_schedule_hooks_firing_exception(
@@ -140,18 +262,15 @@ class TestTimer:
         mock_sleep,
         mock_db_client,
         mock_rabbit_client,
-        mock_select_timers_to_fire,
+        mock_claim_timers_to_fire,
+        mock_migrate,
     ):
         mock_db = mock_db_client.return_value
         mock_mq = mock_rabbit_client.return_value
-        mock_mq.push_message.side_effect = [
-            RabbitMqConnectionException,
-            mock.MagicMock(),
-        ]
-        expect_timer_timer = (TEST_ID, mock.MagicMock(), TEST_URL)
-        expected_message = dict(id=TEST_ID, url=TEST_URL)
-        mock_select_timers_to_fire.side_effect = [
-            [expect_timer_timer],
+        mock_mq.push_messages.side_effect = RabbitMqConnectionException
+        mock_db.run_prepared.return_value = [(-1.5,)]
+        mock_claim_timers_to_fire.side_effect = [
+            [(TEST_ID, mock.MagicMock(), TEST_URL, TEST_TRACE)],
             KeyboardInterrupt
         ]
 
@@ -159,6 +278,372 @@ class TestTimer:
 
         mock_db_client.assert_called_once()
         mock_rabbit_client.assert_called_once()
+        assert not mock_sleep.called
+        mock_mq.push_messages.assert_called_once()
+        mock_db.run_prepared.assert_called_once_with("next_fire_in", mock.ANY)
+
+    def test_fire_timers_deletes_only_confirmed(self):
+        mock_mq = mock.MagicMock()
+        mock_mq.push_messages.return_value = [False, True]
+
+        fire_at = datetime.now(UTC)
+        fired_ids = fire_timers(
+            rabbitmq_client=mock_mq,
+            timers_to_fire=[(TEST_ID, fire_at, TEST_URL, TEST_TRACE), (TEST_OTHER_ID, fire_at, TEST_URL, None)],
+        )
+
+        assert fired_ids == [TEST_OTHER_ID]
+        mock_mq.push_messages.assert_called_once_with(
+            queue_name=RABBIT_MQ_TO_FIRE,
+            messages=[fired_message(TEST_ID, fire_at), fired_message(TEST_OTHER_ID, fire_at)],
+        )
+
+    def test_fire_timers_traces(self):
+        mock_mq = mock.MagicMock()
+        mock_mq.push_messages.side_effect = confirm_all
+        claimed_at = datetime.now(UTC) - timedelta(seconds=5)
+
+        fire_timers(
+            rabbitmq_client=mock_mq,
+            timers_to_fire=[
+                (TEST_ID, claimed_at, TEST_URL, '{"id": "test-trace"}'),
+                (TEST_OTHER_ID, claimed_at, TEST_URL, {"id": "other-trace", "claimed_at": claimed_at}),
+            ],
+        )
+
+        trace, other_trace = [message["trace"] for message in mock_mq.push_messages.call_args.kwargs["messages"]]
+        assert trace["id"] == "test-trace"
+        assert trace["claimed_at"] == trace["dispatched_at"] > claimed_at
+        assert other_trace["id"] == "other-trace"
+        assert other_trace["claimed_at"] == claimed_at < other_trace["dispatched_at"]
+
+    def test_fire_timers_nothing_to_fire(self):
+        mock_mq = mock.MagicMock()
+
+        assert fire_timers(rabbitmq_client=mock_mq, timers_to_fire=[]) == []
+        mock_mq.push_messages.assert_not_called()
+
+    @mock.patch(TIMER_PATH.format("TIMER_BATCH_SIZE"), 1)
+    @mock.patch(TIMER_PATH.format("TIMER_OWNERSHIP_HEARTBEAT_SECONDS"), 0)
+    @mock.patch(TIMER_PATH.format("delete_fired_timers"))
+    @mock.patch(TIMER_PATH.format("delete_and_claim_timers_to_fire"))
+    @mock.patch(TIMER_PATH.format("claim_timers_to_fire"))
+    def test_poll_timers_to_fire_stops_draining_lost_slots(
+        self, mock_claim_timers_to_fire, mock_delete_and_claim_timers_to_fire, mock_delete_fired_timers,
+    ):
+        mock_db = mock.MagicMock()
+        mock_db.run_prepared.return_value = [(2,)]
+        mock_mq = mock.MagicMock()
+        mock_mq.push_messages.side_effect = confirm_all
+        ownership = mock.MagicMock(renewed_at=0, owned=[3, 7])
+        # The first heartbeat keeps the slots, the second one finds slot 3 taken over by another process.
+        heartbeats = iter([[3, 7], [7]])
+
+        def heartbeat():
+            ownership.owned = next(heartbeats)
+            return ownership.owned
+
+        ownership.heartbeat.side_effect = heartbeat
+        mock_claim_timers_to_fire.return_value = [(TEST_ID, mock.MagicMock(), TEST_URL, TEST_TRACE)]
+        mock_delete_and_claim_timers_to_fire.return_value = [(TEST_OTHER_ID, mock.MagicMock(), TEST_URL, TEST_TRACE)]
+
+        poll_timers_to_fire(db_client=mock_db, rabbitmq_client=mock_mq, slots=[3, 7], ownership=ownership)
+
+        assert ownership.heartbeat.call_count == 2
+        mock_delete_and_claim_timers_to_fire.assert_called_once_with(
+            db_client=mock_db, ids=[TEST_ID], limit=1, slots=[3, 7],
+        )
+        mock_delete_fired_timers.assert_called_once_with(db_client=mock_db, ids=[TEST_OTHER_ID])
+
+    @mock.patch(TIMER_PATH.format("TIMER_BATCH_SIZE"), 1)
+    @mock.patch(TIMER_PATH.format("migrate"))
+    @mock.patch(TIMER_PATH.format("claim_timers_to_fire"))
+    @mock.patch(TIMER_PATH.format("RabbitMQPublisher"))
+    @mock.patch(TIMER_PATH.format("PostgresClient"))
+    @mock.patch(TIMER_PATH.format("sleep"))
+    def test_schedule_hooks_firing_full_batch(
+        self,
+        mock_sleep,
+        mock_db_client,
+        mock_rabbit_client,
+        mock_claim_timers_to_fire,
+        mock_migrate,
+    ):
+        mock_db = mock_db_client.return_value
+        mock_db.run_prepared.return_value = [(2,)]
+        mock_rabbit_client.return_value.push_messages.side_effect = confirm_all
+        mock_claim_timers_to_fire.side_effect = [
+            [(TEST_ID, mock.MagicMock(), TEST_URL, TEST_TRACE)],
+            KeyboardInterrupt
+        ]
+        mock_db.run_pipeline.side_effect = [
+            [(TEST_OTHER_ID, mock.MagicMock(), TEST_URL, TEST_TRACE)],
+            [],
+        ]
+
+        schedule_hooks_firing()
+
+        assert mock_claim_timers_to_fire.call_count == 2
+        assert mock_db.run_pipeline.call_args_list == [
+            mock.call([
+                Statement(SQL_DELETE_TIMERS_TO_FIRE, ([TEST_ID],), name="delete_fired_timers"),
+                Statement(SQL_CLAIM_TIMERS_TO_FIRE, (60, 0, 1), name="claim_timers_to_fire"),
+            ]),
+            mock.call([
+                Statement(SQL_DELETE_TIMERS_TO_FIRE, ([TEST_OTHER_ID],), name="delete_fired_timers"),
+                Statement(SQL_CLAIM_TIMERS_TO_FIRE, (60, 0, 1), name="claim_timers_to_fire"),
+            ]),
+        ]
+        mock_db.run_prepared.assert_called_once_with("next_fire_in", mock.ANY)
         mock_sleep.assert_called_once_with(2)
-        mock_mq.push_message.assert_called_once_with(queue_name=RABBIT_MQ_TO_FIRE, message=expected_message)
-        assert not mock_db.run_queries.called
\ No newline at end of file
+
+    @mock.patch(TIMER_PATH.format("TIMER_DB_PARTITIONED"), True)
+    @mock.patch(TIMER_PATH.format("maintain_partitions"))
+    @mock.patch(TIMER_PATH.format("migrate"))
+    @mock.patch(TIMER_PATH.format("claim_timers_to_fire"))
+    @mock.patch(TIMER_PATH.format("RabbitMQPublisher"))
+    @mock.patch(TIMER_PATH.format("PostgresClient"))
+    @mock.patch(TIMER_PATH.format("sleep"))
+    def test_schedule_hooks_firing_partitioned(
+        self,
+        mock_sleep,
+        mock_db_client,
+        mock_rabbit_client,
+        mock_claim_timers_to_fire,
+        mock_migrate,
+        mock_maintain_partitions,
+    ):
+        mock_maintain_partitions.side_effect = PostgresClientException
+        mock_claim_timers_to_fire.side_effect = [[], [], KeyboardInterrupt]
+
+        schedule_hooks_firing()
+
+        mock_maintain_partitions.assert_called_once()
+        assert mock_sleep.call_count == 2
+
+    @mock.patch(TIMER_PATH.format("delete_fired_timers"))
+    @mock.patch(TIMER_PATH.format("claim_timers_to_fire"))
+    def test_dispatch_lookahead_timers(self, mock_claim_timers_to_fire, mock_delete_fired_timers):
+        mock_db = mock.MagicMock()
+        mock_mq = mock.MagicMock()
+        mock_mq.push_messages.side_effect = confirm_all
+        now = datetime.now(UTC)
+        mock_claim_timers_to_fire.return_value = [
+            (TEST_ID, now - timedelta(seconds=1), TEST_URL, TEST_TRACE),
+            (TEST_OTHER_ID, now + timedelta(seconds=30), TEST_URL, TEST_TRACE),
+        ]
+        heap = TimerHeap(capacity=10)
+
+        wait = dispatch_lookahead_timers(db_client=mock_db, rabbitmq_client=mock_mq, heap=heap)
+
+        mock_claim_timers_to_fire.assert_called_once_with(
+            db_client=mock_db, horizon=60, limit=10, lease=120, slots=None,
+        )
+        mock_mq.push_messages.assert_called_once_with(
+            queue_name=RABBIT_MQ_TO_FIRE, messages=[fired_message(TEST_ID, now - timedelta(seconds=1))],
+        )
+        trace = mock_mq.push_messages.call_args.kwargs["messages"][0]["trace"]
+        assert trace["id"] == "test-trace"
+        assert trace["claimed_at"] <= trace["dispatched_at"]
+        mock_delete_fired_timers.assert_called_once_with(db_client=mock_db, ids=[TEST_ID])
+        assert len(heap) == 1
+        assert 0 < wait <= 1
+
+    @mock.patch(TIMER_PATH.format("delete_fired_timers"))
+    @mock.patch(TIMER_PATH.format("claim_timers_to_fire"))
+    def test_dispatch_lookahead_timers_waits_for_next_timer(
+        self, mock_claim_timers_to_fire, mock_delete_fired_timers,
+    ):
+        heap = TimerHeap(capacity=10)
+        heap.push(TEST_ID, datetime.now(UTC) + timedelta(milliseconds=200), TEST_URL)
+        heap.next_refill_at = float("inf")
+
+        wait = dispatch_lookahead_timers(db_client=mock.MagicMock(), rabbitmq_client=mock.MagicMock(), heap=heap)
+
+        assert not mock_claim_timers_to_fire.called
+        assert not mock_delete_fired_timers.called
+        assert 0 < wait <= 0.2
+
+    @mock.patch(TIMER_PATH.format("TIMER_DB_SHARDS"), "timer-db-1,timer-db-2")
+    @mock.patch(TIMER_PATH.format("migrate"))
+    @mock.patch(TIMER_PATH.format("poll_timers_to_fire"))
+    @mock.patch(TIMER_PATH.format("RabbitMQPublisher"))
+    @mock.patch(TIMER_PATH.format("PostgresClient"))
+    @mock.patch(TIMER_PATH.format("sleep"))
+    def test_schedule_hooks_firing_sharded(
+        self,
+        mock_sleep,
+        mock_db_client,
+        mock_rabbit_client,
+        mock_poll_timers_to_fire,
+        mock_migrate,
+    ):
+        mock_db_client.side_effect = lambda host, **kwargs: mock.MagicMock(host=host)
+        mock_poll_timers_to_fire.side_effect = [2, 0, KeyboardInterrupt]
+
+        schedule_hooks_firing()
+
+        assert mock_migrate.call_count == 2
+        polled = [call.kwargs["db_client"].host for call in mock_poll_timers_to_fire.call_args_list]
+        assert polled == ["timer-db-1", "timer-db-2", "timer-db-1"]
+        assert not mock_sleep.called
+
+    def test_count_due_timers(self):
+        mock_db = mock.MagicMock()
+        mock_db.run_prepared.return_value = [(42,)]
+
+        count_due_timers(db_client=mock_db, shard=Shard("backlog-db", 5432))
+
+        assert DUE_TIMERS.labels("backlog-db:5432")._value.get() == 42
+
+    @mock.patch(TIMER_PATH.format("logger"))
+    def test_count_due_timers_exception(self, mock_logger):
+        mock_db = mock.MagicMock()
+        mock_db.run_prepared.side_effect = PostgresClientException
+        DUE_TIMERS.labels("failing-db:5432").set(7)
+
+        count_due_timers(db_client=mock_db, shard=Shard("failing-db", 5432))
+
+        mock_logger.warning.assert_called_once()
+        assert DUE_TIMERS.labels("failing-db:5432")._value.get() == 7
+
+    @mock.patch(TIMER_PATH.format("TIMER_MAX_SLEEP_SECONDS"), 30)
+    def test_next_fire_in(self):
+        mock_db = mock.MagicMock()
+
+        for rows, expected in [([(1.5,)], 1.5), ([(-3,)], 0), ([(3600,)], 30), ([], 30)]:
+            mock_db.run_prepared.return_value = rows
+            assert next_fire_in(mock_db) == expected
+
+        mock_db.run_prepared.side_effect = PostgresClientException
+        assert next_fire_in(mock_db) == 1
+
+    @mock.patch(TIMER_PATH.format("TIMER_DISPATCH_SLOTS"), 64)
+    @mock.patch(TIMER_PATH.format("TIMER_MAX_SLEEP_SECONDS"), 30)
+    def test_next_fire_in_owned_slots(self):
+        mock_db = mock.MagicMock()
+        mock_db.run_prepared.return_value = [(1.5,)]
+
+        assert next_fire_in(mock_db, slots=[3]) == 1.5
+        assert next_fire_in(mock_db, slots=[]) == 30
+
+        mock_db.run_prepared.assert_called_once_with("next_owned_fire_in", SQL_NEXT_OWNED_FIRE_IN, (64, [3]))
+
+    @mock.patch(TIMER_PATH.format("sleep"))
+    def test_wait_for_timers_without_listeners(self, mock_sleep):
+        assert wait_for_timers(None, 5) == set()
+
+        mock_sleep.assert_called_once_with(5)
+
+    @mock.patch(TIMER_PATH.format("sleep"))
+    @mock.patch(TIMER_PATH.format("wait_for_notifications"))
+    def test_wait_for_timers_woken(self, mock_wait_for_notifications, mock_sleep):
+        listeners = [mock.MagicMock(), mock.MagicMock()]
+        mock_wait_for_notifications.side_effect = [
+            [(0, str(time() + 3600))],
+            [(1, str(time() + 1)), (0, "not a moment")],
+        ]
+
+        assert wait_for_timers(listeners, 5) == {0, 1}
+
+        assert mock_wait_for_notifications.call_count == 2
+        assert mock_wait_for_notifications.call_args.args[0] is listeners
+        assert 0 < mock_wait_for_notifications.call_args.args[1] <= 5
+        assert not mock_sleep.called
+
+    @mock.patch(TIMER_PATH.format("sleep"))
+    @mock.patch(TIMER_PATH.format("wait_for_notifications"))
+    def test_wait_for_timers_listening_fails(self, mock_wait_for_notifications, mock_sleep):
+        mock_wait_for_notifications.side_effect = PostgresClientException
+
+        assert wait_for_timers([mock.MagicMock()], 5) == set()
+
+        assert 0 < mock_sleep.call_args.args[0] <= 5
+
+    @mock.patch(TIMER_PATH.format("TIMER_MODE"), "lookahead")
+    @mock.patch(TIMER_PATH.format("wait_for_timers"))
+    @mock.patch(TIMER_PATH.format("dispatch_lookahead_timers"))
+    @mock.patch(TIMER_PATH.format("NotificationListener"))
+    @mock.patch(TIMER_PATH.format("migrate"))
+    @mock.patch(TIMER_PATH.format("RabbitMQPublisher"))
+    @mock.patch(TIMER_PATH.format("PostgresClient"))
+    def test_schedule_hooks_firing_woken(
+        self,
+        mock_db_client,
+        mock_rabbit_client,
+        mock_migrate,
+        mock_listener,
+        mock_dispatch_lookahead_timers,
+        mock_wait_for_timers,
+    ):
+        mock_dispatch_lookahead_timers.side_effect = [5, KeyboardInterrupt]
+        mock_wait_for_timers.return_value = {0}
+
+        # Patched here, since the class-wide patch disabling listening is applied after the ones of the test.
+        with mock.patch(TIMER_PATH.format("TIMER_LISTEN"), True):
+            schedule_hooks_firing()
+
+        listeners, wait = mock_wait_for_timers.call_args.args
+        assert listeners == [mock_listener.return_value]
+        assert wait == 5
+        assert mock_dispatch_lookahead_timers.call_args.kwargs["heap"].next_refill_at == 0
+        mock_listener.return_value.close.assert_called_once()
+
+    @mock.patch(TIMER_PATH.format("TIMER_DISPATCH_SLOTS"), 64)
+    @mock.patch(TIMER_PATH.format("TIMER_DISPATCHER_ID"), "timer-1")
+    @mock.patch(TIMER_PATH.format("SlotOwnership"))
+    @mock.patch(TIMER_PATH.format("poll_timers_to_fire"))
+    @mock.patch(TIMER_PATH.format("migrate"))
+    @mock.patch(TIMER_PATH.format("RabbitMQPublisher"))
+    @mock.patch(TIMER_PATH.format("PostgresClient"))
+    @mock.patch(TIMER_PATH.format("sleep"))
+    def test_schedule_hooks_firing_owned_slots(
+        self,
+        mock_sleep,
+        mock_db_client,
+        mock_rabbit_client,
+        mock_migrate,
+        mock_poll_timers_to_fire,
+        mock_ownership,
+    ):
+        ownership = mock_ownership.return_value
+        ownership.owned = [3, 7]
+        mock_poll_timers_to_fire.side_effect = [30, KeyboardInterrupt]
+
+        schedule_hooks_firing()
+
+        mock_ownership.assert_called_once_with(mock_db_client.return_value, owner="timer-1", slots=64, lease=15)
+        ownership.heartbeat.assert_called_once()
+        assert mock_poll_timers_to_fire.call_args.kwargs["slots"] == [3, 7]
+        assert mock_poll_timers_to_fire.call_args.kwargs["ownership"] is ownership
+        # The sleep is cut short by the next heartbeat.
+        assert 0 < mock_sleep.call_args.args[0] <= 5
+        ownership.release.assert_called_once()
+
+    @mock.patch(TIMER_PATH.format("TIMER_DISPATCH_SLOTS"), 64)
+    @mock.patch(TIMER_PATH.format("TIMER_MODE"), "lookahead")
+    @mock.patch(TIMER_PATH.format("SlotOwnership"))
+    @mock.patch(TIMER_PATH.format("dispatch_lookahead_timers"))
+    @mock.patch(TIMER_PATH.format("migrate"))
+    @mock.patch(TIMER_PATH.format("RabbitMQPublisher"))
+    @mock.patch(TIMER_PATH.format("PostgresClient"))
+    @mock.patch(TIMER_PATH.format("sleep"))
+    def test_schedule_hooks_firing_ownership_failure(
+        self,
+        mock_sleep,
+        mock_db_client,
+        mock_rabbit_client,
+        mock_migrate,
+        mock_dispatch_lookahead_timers,
+        mock_ownership,
+    ):
+        ownership = mock_ownership.return_value
+        ownership.owned = []
+        ownership.heartbeat.side_effect = PostgresClientException
+        ownership.release.side_effect = PostgresClientException
+        mock_dispatch_lookahead_timers.side_effect = [1, KeyboardInterrupt]
+
+        schedule_hooks_firing()
+
+        assert mock_dispatch_lookahead_timers.call_args.kwargs["slots"] == []
+        ownership.release.assert_called_once()
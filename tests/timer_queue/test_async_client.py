@@ -0,0 +1,117 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import json
+from unittest import mock
+
+import pytest
+from aio_pika.exceptions import AMQPConnectionError
+from pamqp.commands import Basic
+
+from timer_queue.async_client import AsyncRabbitMQClient
+from timer_queue.codec import BINARY_CODEC, BINARY_CONTENT_TYPE, JSON_CONTENT_TYPE
+from timer_queue.exceptions import RabbitMqConnectionException
+
+TEST_HOST = "test-host"
+TEST_PORT = 5672
+TEST_QUEUE = "test-queue"
+TEST_MESSAGE = {"id": "test-id"}
+CLIENT_PATH = "timer_queue.async_client.{}"
+
+
+class TestAsyncRabbitMQClient:
+    def setup_method(self):
+        self.client = AsyncRabbitMQClient(host=TEST_HOST, port=TEST_PORT)
+        self.channel = mock.AsyncMock()
+        self.channel.default_exchange.publish.return_value = Basic.Ack()
+        self.connection = mock.AsyncMock()
+        self.connection.channel.return_value = self.channel
+
+    def connect(self):
+        with mock.patch(CLIENT_PATH.format("aio_pika.connect_robust"), return_value=self.connection) as connect:
+            asyncio.run(self.client.connect())
+        connect.assert_called_once_with(host=TEST_HOST, port=TEST_PORT)
+        self.connection.channel.assert_awaited_once_with(publisher_confirms=True)
+
+    def test_push_message(self):
+        self.connect()
+
+        async def push_twice():
+            await asyncio.gather(
+                self.client.push_message(TEST_QUEUE, TEST_MESSAGE),
+                self.client.push_message(TEST_QUEUE, TEST_MESSAGE),
+            )
+
+        asyncio.run(push_twice())
+
+        self.channel.declare_queue.assert_awaited_once_with(TEST_QUEUE, durable=True, arguments=None)
+        assert self.channel.default_exchange.publish.await_count == 2
+        message = self.channel.default_exchange.publish.call_args.args[0]
+        assert json.loads(message.body) == TEST_MESSAGE
+        assert message.content_type == JSON_CONTENT_TYPE
+        assert self.channel.default_exchange.publish.call_args.kwargs["routing_key"] == TEST_QUEUE
+
+    def test_push_message_with_queue_arguments(self):
+        self.connect()
+        arguments = {"x-message-ttl": 100}
+
+        asyncio.run(self.client.push_message(TEST_QUEUE, TEST_MESSAGE, arguments=arguments))
+
+        self.channel.declare_queue.assert_awaited_once_with(TEST_QUEUE, durable=True, arguments=arguments)
+
+    def test_push_message_binary(self):
+        self.client.codec = BINARY_CODEC
+        self.connect()
+
+        asyncio.run(self.client.push_message(TEST_QUEUE, TEST_MESSAGE))
+
+        message = self.channel.default_exchange.publish.call_args.args[0]
+        assert message.content_type == BINARY_CONTENT_TYPE
+        assert BINARY_CODEC.decode(message.body) == TEST_MESSAGE
+
+    def test_push_message_not_confirmed(self):
+        self.connect()
+        self.channel.default_exchange.publish.return_value = Basic.Nack()
+
+        with pytest.raises(RabbitMqConnectionException):
+            asyncio.run(self.client.push_message(TEST_QUEUE, TEST_MESSAGE))
+
+    def test_push_message_connection_error(self):
+        self.connect()
+        self.channel.default_exchange.publish.side_effect = AMQPConnectionError
+
+        with pytest.raises(RabbitMqConnectionException):
+            asyncio.run(self.client.push_message(TEST_QUEUE, TEST_MESSAGE))
+
+    def test_push_message_not_connected(self):
+        with pytest.raises(RabbitMqConnectionException):
+            asyncio.run(self.client.push_message(TEST_QUEUE, TEST_MESSAGE))
+
+    def test_push_messages(self):
+        self.connect()
+        self.channel.default_exchange.publish.side_effect = [Basic.Ack(), Basic.Nack(), AMQPConnectionError]
+
+        confirmed = asyncio.run(self.client.push_messages(TEST_QUEUE, [TEST_MESSAGE] * 3))
+
+        assert confirmed == [True, False, False]
+        assert self.channel.default_exchange.publish.await_count == 3
+
+    def test_close(self):
+        self.connect()
+
+        asyncio.run(self.client.close())
+
+        self.connection.close.assert_awaited_once()
+        assert self.client.channel is None
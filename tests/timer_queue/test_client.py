@@ -0,0 +1,181 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import threading
+from unittest import mock
+
+import pytest
+from pika.exceptions import ConnectionWrongStateError
+
+from timer_queue.client import (
+    RabbitMQClient,
+    RabbitMQPublisher,
+    ack_threadsafe,
+    nack_threadsafe,
+)
+
+TEST_HOST = "test-host"
+TEST_PORT = 5672
+TEST_QUEUE = "test-queue"
+TEST_MESSAGE = {"id": "test-id"}
+CLIENT_PATH = "timer_queue.client.{}"
+
+
+class TestRabbitMQPublisher:
+    @mock.patch(CLIENT_PATH.format("AsyncRabbitMQClient"))
+    def test_push_messages(self, mock_async_client):
+        client = mock_async_client.return_value
+        client.channel = None
+
+        async def connect():
+            client.channel = mock.MagicMock()
+
+        client.connect = mock.AsyncMock(side_effect=connect)
+        client.push_messages = mock.AsyncMock(side_effect=lambda queue_name, messages: [True] * len(messages))
+        client.close = mock.AsyncMock()
+        publisher = RabbitMQPublisher(host=TEST_HOST, port=TEST_PORT)
+
+        assert publisher.push_messages(TEST_QUEUE, [TEST_MESSAGE, TEST_MESSAGE]) == [True, True]
+        assert publisher.push_messages(TEST_QUEUE, [TEST_MESSAGE]) == [True]
+        assert publisher.push_messages(TEST_QUEUE, []) == []
+        publisher.close()
+
+        client.connect.assert_awaited_once()
+        assert client.push_messages.await_count == 2
+        client.close.assert_awaited_once()
+        assert not publisher._thread.is_alive()
+
+
+class TestRabbitMQClient:
+    @mock.patch(CLIENT_PATH.format("BlockingConnection"))
+    def test_consume_batches(self, mock_connection):
+        client = RabbitMQClient(host=TEST_HOST, port=TEST_PORT)
+        mock_channel = mock_connection.return_value.channel.return_value
+        deliveries = [(mock.MagicMock(delivery_tag=tag), mock.MagicMock(), b"{}") for tag in range(1, 4)]
+        mock_channel.consume.return_value = iter([*deliveries, (None, None, None)])
+        call_back = mock.MagicMock()
+
+        client.consume_batches(queue_name=TEST_QUEUE, call_back=call_back, batch_size=2, batch_timeout=10)
+
+        mock_channel.basic_qos.assert_called_once_with(prefetch_count=2)
+        call_back.assert_called_once_with(deliveries[:2])
+        mock_channel.basic_ack.assert_called_once_with(delivery_tag=2, multiple=True)
+
+    @mock.patch(CLIENT_PATH.format("BlockingConnection"))
+    def test_consume_batches_timeout(self, mock_connection):
+        client = RabbitMQClient(host=TEST_HOST, port=TEST_PORT)
+        mock_channel = mock_connection.return_value.channel.return_value
+        delivery = (mock.MagicMock(delivery_tag=1), mock.MagicMock(), b"{}")
+        mock_channel.consume.return_value = iter([delivery, (None, None, None)])
+        call_back = mock.MagicMock()
+
+        client.consume_batches(
+            queue_name=TEST_QUEUE, call_back=call_back, batch_size=10, batch_timeout=0, prefetch_count=100,
+        )
+
+        mock_channel.basic_qos.assert_called_once_with(prefetch_count=100)
+        call_back.assert_called_once_with([delivery])
+        mock_channel.basic_ack.assert_called_once_with(delivery_tag=1, multiple=True)
+
+    @mock.patch(CLIENT_PATH.format("BlockingConnection"))
+    def test_consume_batches_not_acked_on_error(self, mock_connection):
+        client = RabbitMQClient(host=TEST_HOST, port=TEST_PORT)
+        mock_channel = mock_connection.return_value.channel.return_value
+        delivery = (mock.MagicMock(delivery_tag=1), mock.MagicMock(), b"{}")
+        mock_channel.consume.return_value = iter([delivery])
+        call_back = mock.MagicMock(side_effect=KeyboardInterrupt)
+
+        with pytest.raises(KeyboardInterrupt):
+            client.consume_batches(queue_name=TEST_QUEUE, call_back=call_back, batch_size=1, batch_timeout=10)
+
+        mock_channel.basic_ack.assert_not_called()
+
+    @mock.patch(CLIENT_PATH.format("BlockingConnection"))
+    def test_consume_messages_workers(self, mock_connection):
+        client = RabbitMQClient(host=TEST_HOST, port=TEST_PORT)
+        mock_channel = mock_connection.return_value.channel.return_value
+        methods = [mock.MagicMock(delivery_tag=tag) for tag in (1, 2)]
+
+        def start_consuming():
+            on_message = mock_channel.basic_consume.call_args.kwargs["on_message_callback"]
+            for method in methods:
+                on_message(mock_channel, method, None, b"{}")
+
+        mock_channel.start_consuming.side_effect = start_consuming
+        threads = []
+
+        def call_back(ch, method, properties, body):
+            threads.append(threading.current_thread().name)
+            if method.delivery_tag == 1:
+                ack_threadsafe(ch, delivery_tag=method.delivery_tag)
+            else:
+                raise ValueError("broken")
+
+        client.consume_messages(
+            queue_name=TEST_QUEUE, call_back=call_back, prefetch_count=10, auto_ack=False, workers=2,
+        )
+
+        assert all(name.startswith("rabbitmq-consumer") for name in threads)
+        for settle in mock_channel.connection.add_callback_threadsafe.call_args_list:
+            settle.args[0]()
+        mock_channel.basic_qos.assert_called_once_with(prefetch_count=10)
+        mock_channel.basic_ack.assert_called_once_with(delivery_tag=1, multiple=False)
+        mock_channel.basic_nack.assert_called_once_with(delivery_tag=2, requeue=True)
+
+    @mock.patch(CLIENT_PATH.format("BlockingConnection"))
+    def test_consume_batches_workers(self, mock_connection):
+        client = RabbitMQClient(host=TEST_HOST, port=TEST_PORT)
+        mock_channel = mock_connection.return_value.channel.return_value
+        deliveries = [(mock.MagicMock(delivery_tag=tag), mock.MagicMock(), b"{}") for tag in range(1, 5)]
+        mock_channel.consume.return_value = iter(deliveries)
+        call_back = mock.MagicMock(side_effect=[None, ValueError("broken")])
+
+        client.consume_batches(queue_name=TEST_QUEUE, call_back=call_back, batch_size=2, batch_timeout=10, workers=3)
+
+        mock_channel.basic_qos.assert_called_once_with(prefetch_count=6)
+        assert call_back.call_count == 2
+        mock_channel.basic_ack.assert_not_called()
+        for settle in mock_channel.connection.add_callback_threadsafe.call_args_list:
+            settle.args[0]()
+        assert sorted(c.kwargs["delivery_tag"] for c in mock_channel.basic_ack.call_args_list) in ([1, 2], [3, 4])
+        assert len(mock_channel.basic_nack.call_args_list) == 2
+
+
+class TestThreadsafeAcks:
+    def test_ack_threadsafe(self):
+        mock_channel = mock.MagicMock()
+
+        ack_threadsafe(mock_channel, delivery_tag=1)
+        mock_channel.basic_ack.assert_not_called()
+        mock_channel.connection.add_callback_threadsafe.call_args.args[0]()
+
+        mock_channel.basic_ack.assert_called_once_with(delivery_tag=1, multiple=False)
+
+    def test_nack_threadsafe(self):
+        mock_channel = mock.MagicMock()
+
+        nack_threadsafe(mock_channel, delivery_tag=1, requeue=False)
+        mock_channel.connection.add_callback_threadsafe.call_args.args[0]()
+
+        mock_channel.basic_nack.assert_called_once_with(delivery_tag=1, requeue=False)
+
+    def test_ack_threadsafe_closed_connection(self):
+        mock_channel = mock.MagicMock()
+        mock_channel.connection.add_callback_threadsafe.side_effect = ConnectionWrongStateError
+
+        ack_threadsafe(mock_channel, delivery_tag=1)
+        nack_threadsafe(mock_channel, delivery_tag=2)
+
+        mock_channel.basic_ack.assert_not_called()
+        mock_channel.basic_nack.assert_not_called()
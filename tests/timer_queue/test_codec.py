@@ -0,0 +1,99 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import json
+import uuid
+from datetime import datetime, UTC
+from unittest import mock
+
+import pytest
+
+from timer_queue.codec import (
+    BINARY_CODEC,
+    BINARY_CONTENT_TYPE,
+    JSON_CODEC,
+    JSON_CONTENT_TYPE,
+    decode_message,
+    get_codec,
+)
+
+TEST_ID = uuid.uuid4()
+TEST_FIRE_AT = datetime(2024, 12, 1, 10, 1, 2, 345678, tzinfo=UTC)
+TEST_MESSAGE = {"id": TEST_ID, "url": "http://example.com", "fire_at": TEST_FIRE_AT, "hours": 1}
+
+
+class TestCodecs:
+    def test_json_codec(self):
+        body = JSON_CODEC.encode(TEST_MESSAGE)
+
+        assert json.loads(body) == {
+            "id": str(TEST_ID),
+            "url": "http://example.com",
+            "fire_at": "2024-12-01 10:01:02.345678+00:00",
+            "hours": 1,
+        }
+        assert JSON_CODEC.decode(body)["id"] == str(TEST_ID)
+
+    @pytest.mark.parametrize(
+        "message",
+        [
+            TEST_MESSAGE,
+            {"timers": [TEST_MESSAGE, TEST_MESSAGE]},
+            [None, True, False, 0, -1, 2 ** 40, -(2 ** 40), 1.5, "", "ünïcode", b"\x00\xff", []],
+            datetime(1960, 1, 1, tzinfo=UTC),
+        ],
+    )
+    def test_binary_codec_round_trip(self, message):
+        assert BINARY_CODEC.decode(BINARY_CODEC.encode(message)) == message
+
+    def test_binary_codec_is_compact(self):
+        assert len(BINARY_CODEC.encode(TEST_MESSAGE)) < len(JSON_CODEC.encode(TEST_MESSAGE)) * 0.6
+
+    def test_binary_codec_rejects_naive_datetime(self):
+        with pytest.raises(ValueError):
+            BINARY_CODEC.encode(datetime(2024, 1, 1))
+
+    @pytest.mark.parametrize("body", [b"", b"\x02\x00", b"\x01\x05\x10ab", b"\x01\x00\x00", b"\x01\x7f"])
+    def test_binary_codec_malformed(self, body):
+        with pytest.raises(ValueError):
+            BINARY_CODEC.decode(body)
+
+    @pytest.mark.parametrize(
+        "body",
+        [
+            # Timestamps beyond datetime's range, both as a single value and inside a message.
+            bytes((1, 10, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0x7F)),
+            bytes((1, 8, 1, 5, 7)) + b"fire_at" + bytes((10,)) + b"\x80" * 9 + bytes((1,)),
+            bytes((1,)) + bytes((7, 1)) * 100_000 + bytes((0,)),
+        ],
+        ids=["timestamp", "nested_timestamp", "deeply_nested"],
+    )
+    def test_binary_codec_out_of_range(self, body):
+        with pytest.raises(ValueError):
+            BINARY_CODEC.decode(body)
+
+    def test_json_codec_deeply_nested(self):
+        with pytest.raises(ValueError):
+            JSON_CODEC.decode(b"[" * 100_000 + b"]" * 100_000)
+
+    def test_get_codec(self):
+        assert get_codec(BINARY_CONTENT_TYPE) is BINARY_CODEC
+        assert get_codec(JSON_CONTENT_TYPE) is JSON_CODEC
+        assert get_codec(None) is JSON_CODEC
+        assert get_codec("text/plain") is JSON_CODEC
+
+    def test_decode_message(self):
+        properties = mock.MagicMock(content_type=BINARY_CONTENT_TYPE)
+
+        assert decode_message(properties, BINARY_CODEC.encode(TEST_MESSAGE)) == TEST_MESSAGE
+        assert decode_message(None, b'{"id": "x"}') == {"id": "x"}
@@ -0,0 +1,81 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from unittest import mock
+
+import pytest
+
+from timer_queue.delay import (
+    backoff_delays,
+    dead_letter_queue_name,
+    declare_delay_queues,
+    delay_for_attempt,
+    delay_queue_name,
+    delay_tier,
+)
+
+
+class TestDelay:
+    def test_queue_names(self):
+        assert delay_queue_name("to_fire", 2000) == "to_fire.delay.2000ms"
+        assert dead_letter_queue_name("to_fire") == "to_fire.dead"
+
+    @pytest.mark.parametrize(
+        "base_ms, max_ms, expected",
+        [
+            (1000, 1000, [1000]),
+            (1000, 8000, [1000, 2000, 4000, 8000]),
+            (1000, 5000, [1000, 2000, 4000, 5000]),
+        ],
+    )
+    def test_backoff_delays(self, base_ms, max_ms, expected):
+        assert backoff_delays(base_ms, max_ms) == expected
+
+    @pytest.mark.parametrize("base_ms, max_ms", [(0, 1000), (2000, 1000)])
+    def test_backoff_delays_invalid(self, base_ms, max_ms):
+        with pytest.raises(ValueError):
+            backoff_delays(base_ms, max_ms)
+
+    @pytest.mark.parametrize("attempt, expected", [(0, 1000), (1, 1000), (2, 2000), (3, 4000), (10, 4000)])
+    def test_delay_for_attempt(self, attempt, expected):
+        assert delay_for_attempt(attempt, [1000, 2000, 4000]) == expected
+
+    @pytest.mark.parametrize(
+        "delay_ms, expected",
+        [(-500, None), (0, None), (49, None), (50, 100), (150, 100), (399, 200), (400, 400), (60000, 400)],
+    )
+    def test_delay_tier(self, delay_ms, expected):
+        assert delay_tier(delay_ms, [100, 200, 400]) == expected
+
+    def test_delay_tier_without_tiers(self):
+        assert delay_tier(1000, []) is None
+
+    def test_declare_delay_queues(self):
+        channel = mock.MagicMock()
+
+        declare_delay_queues(channel, "to_fire", [1000, 2000])
+
+        assert channel.queue_declare.call_args_list == [
+            mock.call(
+                queue="to_fire.delay.1000ms",
+                durable=True,
+                arguments={"x-message-ttl": 1000, "x-dead-letter-exchange": "", "x-dead-letter-routing-key": "to_fire"},
+            ),
+            mock.call(
+                queue="to_fire.delay.2000ms",
+                durable=True,
+                arguments={"x-message-ttl": 2000, "x-dead-letter-exchange": "", "x-dead-letter-routing-key": "to_fire"},
+            ),
+            mock.call(queue="to_fire.dead", durable=True),
+        ]
@@ -0,0 +1,79 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from datetime import datetime, timedelta, timezone, UTC
+
+from timer_queue.trace import (
+    dump_trace,
+    firing_stages,
+    hop_time,
+    load_trace,
+    new_trace,
+    parse_time,
+    record_hop,
+)
+
+TEST_MOMENT = datetime(2024, 12, 1, 10, 0, tzinfo=UTC)
+
+
+class TestTrace:
+    def test_new_trace(self) -> None:
+        assert new_trace("test-trace") == {"id": "test-trace"}
+        assert new_trace()["id"] != new_trace()["id"]
+
+    def test_load_trace(self) -> None:
+        trace = {"id": "test-trace", "published_at": str(TEST_MOMENT)}
+
+        assert load_trace(trace) == trace
+        assert load_trace(trace) is not trace
+        assert load_trace(dump_trace(trace)) == trace
+
+    def test_load_trace_missing(self) -> None:
+        for value in (None, "not a json", "[]", {"published_at": str(TEST_MOMENT)}):
+            assert set(load_trace(value)) == {"id"}
+
+    def test_record_hop(self) -> None:
+        trace = new_trace("test-trace")
+
+        recorded = record_hop(trace, "consumed_at", at=TEST_MOMENT)
+
+        assert recorded == {"id": "test-trace", "consumed_at": TEST_MOMENT}
+        assert trace == {"id": "test-trace"}
+        assert record_hop(None, "consumed_at")["consumed_at"] > TEST_MOMENT
+
+    def test_hop_time(self) -> None:
+        trace = {"id": "test-trace", "published_at": TEST_MOMENT, "consumed_at": str(TEST_MOMENT), "claimed_at": "-"}
+
+        assert hop_time(trace, "published_at") == TEST_MOMENT
+        assert hop_time(trace, "consumed_at") == TEST_MOMENT
+        assert hop_time(trace, "claimed_at") is None
+        assert hop_time(trace, "received_at") is None
+        assert parse_time(42) is None
+
+    def test_parse_time_naive(self) -> None:
+        assert parse_time("2024-12-01 10:00:00") == TEST_MOMENT
+        assert parse_time(TEST_MOMENT.replace(tzinfo=None)) == TEST_MOMENT
+        assert parse_time(TEST_MOMENT.astimezone(timezone(timedelta(hours=3)))) == TEST_MOMENT
+
+    def test_firing_stages(self) -> None:
+        trace = {
+            "id": "test-trace",
+            "published_at": TEST_MOMENT,
+            "consumed_at": str(TEST_MOMENT + timedelta(seconds=1)),
+            "dispatched_at": TEST_MOMENT + timedelta(seconds=65),
+            "received_at": TEST_MOMENT + timedelta(seconds=65.5),
+        }
+
+        stages = firing_stages(trace, fire_at=TEST_MOMENT + timedelta(seconds=62))
+
+        assert stages == {"incoming_queue": 1, "outgoing_queue": 0.5, "poll_delay": 3}
@@ -0,0 +1,142 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+from trigger.engine import DeliveryResult, TriggerEngine
+
+TEST_URL = "http://example.com/hook"
+TEST_SLOW_URL = "http://slow.example.com/hook"
+TEST_PAYLOAD = {"id": "test-id"}
+
+
+class TestTriggerEngine:
+    def setup_method(self):
+        self.requests = []
+
+    def teardown_method(self):
+        self.engine.stop()
+
+    def start_engine(self, handler, **kwargs) -> TriggerEngine:
+        self.engine = TriggerEngine(transport=httpx.MockTransport(handler), **kwargs)
+        self.engine.start()
+        return self.engine
+
+    def test_submit(self):
+        def handler(request: httpx.Request) -> httpx.Response:
+            self.requests.append(request)
+            return httpx.Response(204)
+
+        done = threading.Event()
+        results = []
+        engine = self.start_engine(handler)
+
+        engine.submit(TEST_URL, TEST_PAYLOAD, on_done=lambda result: (results.append(result), done.set()))
+
+        assert done.wait(timeout=5)
+        assert results[0].ok
+        assert results[0].status_code == 204
+        assert self.requests[0].url == TEST_URL
+        assert self.requests[0].content == b'{"id":"test-id"}'
+        assert engine._host_semaphores == {}
+
+    @pytest.mark.parametrize("status_code", [404, 500])
+    def test_submit_not_ok(self, status_code):
+        done = threading.Event()
+        results = []
+        engine = self.start_engine(lambda request: httpx.Response(status_code))
+
+        engine.submit(TEST_URL, TEST_PAYLOAD, on_done=lambda result: (results.append(result), done.set()))
+
+        assert done.wait(timeout=5)
+        assert not results[0].ok
+        assert results[0].status_code == status_code
+
+    def test_submit_error(self):
+        def handler(request: httpx.Request) -> httpx.Response:
+            raise httpx.ConnectTimeout("timed out", request=request)
+
+        done = threading.Event()
+        results: list[DeliveryResult] = []
+        engine = self.start_engine(handler)
+
+        engine.submit(TEST_URL, TEST_PAYLOAD, on_done=lambda result: (results.append(result), done.set()))
+
+        assert done.wait(timeout=5)
+        assert results[0].status_code is None
+        assert "ConnectTimeout" in results[0].error
+
+    @pytest.mark.parametrize("url", ["http://[bad", "http://host\x00name/hook", "http://:99999/hook"])
+    def test_submit_malformed_url(self, url):
+        done = threading.Event()
+        results: list[DeliveryResult] = []
+        engine = self.start_engine(lambda request: httpx.Response(200))
+
+        engine.submit(url, TEST_PAYLOAD, on_done=lambda result: (results.append(result), done.set()))
+
+        assert done.wait(timeout=5)
+        assert results[0].status_code is None
+        assert results[0].permanent
+        assert not results[0].retryable
+        assert engine._host_semaphores == {}
+
+    def test_per_host_concurrency(self):
+        release = asyncio.Event()
+        in_flight = {"slow": 0, "max_slow": 0}
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            if request.url.host == "slow.example.com":
+                in_flight["slow"] += 1
+                in_flight["max_slow"] = max(in_flight["max_slow"], in_flight["slow"])
+                await release.wait()
+                in_flight["slow"] -= 1
+            return httpx.Response(200)
+
+        fast_done = threading.Event()
+        slow_done = threading.Semaphore(0)
+        engine = self.start_engine(handler, concurrency=10, per_host_concurrency=2)
+
+        for _ in range(3):
+            engine.submit(TEST_SLOW_URL, TEST_PAYLOAD, on_done=lambda result: slow_done.release())
+        engine.submit(TEST_URL, TEST_PAYLOAD, on_done=lambda result: fast_done.set())
+
+        assert fast_done.wait(timeout=5)
+        assert in_flight["max_slow"] == 2
+        assert list(engine._host_semaphores) == ["slow.example.com"]
+        assert engine._host_semaphores["slow.example.com"][1] == 3
+        engine._loop.call_soon_threadsafe(release.set)
+        assert all(slow_done.acquire(timeout=5) for _ in range(3))
+        assert engine._host_semaphores == {}
+
+    def test_slow_host_keeps_global_slots(self):
+        release = asyncio.Event()
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            if request.url.host == "slow.example.com":
+                await release.wait()
+            return httpx.Response(200)
+
+        fast_done = threading.Event()
+        engine = self.start_engine(handler, concurrency=2, per_host_concurrency=1)
+
+        for _ in range(4):
+            engine.submit(TEST_SLOW_URL, TEST_PAYLOAD, on_done=lambda result: None)
+        engine.submit(TEST_URL, TEST_PAYLOAD, on_done=lambda result: fast_done.set())
+
+        assert fast_done.wait(timeout=1)
+        engine._loop.call_soon_threadsafe(release.set)
@@ -0,0 +1,261 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import json
+import uuid
+from datetime import datetime, timedelta, UTC
+from unittest import mock
+
+from timer_queue.codec import BINARY_CODEC, BINARY_CONTENT_TYPE
+from trigger.engine import DeliveryResult
+from trigger.main import delivery_attempt, fire_hooks, report_firing, waiting_delays
+
+TEST_ID = "test-id"
+TEST_URL = "http://example.com"
+TEST_UUID = str(uuid.uuid4())
+TRIGGER_PATH = "trigger.main.{}"
+
+
+@mock.patch(TRIGGER_PATH.format("METRICS_PORT"), 0)
+class TestTrigger:
+    @mock.patch(TRIGGER_PATH.format("RabbitMQClient"))
+    @mock.patch(TRIGGER_PATH.format("TriggerEngine"))
+    def test_fire_hooks(self, mock_engine, mock_rabbit_client):
+        mock_channel = mock.MagicMock()
+        method = mock.MagicMock(delivery_tag=7)
+
+        def consume_messages(queue_name, call_back, **kwargs):
+            assert kwargs == {"prefetch_count": 1000, "auto_ack": False, "setup": mock.ANY}
+            call_back(mock_channel, method, None, json.dumps({"id": TEST_ID, "url": TEST_URL}).encode())
+            raise KeyboardInterrupt
+
+        mock_rabbit_client.return_value.consume_messages.side_effect = consume_messages
+
+        fire_hooks()
+
+        mock_engine.return_value.start.assert_called_once()
+        mock_engine.return_value.stop.assert_called_once()
+        submit = mock_engine.return_value.submit
+        submit.assert_called_once_with(url=TEST_URL, payload={"id": TEST_ID}, on_done=mock.ANY)
+        mock_channel.connection.add_callback_threadsafe.assert_not_called()
+
+        submit.call_args.kwargs["on_done"](DeliveryResult(url=TEST_URL, status_code=200, error=None, elapsed=0.1))
+
+        ack = mock_channel.connection.add_callback_threadsafe.call_args.args[0]
+        ack()
+        mock_channel.basic_ack.assert_called_once_with(delivery_tag=7, multiple=False)
+
+    @mock.patch(TRIGGER_PATH.format("report_firing"))
+    @mock.patch(TRIGGER_PATH.format("RabbitMQClient"))
+    @mock.patch(TRIGGER_PATH.format("TriggerEngine"))
+    def test_fire_hooks_reports_firing(self, mock_engine, mock_rabbit_client, mock_report_firing):
+        fire_at = datetime.now(UTC) - timedelta(seconds=1)
+        body = {"id": TEST_ID, "url": TEST_URL, "fire_at": str(fire_at), "trace": {"id": "test-trace"}}
+
+        def consume_messages(queue_name, call_back, **kwargs):
+            retry = mock.MagicMock(headers={"x-attempts": 1})
+            call_back(mock.MagicMock(), mock.MagicMock(delivery_tag=7), None, json.dumps(body).encode())
+            call_back(mock.MagicMock(), mock.MagicMock(delivery_tag=8), retry, json.dumps(body).encode())
+            raise KeyboardInterrupt
+
+        mock_rabbit_client.return_value.consume_messages.side_effect = consume_messages
+        result = DeliveryResult(url=TEST_URL, status_code=200, error=None, elapsed=0.1)
+
+        fire_hooks()
+        for call in mock_engine.return_value.submit.call_args_list:
+            call.kwargs["on_done"](result)
+
+        mock_report_firing.assert_called_once_with(TEST_ID, fire_at, mock.ANY, result)
+        trace = mock_report_firing.call_args.args[2]
+        assert trace["id"] == "test-trace"
+        assert trace["received_at"] > fire_at
+
+    @mock.patch(TRIGGER_PATH.format("logger"))
+    @mock.patch(TRIGGER_PATH.format("observe_firing"))
+    def test_report_firing(self, mock_observe_firing, mock_logger):
+        fire_at = datetime.now(UTC) - timedelta(seconds=10)
+        trace = {
+            "id": "test-trace",
+            "published_at": str(fire_at - timedelta(seconds=60)),
+            "consumed_at": str(fire_at - timedelta(seconds=59)),
+            "claimed_at": fire_at + timedelta(seconds=1),
+            "dispatched_at": fire_at + timedelta(seconds=1),
+            "received_at": fire_at + timedelta(seconds=3),
+        }
+
+        report_firing(TEST_ID, fire_at, trace, DeliveryResult(TEST_URL, 200, None, 0.5))
+
+        lateness, stages = mock_observe_firing.call_args.args
+        assert 9 < lateness < 10
+        assert stages["incoming_queue"] == 1
+        assert stages["db_wait"] == 60
+        assert stages["poll_delay"] == 1
+        assert stages["outgoing_queue"] == 2
+        assert 6 < stages["trigger_wait"] < 7
+        assert stages["http"] == 0.5
+        mock_logger.info.assert_called_once()
+        assert "test-trace" in mock_logger.info.call_args.args
+
+    @mock.patch(TRIGGER_PATH.format("RabbitMQClient"))
+    @mock.patch(TRIGGER_PATH.format("TriggerEngine"))
+    def test_fire_hooks_malformed_message(self, mock_engine, mock_rabbit_client):
+        mock_channel = mock.MagicMock()
+
+        def consume_messages(queue_name, call_back, **kwargs):
+            call_back(mock_channel, mock.MagicMock(delivery_tag=3), None, b"broken")
+            raise KeyboardInterrupt
+
+        mock_rabbit_client.return_value.consume_messages.side_effect = consume_messages
+
+        fire_hooks()
+
+        mock_engine.return_value.submit.assert_not_called()
+        mock_channel.basic_ack.assert_called_once_with(delivery_tag=3)
+
+    @mock.patch(TRIGGER_PATH.format("RabbitMQClient"))
+    @mock.patch(TRIGGER_PATH.format("TriggerEngine"))
+    def deliver(self, result, headers, mock_engine, mock_rabbit_client):
+        """Fires a hook of a message with given headers, completes it with a given result and returns the channel."""
+        mock_channel = mock.MagicMock()
+        body = json.dumps({"id": TEST_ID, "url": TEST_URL}).encode()
+
+        def consume_messages(queue_name, call_back, **kwargs):
+            kwargs["setup"](mock_channel)
+            call_back(mock_channel, mock.MagicMock(delivery_tag=5), mock.MagicMock(headers=headers), body)
+            raise KeyboardInterrupt
+
+        mock_rabbit_client.return_value.consume_messages.side_effect = consume_messages
+
+        with mock.patch(TRIGGER_PATH.format("RABBIT_MQ_TO_FIRE"), "to_fire"):
+            fire_hooks()
+            mock_engine.return_value.submit.call_args.kwargs["on_done"](result)
+
+        mock_channel.basic_ack.assert_not_called()
+        mock_channel.connection.add_callback_threadsafe.call_args.args[0]()
+        mock_channel.basic_ack.assert_called_once()
+        assert mock_channel.basic_ack.call_args.kwargs["delivery_tag"] == 5
+        return mock_channel
+
+    def test_fire_hooks_declares_delay_queues(self):
+        mock_channel = self.deliver(DeliveryResult(TEST_URL, 200, None, 0.1), None)
+
+        declared = [c.kwargs["queue"] for c in mock_channel.queue_declare.call_args_list]
+        assert declared[0] == "to_fire.delay.1000ms"
+        assert declared[-2] == "to_fire.delay.300000ms"
+        assert declared[-1] == "to_fire.dead"
+        mock_channel.basic_publish.assert_not_called()
+
+    def test_fire_hooks_retries_failed_delivery(self):
+        mock_channel = self.deliver(DeliveryResult(TEST_URL, 503, None, 0.1), {"x-attempts": 2})
+
+        publish = mock_channel.basic_publish.call_args.kwargs
+        assert publish["routing_key"] == "to_fire.delay.4000ms"
+        assert publish["properties"].headers == {"x-attempts": 3}
+        assert json.loads(publish["body"]) == {"id": TEST_ID, "url": TEST_URL}
+
+    def test_fire_hooks_dead_letters_after_max_attempts(self):
+        mock_channel = self.deliver(DeliveryResult(TEST_URL, None, "timeout", 10.0), {"x-attempts": 4})
+
+        publish = mock_channel.basic_publish.call_args.kwargs
+        assert publish["routing_key"] == "to_fire.dead"
+        assert publish["properties"].headers == {"x-attempts": 5}
+
+    def test_fire_hooks_dead_letters_client_error(self):
+        mock_channel = self.deliver(DeliveryResult(TEST_URL, 404, None, 0.1), None)
+
+        publish = mock_channel.basic_publish.call_args.kwargs
+        assert publish["routing_key"] == "to_fire.dead"
+        assert publish["properties"].headers == {"x-attempts": 1}
+
+    @mock.patch(TRIGGER_PATH.format("RabbitMQClient"))
+    @mock.patch(TRIGGER_PATH.format("TriggerEngine"))
+    def test_fire_hooks_binary_message(self, mock_engine, mock_rabbit_client):
+        mock_channel = mock.MagicMock()
+        properties = mock.MagicMock(content_type=BINARY_CONTENT_TYPE, headers=None)
+        body = BINARY_CODEC.encode({"id": uuid.UUID(TEST_UUID), "url": TEST_URL})
+
+        def consume_messages(queue_name, call_back, **kwargs):
+            call_back(mock_channel, mock.MagicMock(delivery_tag=2), properties, body)
+            raise KeyboardInterrupt
+
+        mock_rabbit_client.return_value.consume_messages.side_effect = consume_messages
+
+        fire_hooks()
+        mock_engine.return_value.submit.call_args.kwargs["on_done"](DeliveryResult(TEST_URL, 500, None, 0.1))
+        mock_channel.connection.add_callback_threadsafe.call_args.args[0]()
+
+        submit = mock_engine.return_value.submit
+        submit.assert_called_once_with(url=TEST_URL, payload={"id": TEST_UUID}, on_done=mock.ANY)
+        publish = mock_channel.basic_publish.call_args.kwargs
+        assert publish["body"] == body
+        assert publish["properties"].content_type == BINARY_CONTENT_TYPE
+
+    @mock.patch(TRIGGER_PATH.format("RABBIT_MQ_TO_FIRE"), "to_fire")
+    @mock.patch(TRIGGER_PATH.format("TIMER_FAST_PATH_RESOLUTION_MS"), 500)
+    @mock.patch(TRIGGER_PATH.format("TIMER_FAST_PATH_THRESHOLD_SECONDS"), 4)
+    @mock.patch(TRIGGER_PATH.format("RabbitMQClient"))
+    @mock.patch(TRIGGER_PATH.format("TriggerEngine"))
+    def test_fire_hooks_delays_early_message(self, mock_engine, mock_rabbit_client):
+        mock_channel = mock.MagicMock()
+        fire_at = datetime.now(UTC) + timedelta(seconds=3)
+        body = json.dumps({"id": TEST_ID, "url": TEST_URL, "fire_at": str(fire_at)}).encode()
+
+        def consume_messages(queue_name, call_back, **kwargs):
+            kwargs["setup"](mock_channel)
+            call_back(mock_channel, mock.MagicMock(delivery_tag=4), mock.MagicMock(headers=None), body)
+            raise KeyboardInterrupt
+
+        mock_rabbit_client.return_value.consume_messages.side_effect = consume_messages
+
+        fire_hooks()
+
+        mock_engine.return_value.submit.assert_not_called()
+        declared = [c.kwargs["queue"] for c in mock_channel.queue_declare.call_args_list]
+        assert declared[:4] == [f"to_fire.delay.{delay}ms" for delay in (500, 1000, 2000, 4000)]
+        publish = mock_channel.basic_publish.call_args.kwargs
+        assert publish["routing_key"] == "to_fire.delay.2000ms"
+        assert publish["body"] == body
+        assert publish["properties"].headers == {"x-attempts": 0}
+        mock_channel.basic_ack.assert_called_once_with(delivery_tag=4)
+
+    @mock.patch(TRIGGER_PATH.format("RabbitMQClient"))
+    @mock.patch(TRIGGER_PATH.format("TriggerEngine"))
+    def test_fire_hooks_naive_fire_at(self, mock_engine, mock_rabbit_client):
+        body = json.dumps({"id": TEST_ID, "url": TEST_URL, "fire_at": "2024-01-01 00:00:00"}).encode()
+
+        def consume_messages(queue_name, call_back, **kwargs):
+            call_back(mock.MagicMock(), mock.MagicMock(delivery_tag=4), mock.MagicMock(headers=None), body)
+            raise KeyboardInterrupt
+
+        mock_rabbit_client.return_value.consume_messages.side_effect = consume_messages
+
+        fire_hooks()
+
+        mock_engine.return_value.submit.assert_called_once()
+        assert mock_engine.return_value.submit.call_args.kwargs["url"] == TEST_URL
+
+    @mock.patch(TRIGGER_PATH.format("TIMER_FAST_PATH_THRESHOLD_SECONDS"), 0)
+    def test_waiting_delays_without_fast_path(self):
+        assert waiting_delays([1000, 2000]) == [1000, 2000]
+
+    @mock.patch(TRIGGER_PATH.format("TIMER_FAST_PATH_RESOLUTION_MS"), 500)
+    @mock.patch(TRIGGER_PATH.format("TIMER_FAST_PATH_THRESHOLD_SECONDS"), 2)
+    def test_waiting_delays(self):
+        assert waiting_delays([1000, 4000]) == [500, 1000, 2000, 4000]
+
+    def test_delivery_attempt(self):
+        assert delivery_attempt(None) == 1
+        assert delivery_attempt(mock.MagicMock(headers=None)) == 1
+        assert delivery_attempt(mock.MagicMock(headers={"x-attempts": 3})) == 4
+        assert delivery_attempt(mock.MagicMock(headers={"x-attempts": "broken"})) == 1
@@ -0,0 +1,69 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import uuid
+from datetime import timedelta
+
+import pytest
+
+from webserver.cache.timers import TimerCache
+from webserver.utils.timer import utc_now
+
+
+class TestTimerCache:
+    def test_get(self) -> None:
+        cache = TimerCache(max_size=2)
+        timer_id = uuid.uuid4()
+        fire_at = utc_now() + timedelta(minutes=1)
+
+        cache.put(timer_id, fire_at)
+
+        assert cache.get(timer_id) == fire_at
+        assert cache.get(uuid.uuid4()) is None
+
+    def test_fired_timer_evicted(self) -> None:
+        cache = TimerCache(max_size=2)
+        timer_id = uuid.uuid4()
+        cache.put(timer_id, utc_now() + timedelta(minutes=1))
+        cache.put(uuid.uuid4(), utc_now() - timedelta(seconds=1))
+
+        assert len(cache) == 1
+        cache._fire_at[timer_id] = utc_now() - timedelta(seconds=1)
+        assert cache.get(timer_id) is None
+        assert len(cache) == 0
+
+    def test_least_recently_used_evicted(self) -> None:
+        cache = TimerCache(max_size=2)
+        fire_at = utc_now() + timedelta(minutes=1)
+        first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        cache.put(first, fire_at)
+        cache.put(second, fire_at)
+        cache.get(first)
+
+        cache.put(third, fire_at)
+
+        assert len(cache) == 2
+        assert cache.get(second) is None
+        assert cache.get(first) == fire_at
+        assert cache.get(third) == fire_at
+
+    def test_disabled(self) -> None:
+        cache = TimerCache(max_size=0)
+
+        cache.put(uuid.uuid4(), utc_now() + timedelta(minutes=1))
+
+        assert len(cache) == 0
+
+    def test_negative_size(self) -> None:
+        with pytest.raises(ValueError):
+            TimerCache(max_size=-1)
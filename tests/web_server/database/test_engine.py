@@ -0,0 +1,60 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+from unittest import mock
+
+from metrics.registry import DB_QUERY_LATENCY
+from webserver.database.engine import record_query, start_query_timer
+
+ENGINE_PATH = "webserver.database.engine.{}"
+
+
+class TestQueryTiming:
+    @mock.patch(ENGINE_PATH.format("SQL_SLOW_QUERY_MS"), 100)
+    @mock.patch(ENGINE_PATH.format("perf_counter"))
+    @mock.patch(ENGINE_PATH.format("logger"))
+    def test_slow_query_logged(self, mock_logger, mock_perf_counter) -> None:
+        conn = mock.MagicMock(info={})
+        mock_perf_counter.side_effect = [1.0, 1.5]
+
+        start_query_timer(conn, None, "SELECT 1", None, None, False)
+        record_query(conn, None, "SELECT 1", None, None, False)
+
+        mock_logger.warning.assert_called_once_with("Slow query took %.1f ms: %s", 500.0, "SELECT 1")
+
+    @mock.patch(ENGINE_PATH.format("SQL_SLOW_QUERY_MS"), 100)
+    @mock.patch(ENGINE_PATH.format("perf_counter"))
+    @mock.patch(ENGINE_PATH.format("logger"))
+    def test_fast_query_not_logged(self, mock_logger, mock_perf_counter) -> None:
+        conn = mock.MagicMock(info={})
+        mock_perf_counter.side_effect = [1.0, 1.01]
+
+        start_query_timer(conn, None, "SELECT 1", None, None, False)
+        record_query(conn, None, "SELECT 1", None, None, False)
+
+        mock_logger.warning.assert_not_called()
+
+    @mock.patch(ENGINE_PATH.format("SQL_SLOW_QUERY_MS"), 0)
+    @mock.patch(ENGINE_PATH.format("perf_counter"))
+    @mock.patch(ENGINE_PATH.format("logger"))
+    def test_query_latency_recorded(self, mock_logger, mock_perf_counter) -> None:
+        conn = mock.MagicMock(info={})
+        mock_perf_counter.side_effect = [1.0, 1.5]
+        histogram = DB_QUERY_LATENCY.labels("select")
+        observed = histogram._sum.get()
+
+        start_query_timer(conn, None, "SELECT 1", None, None, False)
+        record_query(conn, None, "SELECT 1", None, None, False)
+
+        assert histogram._sum.get() - observed == 0.5
+        mock_logger.warning.assert_not_called()
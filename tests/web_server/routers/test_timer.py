@@ -0,0 +1,243 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+import uuid
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+from timer_queue.exceptions import RabbitMqConnectionException
+from webserver.broker.client import get_queue_client
+from webserver.cache.timers import TimerCache, get_timer_cache
+from webserver.database.engine import get_async_session
+from webserver.main import app
+from webserver.models.timers import Timers
+from webserver.utils.timer import utc_now
+
+TEST_TIMER = {"hours": 0, "minutes": 1, "seconds": 2, "url": "http://example.com"}
+TEST_SHORT_TIMER = {"hours": 0, "minutes": 0, "seconds": 5, "url": "http://example.com/short"}
+TIMER_PATH = "webserver.routers.timer.{}"
+
+
+class TestTimerEndpoints:
+    def setup_method(self) -> None:
+        self.queue_client = mock.AsyncMock()
+        app.dependency_overrides[get_queue_client] = lambda: self.queue_client
+        self.timer_cache = TimerCache(max_size=10)
+        app.dependency_overrides[get_timer_cache] = lambda: self.timer_cache
+        self.client = TestClient(app)
+
+    def teardown_method(self) -> None:
+        app.dependency_overrides.clear()
+
+    def test_create_timer(self) -> None:
+        response = self.client.post("/timer/", json=TEST_TIMER)
+
+        assert response.status_code == 200
+        timer_id = response.json()["id"]
+        self.queue_client.push_message.assert_awaited_once()
+        message = self.queue_client.push_message.call_args.kwargs["message"]
+        assert message["id"] == uuid.UUID(timer_id)
+        assert message["url"] == TEST_TIMER["url"]
+        assert message["trace"]["id"] == response.headers["X-Trace-Id"]
+        assert message["trace"]["published_at"] is not None
+        assert self.timer_cache.get(uuid.UUID(timer_id)) is not None
+
+    def test_create_timer_traced(self) -> None:
+        response = self.client.post("/timer/", json=TEST_TIMER, headers={"X-Trace-Id": "test-trace"})
+
+        assert response.status_code == 200
+        assert response.headers["X-Trace-Id"] == "test-trace"
+        message = self.queue_client.push_message.call_args.kwargs["message"]
+        assert message["trace"]["id"] == "test-trace"
+
+    def test_create_timer_broker_unavailable(self) -> None:
+        self.queue_client.push_message.side_effect = RabbitMqConnectionException
+
+        response = self.client.post("/timer/", json=TEST_TIMER)
+
+        assert response.status_code == 503
+        assert len(self.timer_cache) == 0
+
+    @mock.patch(TIMER_PATH.format("RABBIT_MQ_TO_FIRE"), "to_fire")
+    @mock.patch(TIMER_PATH.format("RABBIT_MQ_INCOMING"), "incoming")
+    @mock.patch(TIMER_PATH.format("TIMER_FAST_PATH_RESOLUTION_MS"), 1000)
+    @mock.patch(TIMER_PATH.format("TIMER_FAST_PATH_THRESHOLD_SECONDS"), 60)
+    def test_create_timer_fast_path(self) -> None:
+        response = self.client.post("/timer/", json=TEST_SHORT_TIMER)
+
+        assert response.status_code == 200
+        timer_id = uuid.UUID(response.json()["id"])
+        fire_call, record_call = self.queue_client.push_message.await_args_list
+        assert record_call.kwargs["queue_name"] == "incoming"
+        assert record_call.kwargs["message"]["id"] == timer_id
+        assert record_call.kwargs["message"]["fired_by_broker"] is True
+        assert fire_call.kwargs["queue_name"] == "to_fire.delay.4000ms"
+        assert fire_call.kwargs["arguments"] == {
+            "x-message-ttl": 4000, "x-dead-letter-exchange": "", "x-dead-letter-routing-key": "to_fire",
+        }
+        message = fire_call.kwargs["message"]
+        assert set(message) == {"id", "url", "fire_at", "trace"}
+        assert message["id"] == timer_id
+        assert message["fire_at"] == record_call.kwargs["message"]["fire_at"]
+        assert message["trace"]["id"] == response.headers["X-Trace-Id"]
+
+    @mock.patch(TIMER_PATH.format("RABBIT_MQ_TO_FIRE"), "to_fire")
+    @mock.patch(TIMER_PATH.format("TIMER_FAST_PATH_THRESHOLD_SECONDS"), 60)
+    def test_create_timer_fast_path_due(self) -> None:
+        response = self.client.post("/timer/", json={**TEST_SHORT_TIMER, "seconds": 0})
+
+        assert response.status_code == 200
+        fire_call = self.queue_client.push_message.await_args_list[0]
+        assert fire_call.kwargs["queue_name"] == "to_fire"
+        assert "arguments" not in fire_call.kwargs
+
+    @mock.patch(TIMER_PATH.format("TIMER_FAST_PATH_THRESHOLD_SECONDS"), 60)
+    def test_create_timer_fast_path_long_timer(self) -> None:
+        response = self.client.post("/timer/", json=TEST_TIMER)
+
+        assert response.status_code == 200
+        self.queue_client.push_message.assert_awaited_once()
+        assert "fired_by_broker" not in self.queue_client.push_message.call_args.kwargs["message"]
+
+    @mock.patch(TIMER_PATH.format("TIMER_FAST_PATH_THRESHOLD_SECONDS"), 60)
+    def test_create_timer_fast_path_broker_unavailable(self) -> None:
+        self.queue_client.push_message.side_effect = [RabbitMqConnectionException]
+
+        response = self.client.post("/timer/", json=TEST_SHORT_TIMER)
+
+        # The record isn't published without the firing message, so no timer is left recorded as fired by the broker.
+        assert response.status_code == 503
+        self.queue_client.push_message.assert_awaited_once()
+        assert "fired_by_broker" not in self.queue_client.push_message.call_args.kwargs["message"]
+        assert len(self.timer_cache) == 0
+
+    @mock.patch(TIMER_PATH.format("RABBIT_MQ_INCOMING"), "incoming")
+    @mock.patch(TIMER_PATH.format("TIMER_FAST_PATH_THRESHOLD_SECONDS"), 60)
+    def test_create_timer_fast_path_record_failed(self) -> None:
+        self.queue_client.push_message.side_effect = [None, RabbitMqConnectionException]
+
+        response = self.client.post("/timer/", json=TEST_SHORT_TIMER)
+
+        assert response.status_code == 503
+        fire_call, record_call = self.queue_client.push_message.await_args_list
+        assert record_call.kwargs["queue_name"] == "incoming"
+        assert record_call.kwargs["message"]["id"] == fire_call.kwargs["message"]["id"]
+        assert len(self.timer_cache) == 0
+
+    def test_create_timer_invalid(self) -> None:
+        response = self.client.post("/timer/", json={**TEST_TIMER, "hours": -1})
+
+        assert response.status_code == 422
+        self.queue_client.push_message.assert_not_called()
+
+    @mock.patch("webserver.routers.timer.TIMER_BATCH_MESSAGE_SIZE", 2)
+    def test_create_timers(self) -> None:
+        timers = [{**TEST_TIMER, "url": f"http://example.com/{i}"} for i in range(3)]
+
+        response = self.client.post("/timer/batch", json=timers)
+
+        assert response.status_code == 200
+        ids = response.json()["ids"]
+        assert len(ids) == 3
+        envelopes = [call.kwargs["message"] for call in self.queue_client.push_message.await_args_list]
+        assert [len(envelope["timers"]) for envelope in envelopes] == [2, 1]
+        published = [timer for envelope in envelopes for timer in envelope["timers"]]
+        assert [str(timer["id"]) for timer in published] == ids
+        assert [timer["url"] for timer in published] == [timer["url"] for timer in timers]
+        assert {timer["trace"]["id"] for timer in published} == {response.headers["X-Trace-Id"]}
+        assert all(self.timer_cache.get(uuid.UUID(timer_id)) for timer_id in ids)
+
+    @mock.patch(TIMER_PATH.format("RABBIT_MQ_TO_FIRE"), "to_fire")
+    @mock.patch(TIMER_PATH.format("RABBIT_MQ_INCOMING"), "incoming")
+    @mock.patch(TIMER_PATH.format("TIMER_FAST_PATH_THRESHOLD_SECONDS"), 60)
+    def test_create_timers_fast_path(self) -> None:
+        response = self.client.post("/timer/batch", json=[TEST_TIMER, TEST_SHORT_TIMER])
+
+        assert response.status_code == 200
+        ids = [uuid.UUID(timer_id) for timer_id in response.json()["ids"]]
+        fire_call, envelope_call = self.queue_client.push_message.await_args_list
+        assert envelope_call.kwargs["queue_name"] == "incoming"
+        assert ["fired_by_broker" in timer for timer in envelope_call.kwargs["message"]["timers"]] == [False, True]
+        assert fire_call.kwargs["queue_name"].startswith("to_fire.delay.")
+        assert fire_call.kwargs["message"]["id"] == ids[1]
+
+    @mock.patch(TIMER_PATH.format("RABBIT_MQ_TO_FIRE"), "to_fire")
+    @mock.patch(TIMER_PATH.format("TIMER_FAST_PATH_THRESHOLD_SECONDS"), 60)
+    def test_create_timers_fast_path_broker_unavailable(self) -> None:
+        self.queue_client.push_message.side_effect = [RabbitMqConnectionException]
+
+        response = self.client.post("/timer/batch", json=[TEST_TIMER, TEST_SHORT_TIMER])
+
+        assert response.status_code == 503
+        self.queue_client.push_message.assert_awaited_once()
+        assert self.queue_client.push_message.call_args.kwargs["queue_name"].startswith("to_fire.delay.")
+        assert len(self.timer_cache) == 0
+
+    def test_create_timers_broker_unavailable(self) -> None:
+        self.queue_client.push_message.side_effect = RabbitMqConnectionException
+
+        response = self.client.post("/timer/batch", json=[TEST_TIMER])
+
+        assert response.status_code == 503
+        assert len(self.timer_cache) == 0
+
+    def test_create_timers_invalid(self) -> None:
+        assert self.client.post("/timer/batch", json=[TEST_TIMER, {**TEST_TIMER, "hours": -1}]).status_code == 422
+        assert self.client.post("/timer/batch", json=[]).status_code == 422
+        self.queue_client.push_message.assert_not_called()
+
+    def test_get_timer(self) -> None:
+        timer = Timers(id=uuid.uuid4(), created_at=utc_now(), **TEST_TIMER)
+        session = mock.AsyncMock()
+        session.get.return_value = timer
+        app.dependency_overrides[get_async_session] = lambda: session
+
+        response = self.client.get(f"/timer/{timer.id}")
+
+        assert response.status_code == 200
+        assert response.json()["id"] == str(timer.id)
+        assert response.json()["time_left"] in (61, 62)
+        session.get.assert_awaited_once_with(Timers, timer.id)
+
+    def test_get_timer_not_found(self) -> None:
+        session = mock.AsyncMock()
+        session.get.return_value = None
+        app.dependency_overrides[get_async_session] = lambda: session
+
+        assert self.client.get(f"/timer/{uuid.uuid4()}").status_code == 404
+        assert self.client.get("/timer/not-a-uuid").status_code == 404
+        session.get.assert_awaited_once()
+
+    def test_get_timer_cached(self) -> None:
+        session = mock.AsyncMock()
+        app.dependency_overrides[get_async_session] = lambda: session
+        timer_id = self.client.post("/timer/", json=TEST_TIMER).json()["id"]
+
+        response = self.client.get(f"/timer/{timer_id}")
+
+        assert response.status_code == 200
+        assert response.json()["time_left"] in (61, 62)
+        session.get.assert_not_awaited()
+
+    def test_get_timer_caches_database_result(self) -> None:
+        timer = Timers(id=uuid.uuid4(), created_at=utc_now(), **TEST_TIMER)
+        session = mock.AsyncMock()
+        session.get.return_value = timer
+        app.dependency_overrides[get_async_session] = lambda: session
+
+        self.client.get(f"/timer/{timer.id}")
+        response = self.client.get(f"/timer/{timer.id}")
+
+        assert response.status_code == 200
+        session.get.assert_awaited_once()
@@ -0,0 +1,69 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""Bounded in-memory heap of claimed timers waiting for their firing moment"""
+import heapq
+from datetime import datetime
+from typing import Any, NamedTuple, Optional
+
+
+class ScheduledTimer(NamedTuple):
+    """Timer claimed from the database, ordered by its firing moment."""
+    fire_at: datetime
+    id: str
+    url: str
+    trace: Optional[dict[str, Any]] = None
+
+
+class TimerHeap:
+    """
+    Min-heap of timers ordered by ``fire_at`` holding at most ``capacity`` timers.
+
+    The heap also remembers when the lookahead window should be refilled from the database next time.
+    """
+    def __init__(self, capacity: int) -> None:
+        if capacity < 1:
+            raise ValueError("Heap capacity must be a positive number")
+        self.capacity = capacity
+        self.next_refill_at = 0.0
+        self._heap: list[ScheduledTimer] = []
+        self._ids: set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    @property
+    def free_slots(self) -> int:
+        return self.capacity - len(self._heap)
+
+    def push(self, timer_id: Any, fire_at: datetime, url: str, trace: Optional[dict[str, Any]] = None) -> bool:
+        """Adds a timer unless it's already scheduled or the heap is full. Returns whether it was added."""
+        timer_id = str(timer_id)
+        if timer_id in self._ids or not self.free_slots:
+            return False
+        heapq.heappush(self._heap, ScheduledTimer(fire_at=fire_at, id=timer_id, url=url, trace=trace))
+        self._ids.add(timer_id)
+        return True
+
+    def next_fire_at(self) -> Optional[datetime]:
+        """Retrieves the firing moment of the earliest scheduled timer."""
+        return self._heap[0].fire_at if self._heap else None
+
+    def pop_due(self, now: datetime) -> list[ScheduledTimer]:
+        """Removes and returns all timers that should be fired at the given moment, earliest first."""
+        due = []
+        while self._heap and self._heap[0].fire_at <= now:
+            timer = heapq.heappop(self._heap)
+            self._ids.discard(timer.id)
+            due.append(timer)
+        return due
@@ -13,93 +13,533 @@
 #  limitations under the License.
 import logging
 import os
-from time import sleep
-from typing import Any
+import socket
+import uuid
+from datetime import datetime, timedelta, UTC
+from time import monotonic, sleep, time
+from typing import Any, Optional
 
-from db.client import PostgresClient, PostgresClientException
-from timer_queue.client import RabbitMQClient
+from db.client import PostgresClient, PostgresClientException, Statement
+from db.migrations import TIMERS_TO_FIRE_CHANNEL, TIMERS_TO_FIRE_COMPONENT, migrate, timers_to_fire_migrations
+from db.notifications import NotificationListener, wait_for_notifications
+from db.ownership import SQL_TIMER_SLOT, SlotOwnership
+from db.partitions import maintain_partitions
+from db.sharding import HashRing, Shard, ShardRouter, parse_shards
+from metrics.registry import BATCH_SIZE, DUE_TIMERS, start_metrics_server
+from timer.heap import TimerHeap
+from timer_queue.client import RabbitMQPublisher
+from timer_queue.codec import JSON_CONTENT_TYPE, get_codec
 from timer_queue.exceptions import RabbitMqConnectionException
+from timer_queue.trace import CLAIMED_AT, DISPATCHED_AT, TRACE_FIELD, record_hop
 
 RABBIT_MQ_HOST = os.environ.get("RABBIT_MQ_HOST", "rabbitmq")
 RABBIT_MQ_PORT = int(os.environ.get("RABBIT_MQ_PORT", "5672"))
 RABBIT_MQ_TO_FIRE = os.environ.get("RABBIT_MQ_TO_FIRE", "timers_to_fire")
-RABBIT_MQ_RECONNECTING_INTERVAL = int(os.environ.get("RABBIT_MQ_RECONNECTING_INTERVAL", "2"))
+RABBIT_MQ_CONFIRM_TIMEOUT = float(os.environ.get("RABBIT_MQ_CONFIRM_TIMEOUT", "5"))
+# Content type of published messages, "application/x-timer-binary" is more compact than the default JSON.
+RABBIT_MQ_CONTENT_TYPE = os.environ.get("RABBIT_MQ_CONTENT_TYPE", JSON_CONTENT_TYPE)
 TIMER_DB_HOST = os.environ.get("TIMER_DB_HOST", "postgres")
 TIMER_DB_PORT = int(os.environ.get("TIMER_DB_PORT", "5432"))
 TIMER_DB_USER = os.environ.get("TIMER_DB_USER", "postgres")
 TIMER_DB_PASSWORD =os.environ.get("TIMER_DB_PASSWORD", "postgres")
 TIMER_DB_DB = os.environ.get("TIMER_DB_DB", "postgres")
+TIMER_DB_POOL_SIZE = int(os.environ.get("TIMER_DB_POOL_SIZE", "1"))
+# Comma separated list of timer-db shards as host[:port] fired by this process. If empty, then only TIMER_DB_HOST.
+TIMER_DB_SHARDS = os.environ.get("TIMER_DB_SHARDS", "")
+TIMER_DB_PARTITIONED = os.environ.get("TIMER_DB_PARTITIONED", "false").lower() == "true"
+TIMER_DB_PARTITION_INTERVAL_MINUTES = int(os.environ.get("TIMER_DB_PARTITION_INTERVAL_MINUTES", "60"))
+TIMER_DB_PARTITIONS_AHEAD = int(os.environ.get("TIMER_DB_PARTITIONS_AHEAD", "24"))
+TIMER_DB_PARTITION_MAINTENANCE_INTERVAL = int(os.environ.get("TIMER_DB_PARTITION_MAINTENANCE_INTERVAL", "300"))
+TIMER_BATCH_SIZE = int(os.environ.get("TIMER_BATCH_SIZE", "1000"))
+TIMER_CLAIM_LEASE_SECONDS = int(os.environ.get("TIMER_CLAIM_LEASE_SECONDS", "60"))
+# "poll" fires due timers and sleeps until the next one is due, "lookahead" preloads upcoming timers into memory and
+# fires each of them at its exact firing moment.
+TIMER_MODE = os.environ.get("TIMER_MODE", "poll")
+TIMER_LOOKAHEAD_SECONDS = int(os.environ.get("TIMER_LOOKAHEAD_SECONDS", "60"))
+TIMER_LOOKAHEAD_CAPACITY = int(os.environ.get("TIMER_LOOKAHEAD_CAPACITY", "100000"))
+TIMER_LOOKAHEAD_REFILL_INTERVAL = float(os.environ.get("TIMER_LOOKAHEAD_REFILL_INTERVAL", "1"))
+# How often, in seconds, the number of due timers of each shard is counted for the backlog metric; 0 disables it.
+TIMER_BACKLOG_INTERVAL = int(os.environ.get("TIMER_BACKLOG_INTERVAL", "15"))
+# Due timers are counted up to this limit, so a huge backlog doesn't make counting itself slow.
+TIMER_BACKLOG_COUNT_LIMIT = int(os.environ.get("TIMER_BACKLOG_COUNT_LIMIT", "100000"))
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9100"))
+# Whether to wake up as soon as a timer firing before the planned wake-up is inserted, via LISTEN/NOTIFY.
+TIMER_LISTEN = os.environ.get("TIMER_LISTEN", "true").lower() == "true"
+# Longest sleep between polls in seconds. It bounds how long expired claims and missed notifications go unnoticed.
+TIMER_MAX_SLEEP_SECONDS = float(os.environ.get("TIMER_MAX_SLEEP_SECONDS", "30"))
+# Timers of every shard are split into this number of slots leased by the timer processes sharing the shard, and every
+# process fires timers of its own slots only (see db.ownership). 0 disables it, then every process claims any timers.
+TIMER_DISPATCH_SLOTS = int(os.environ.get("TIMER_DISPATCH_SLOTS", "0"))
+# Name of the process in slot leases, it must be unique among the timer processes.
+TIMER_DISPATCHER_ID = os.environ.get("TIMER_DISPATCHER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+# Slots of a process that stopped renewing its leases for this number of seconds are taken over by the others.
+TIMER_OWNERSHIP_LEASE_SECONDS = float(os.environ.get("TIMER_OWNERSHIP_LEASE_SECONDS", "15"))
+TIMER_OWNERSHIP_HEARTBEAT_SECONDS = float(os.environ.get("TIMER_OWNERSHIP_HEARTBEAT_SECONDS", "5"))
 
-SQL_CREATE_TIMERS_TO_FIRE_TABLE = """
-CREATE TABLE IF NOT EXISTS timers_to_fire (
-    id UUID PRIMARY KEY,
-    fire_at TIMESTAMP WITH TIME ZONE,
-    url TEXT
+# Due timers are claimed by setting a lease on them, so concurrent timer processes skip them. If the process dies
+# before the claimed timers are fired and deleted, the lease expires and another process picks them up again.
+# Parameters: lease in seconds, horizon in seconds, limit.
+SQL_CLAIM_TIMERS_TO_FIRE = """
+UPDATE timers_to_fire
+SET claimed_until = NOW() + make_interval(secs => %s)
+WHERE id IN (
+    SELECT id
+    FROM timers_to_fire
+    WHERE fire_at <= NOW() + make_interval(secs => %s) AND (claimed_until IS NULL OR claimed_until < NOW())
+    ORDER BY fire_at
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
 )
+RETURNING id, fire_at, url, trace
 """
-SQL_SELECT_TIMERS_TO_FIRE = """
-SELECT * 
-FROM timers_to_fire
-WHERE fire_at <= NOW() AT TIME ZONE 'UTC'
+# The same as SQL_CLAIM_TIMERS_TO_FIRE for timers of given slots only.
+# Parameters: lease in seconds, horizon in seconds, number of slots, list of slots, limit.
+SQL_CLAIM_OWNED_TIMERS_TO_FIRE = f"""
+UPDATE timers_to_fire
+SET claimed_until = NOW() + make_interval(secs => %s)
+WHERE id IN (
+    SELECT id
+    FROM timers_to_fire
+    WHERE fire_at <= NOW() + make_interval(secs => %s) AND (claimed_until IS NULL OR claimed_until < NOW())
+        AND {SQL_TIMER_SLOT} = ANY(%s::int[])
+    ORDER BY fire_at
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id, fire_at, url, trace
 """
+# Parameters: list of ids. psycopg2 sends a list of strings as a text[] array, which a prepared statement doesn't
+# coerce to uuid[] implicitly, so the parameter is declared as text[] and cast explicitly.
 SQL_DELETE_TIMERS_TO_FIRE = """
 DELETE FROM timers_to_fire
-WHERE id = '{}';
+WHERE id = ANY(%s::text[]::uuid[])
+"""
+# Seconds until the earliest unclaimed timer is due, negative if it's overdue. Parameters: none.
+SQL_NEXT_FIRE_IN = """
+SELECT extract(epoch FROM fire_at - NOW())
+FROM timers_to_fire
+WHERE claimed_until IS NULL OR claimed_until < NOW()
+ORDER BY fire_at
+LIMIT 1
+"""
+# The same as SQL_NEXT_FIRE_IN for timers of given slots only. Parameters: number of slots, list of slots.
+SQL_NEXT_OWNED_FIRE_IN = f"""
+SELECT extract(epoch FROM fire_at - NOW())
+FROM timers_to_fire
+WHERE (claimed_until IS NULL OR claimed_until < NOW()) AND {SQL_TIMER_SLOT} = ANY(%s::int[])
+ORDER BY fire_at
+LIMIT 1
+"""
+# Parameters: limit.
+SQL_COUNT_DUE_TIMERS = """
+SELECT count(*) FROM (SELECT 1 FROM timers_to_fire WHERE fire_at <= NOW() LIMIT %s) due
 """
 
 logger = logging.getLogger(__name__)
 
 
-def select_timers_to_fire(db_client: PostgresClient) -> list[Any]:
-    """Selects timers from database that are ready to be fired."""
-    timers_to_fire = []
+def claim_statement(horizon: int, limit: int, lease: int, slots: Optional[list[int]] = None) -> Statement:
+    """Retrieves the statement claiming timers, of given slots only if they are given."""
+    if slots is None:
+        return Statement(SQL_CLAIM_TIMERS_TO_FIRE, (lease, horizon, limit), name="claim_timers_to_fire")
+    return Statement(
+        SQL_CLAIM_OWNED_TIMERS_TO_FIRE,
+        (lease, horizon, TIMER_DISPATCH_SLOTS, list(slots), limit),
+        name="claim_owned_timers_to_fire",
+    )
+
+
+def claim_timers_to_fire(
+    db_client: PostgresClient,
+    horizon: int = 0,
+    limit: int = TIMER_BATCH_SIZE,
+    lease: int = TIMER_CLAIM_LEASE_SECONDS,
+    slots: Optional[list[int]] = None,
+) -> list[Any]:
+    """
+    Claims a batch of timers that are ready to be fired, so no other timer process fires them.
+
+    If ``horizon`` is given, then timers firing within that many seconds from now are claimed as well. If ``slots`` are
+    given, then only timers of these slots are claimed.
+    """
+    if slots is not None and not slots:
+        return []
+    statement = claim_statement(horizon=horizon, limit=limit, lease=lease, slots=slots)
     while True:
         try:
-            results = db_client.run_queries([
-                SQL_CREATE_TIMERS_TO_FIRE_TABLE,
-                SQL_SELECT_TIMERS_TO_FIRE,
-            ])
+            return db_client.run_pipeline([statement]) or []
         except PostgresClientException as ex:
             logger.warning("Error occurred while fetching timers from database: %s. Retry in 1 sec.", ex)
             sleep(1)
+
+
+def delete_fired_timers(db_client: PostgresClient, ids: list[str]) -> None:
+    """Deletes fired timers from database with a single query."""
+    while True:
+        try:
+            db_client.run_prepared("delete_fired_timers", SQL_DELETE_TIMERS_TO_FIRE, (list(ids),))
+        except PostgresClientException as ex:
+            logger.warning("Error occurred while deleting fired timers from database: %s. Retry in 1 sec.", ex)
+            sleep(1)
+            continue
+        else:
+            return
+
+
+def delete_and_claim_timers_to_fire(
+    db_client: PostgresClient,
+    ids: list[str],
+    limit: int = TIMER_BATCH_SIZE,
+    lease: int = TIMER_CLAIM_LEASE_SECONDS,
+    slots: Optional[list[int]] = None,
+) -> list[Any]:
+    """
+    Deletes fired timers and claims the next batch of due timers, of given ``slots`` only if they are given, in a single
+    transaction with one round-trip.
+    """
+    statements = [] if slots is not None and not slots else [claim_statement(0, limit, lease, slots)]
+    if ids:
+        statements.insert(0, Statement(SQL_DELETE_TIMERS_TO_FIRE, (list(ids),), name="delete_fired_timers"))
+    if not statements:
+        return []
+    while True:
+        try:
+            return db_client.run_pipeline(statements) or []
+        except PostgresClientException as ex:
+            logger.warning("Error occurred while deleting and fetching timers: %s. Retry in 1 sec.", ex)
+            sleep(1)
+
+
+def fire_timers(rabbitmq_client: RabbitMQPublisher, timers_to_fire: list[Any]) -> list[str]:
+    """
+    Pushes given timers to the queue and returns ids of the ones confirmed by the broker.
+
+    Only confirmed timers may be deleted, the others are fired again once their claim expires. Messages carry the
+    firing moment and the trace of each timer, timers claimed right before firing are claimed at the dispatch moment.
+    """
+    if not timers_to_fire:
+        return []
+    logger.info("Found %d timers ready to fire!", len(timers_to_fire))
+    BATCH_SIZE.labels("fire").observe(len(timers_to_fire))
+    dispatched_at = datetime.now(UTC)
+    messages = []
+    for timer_id, fire_at, url, trace in timers_to_fire:
+        trace = record_hop(trace, DISPATCHED_AT, at=dispatched_at)
+        trace.setdefault(CLAIMED_AT, dispatched_at)
+        messages.append({"id": uuid.UUID(str(timer_id)), "url": url, "fire_at": fire_at, TRACE_FIELD: trace})
+    try:
+        confirmed = rabbitmq_client.push_messages(queue_name=RABBIT_MQ_TO_FIRE, messages=messages)
+    except RabbitMqConnectionException as ex:
+        logger.error("Failed to push %d messages to RabbitMQ due to error %s", len(messages), str(ex))
+        return []
+    fired_ids = [str(message["id"]) for message, is_confirmed in zip(messages, confirmed) if is_confirmed]
+    if len(fired_ids) < len(messages):
+        logger.error("RabbitMQ didn't confirm %d of %d messages", len(messages) - len(fired_ids), len(messages))
+    return fired_ids
+
+
+def migrate_database(db_client: PostgresClient) -> None:
+    """Brings the timer database schema up to date, retrying until it succeeds."""
+    while True:
+        try:
+            migrate(
+                db_client,
+                component=TIMERS_TO_FIRE_COMPONENT,
+                migrations=timers_to_fire_migrations(partitioned=TIMER_DB_PARTITIONED),
+            )
+        except PostgresClientException as ex:
+            logger.warning("Error occurred while migrating database schema: %s. Retry in 1 sec.", ex)
+            sleep(1)
             continue
         else:
-            timers_to_fire = results[1]
+            return
+
+
+def maintain_timer_db_partitions(db_client: PostgresClient) -> None:
+    """Creates upcoming partitions of timers_to_fire and drops drained ones, failures are only logged."""
+    try:
+        maintain_partitions(
+            db_client,
+            interval=timedelta(minutes=TIMER_DB_PARTITION_INTERVAL_MINUTES),
+            ahead=TIMER_DB_PARTITIONS_AHEAD,
+        )
+    except PostgresClientException as ex:
+        logger.warning("Error occurred while maintaining partitions of timers_to_fire: %s", ex)
+
+
+def count_due_timers(db_client: PostgresClient, shard: Shard) -> None:
+    """Updates the backlog metric of a given shard with the number of due timers, failures are only logged."""
+    try:
+        rows = db_client.run_prepared("count_due_timers", SQL_COUNT_DUE_TIMERS, (TIMER_BACKLOG_COUNT_LIMIT,))
+    except PostgresClientException as ex:
+        logger.warning("Error occurred while counting due timers of shard %s: %s", shard.name, ex)
+    else:
+        DUE_TIMERS.labels(shard.name).set(rows[0][0] if rows else 0)
+
+
+def renew_ownership(ownership: SlotOwnership, shard: Shard) -> bool:
+    """Renews slot leases of a given shard, failures are only logged. Returns whether the owned slots have changed."""
+    owned = ownership.owned
+    try:
+        return ownership.heartbeat() != owned
+    except PostgresClientException as ex:
+        logger.warning("Error occurred while renewing slot leases of shard %s: %s", shard.name, ex)
+        return False
+
+
+def release_ownership(ownership: SlotOwnership, shard: Shard) -> None:
+    """Releases slots of a given shard, failures are only logged, then the leases simply expire."""
+    try:
+        ownership.release()
+    except PostgresClientException as ex:
+        logger.warning("Error occurred while releasing slots of shard %s: %s", shard.name, ex)
+
+
+def next_fire_in(db_client: PostgresClient, slots: Optional[list[int]] = None) -> float:
+    """
+    Retrieves how many seconds to wait until the next timer, of given ``slots`` only if they are given, is due, up to
+    TIMER_MAX_SLEEP_SECONDS.
+    """
+    if slots is not None and not slots:
+        return TIMER_MAX_SLEEP_SECONDS
+    try:
+        if slots is None:
+            rows = db_client.run_prepared("next_fire_in", SQL_NEXT_FIRE_IN)
+        else:
+            rows = db_client.run_prepared(
+                "next_owned_fire_in", SQL_NEXT_OWNED_FIRE_IN, (TIMER_DISPATCH_SLOTS, list(slots)),
+            )
+    except PostgresClientException as ex:
+        logger.warning("Error occurred while looking up the next timer to fire: %s. Retry in 1 sec.", ex)
+        return 1
+    if not rows:
+        return TIMER_MAX_SLEEP_SECONDS
+    return min(max(float(rows[0][0]), 0), TIMER_MAX_SLEEP_SECONDS)
+
+
+def wait_for_timers(listeners: Optional[list[NotificationListener]], wait: float) -> set[int]:
+    """
+    Sleeps for ``wait`` seconds, or until a timer firing earlier than that is inserted into a shard.
+
+    Returns indexes of the shards that got such timers. Without listeners, or once listening fails, it simply sleeps.
+    """
+    if not listeners:
+        sleep(wait)
+        return set()
+    deadline = monotonic() + wait
+    woken: set[int] = set()
+    while not woken and (timeout := deadline - monotonic()) > 0:
+        try:
+            notifications = wait_for_notifications(listeners, timeout)
+        except PostgresClientException as ex:
+            logger.warning("Error occurred while waiting for new timers: %s", ex)
             break
-    return timers_to_fire
+        for index, payload in notifications:
+            try:
+                fire_in = float(payload) - time()
+            except ValueError:
+                fire_in = 0
+            if fire_in < deadline - monotonic():
+                woken.add(index)
+    if not woken and (timeout := deadline - monotonic()) > 0:
+        sleep(timeout)
+    return woken
+
+
+def keeps_slots(ownership: Optional[SlotOwnership], slots: Optional[list[int]]) -> bool:
+    """
+    Renews slot leases if a heartbeat is due and checks whether given ``slots`` are still owned, failures to renew
+    are only logged. Without ``ownership`` every timer may be fired, so it always holds.
+    """
+    if ownership is None:
+        return True
+    if monotonic() - ownership.renewed_at >= TIMER_OWNERSHIP_HEARTBEAT_SECONDS:
+        try:
+            ownership.heartbeat()
+        except PostgresClientException as ex:
+            logger.warning("Error occurred while renewing slot leases: %s", ex)
+    return set(slots or []) <= set(ownership.owned)
+
+
+def poll_timers_to_fire(
+    db_client: PostgresClient,
+    rabbitmq_client: RabbitMQPublisher,
+    slots: Optional[list[int]] = None,
+    ownership: Optional[SlotOwnership] = None,
+) -> float:
+    """
+    Fires due timers batch by batch and returns how many seconds to wait until the next timer is due. If ``slots`` are
+    given, then only timers of these slots are fired.
+
+    A backlog may take longer to drain than slot leases last, so the leases of ``ownership`` are renewed between
+    batches, and draining stops as soon as any of the ``slots`` is lost to another process.
+    """
+    timers_to_fire = claim_timers_to_fire(db_client=db_client, limit=TIMER_BATCH_SIZE, slots=slots) or []
+    fired_ids = fire_timers(rabbitmq_client=rabbitmq_client, timers_to_fire=timers_to_fire)
+    # A full batch means there is a backlog of due timers, so fired timers are deleted and the next batch is claimed
+    # right away with a single round-trip.
+    while len(timers_to_fire) >= TIMER_BATCH_SIZE:
+        if not keeps_slots(ownership, slots):
+            logger.warning("Lost slots while draining due timers, the new owner fires the rest of them")
+            break
+        timers_to_fire = delete_and_claim_timers_to_fire(
+            db_client=db_client, ids=fired_ids, limit=TIMER_BATCH_SIZE, slots=slots,
+        )
+        fired_ids = fire_timers(rabbitmq_client=rabbitmq_client, timers_to_fire=timers_to_fire)
+    if fired_ids:
+        delete_fired_timers(db_client=db_client, ids=fired_ids)
+    return next_fire_in(db_client, slots=slots)
+
+
+def dispatch_lookahead_timers(
+    db_client: PostgresClient,
+    rabbitmq_client: RabbitMQPublisher,
+    heap: TimerHeap,
+    slots: Optional[list[int]] = None,
+) -> float:
+    """
+    Refills the in-memory heap with upcoming timers if it's time, fires timers that are due right now, and returns how
+    many seconds to wait until the next due timer or the next refill, whichever comes first. If ``slots`` are given,
+    then the heap is refilled with timers of these slots only.
+
+    Timers in the heap stay claimed for the lookahead window plus the regular lease, so if the process dies they are
+    picked up by another timer process once the lease expires.
+    """
+    if monotonic() >= heap.next_refill_at:
+        if heap.free_slots:
+            for timer_id, fire_at, url, trace in claim_timers_to_fire(
+                db_client=db_client,
+                horizon=TIMER_LOOKAHEAD_SECONDS,
+                limit=min(heap.free_slots, TIMER_BATCH_SIZE),
+                lease=TIMER_LOOKAHEAD_SECONDS + TIMER_CLAIM_LEASE_SECONDS,
+                slots=slots,
+            ) or []:
+                heap.push(timer_id=timer_id, fire_at=fire_at, url=url, trace=record_hop(trace, CLAIMED_AT))
+        heap.next_refill_at = monotonic() + TIMER_LOOKAHEAD_REFILL_INTERVAL
+
+    if due := heap.pop_due(datetime.now(UTC)):
+        timers_to_fire = [(timer.id, timer.fire_at, timer.url, timer.trace) for timer in due]
+        if fired_ids := fire_timers(rabbitmq_client=rabbitmq_client, timers_to_fire=timers_to_fire):
+            delete_fired_timers(db_client=db_client, ids=fired_ids)
+
+    wait = heap.next_refill_at - monotonic()
+    if (next_fire_at := heap.next_fire_at()) is not None:
+        wait = min(wait, (next_fire_at - datetime.now(UTC)).total_seconds())
+    return max(wait, 0)
 
 
 def schedule_hooks_firing():
-    """Callback for saving incoming messages to database."""
-    db_client = PostgresClient(
-        host=TIMER_DB_HOST,
-        port=TIMER_DB_PORT,
-        database=TIMER_DB_DB,
-        user=TIMER_DB_USER,
-        password=TIMER_DB_PASSWORD
+    """
+    Fires timers stored on all shards of this process.
+
+    Claims are leased, so several timer processes may fire timers of the same shard without firing any timer twice.
+    With TIMER_DISPATCH_SLOTS the processes split timers of every shard by leasing its slots, renewed with heartbeats
+    every TIMER_OWNERSHIP_HEARTBEAT_SECONDS, and each of them fires timers of its own slots. Between polls the process
+    sleeps until the next timer is due, or up to TIMER_MAX_SLEEP_SECONDS, and with TIMER_LISTEN it's woken up early by
+    notifications about sooner timers inserted into any shard.
+    """
+    timer_db_router = ShardRouter(
+        HashRing(parse_shards(TIMER_DB_SHARDS, TIMER_DB_PORT) or [Shard(TIMER_DB_HOST, TIMER_DB_PORT)]),
+        lambda shard: PostgresClient(
+            host=shard.host,
+            port=shard.port,
+            database=TIMER_DB_DB,
+            user=TIMER_DB_USER,
+            password=TIMER_DB_PASSWORD,
+            pool_size=TIMER_DB_POOL_SIZE,
+        ),
     )
-    rabbitmq_client = RabbitMQClient(host=RABBIT_MQ_HOST, port=RABBIT_MQ_PORT)
+    shards = timer_db_router.shards
+    db_clients = [timer_db_router.client(shard) for shard in shards]
+    for db_client in db_clients:
+        migrate_database(db_client=db_client)
+    rabbitmq_client = RabbitMQPublisher(
+        host=RABBIT_MQ_HOST,
+        port=RABBIT_MQ_PORT,
+        confirm_timeout=RABBIT_MQ_CONFIRM_TIMEOUT,
+        codec=get_codec(RABBIT_MQ_CONTENT_TYPE),
+    )
+    heaps = [
+        TimerHeap(capacity=max(TIMER_LOOKAHEAD_CAPACITY // len(db_clients), 1)) for _ in db_clients
+    ] if TIMER_MODE == "lookahead" else None
+    listeners = [
+        NotificationListener(
+            host=shard.host,
+            port=shard.port,
+            database=TIMER_DB_DB,
+            user=TIMER_DB_USER,
+            password=TIMER_DB_PASSWORD,
+            channel=TIMERS_TO_FIRE_CHANNEL,
+        )
+        for shard in shards
+    ] if TIMER_LISTEN else None
+    ownerships = [
+        SlotOwnership(
+            db_client,
+            owner=TIMER_DISPATCHER_ID,
+            slots=TIMER_DISPATCH_SLOTS,
+            lease=TIMER_OWNERSHIP_LEASE_SECONDS,
+        )
+        for db_client in db_clients
+    ] if TIMER_DISPATCH_SLOTS else None
+    heartbeat_at = None
+    partitions_maintained_at = None
+    backlog_counted_at = None
+    start_metrics_server(METRICS_PORT)
     while True:
         try:
-            if timers_to_fire := select_timers_to_fire(db_client=db_client):
-                for timer in timers_to_fire:
-                    logger.info(f"Found timer ready to fire!")
-                    data = dict(zip(["id", "fire_at", "url"], timer))
-                    message = {"id": str(data["id"]), "url": data["url"]}
-                    try:
-                        rabbitmq_client.push_message(queue_name=RABBIT_MQ_TO_FIRE, message=message)
-                    except RabbitMqConnectionException as ex:
-                        logger.error(
-                            "Failed to push message to RabbitMQ for id %s due to error %s",
-                            message["id"],
-                            str(ex),
-                        )
-                        continue
-                    else:
-                        db_client.run_queries([SQL_DELETE_TIMERS_TO_FIRE.format(message["id"])])
-
-            sleep(RABBIT_MQ_RECONNECTING_INTERVAL)
+            if TIMER_DB_PARTITIONED and (
+                partitions_maintained_at is None
+                or monotonic() - partitions_maintained_at >= TIMER_DB_PARTITION_MAINTENANCE_INTERVAL
+            ):
+                for db_client in db_clients:
+                    maintain_timer_db_partitions(db_client=db_client)
+                partitions_maintained_at = monotonic()
+
+            if TIMER_BACKLOG_INTERVAL and (
+                backlog_counted_at is None or monotonic() - backlog_counted_at >= TIMER_BACKLOG_INTERVAL
+            ):
+                for shard, db_client in zip(shards, db_clients):
+                    count_due_timers(db_client=db_client, shard=shard)
+                backlog_counted_at = monotonic()
+
+            if ownerships is not None and (
+                heartbeat_at is None or monotonic() - heartbeat_at >= TIMER_OWNERSHIP_HEARTBEAT_SECONDS
+            ):
+                for index, (shard, ownership) in enumerate(zip(shards, ownerships)):
+                    # Timers of newly owned slots are picked up by the lookahead window right away.
+                    if renew_ownership(ownership=ownership, shard=shard) and heaps is not None:
+                        heaps[index].next_refill_at = 0
+                heartbeat_at = monotonic()
+            slots = [ownership.owned for ownership in ownerships] if ownerships is not None else [None] * len(shards)
+
+            if heaps is None:
+                wait = min(
+                    poll_timers_to_fire(
+                        db_client=db_client, rabbitmq_client=rabbitmq_client, slots=shard_slots, ownership=ownership,
+                    )
+                    for db_client, shard_slots, ownership in zip(db_clients, slots, ownerships or [None] * len(shards))
+                )
+            else:
+                wait = min(
+                    dispatch_lookahead_timers(
+                        db_client=db_client, rabbitmq_client=rabbitmq_client, heap=heap, slots=shard_slots,
+                    )
+                    for db_client, heap, shard_slots in zip(db_clients, heaps, slots)
+                )
+            if heartbeat_at is not None:
+                wait = min(wait, max(heartbeat_at + TIMER_OWNERSHIP_HEARTBEAT_SECONDS - monotonic(), 0))
+            if wait > 0:
+                for index in wait_for_timers(listeners, min(wait, TIMER_MAX_SLEEP_SECONDS)):
+                    # A sooner timer is picked up by the lookahead window right away instead of on the next refill.
+                    if heaps is not None:
+                        heaps[index].next_refill_at = 0
         except KeyboardInterrupt:
+            rabbitmq_client.close()
+            for listener in listeners or []:
+                listener.close()
+            for shard, ownership in zip(shards, ownerships or []):
+                release_ownership(ownership=ownership, shard=shard)
             return
 
 
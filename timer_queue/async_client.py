@@ -0,0 +1,134 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""Helper class for publishing to RabbitMQ from asyncio code"""
+import asyncio
+import logging
+from time import monotonic
+from typing import Any, Mapping, Optional, Sequence
+
+import aio_pika
+from aio_pika.abc import AbstractChannel, AbstractRobustConnection
+from aio_pika.exceptions import AMQPError, DeliveryError
+from pamqp.commands import Basic
+from tenacity import retry, wait_exponential
+
+from metrics.registry import MESSAGES_PUBLISHED, PUBLISH_LATENCY
+from timer_queue.codec import JSON_CODEC, Codec
+from timer_queue.exceptions import RabbitMqConnectionException
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRabbitMQClient:
+    """
+    Helper class for publishing to RabbitMQ over a single long-lived connection shared by all coroutines.
+
+    The connection is restored automatically after failures. Publisher confirms are enabled, so a publish completes
+    only once the broker has taken responsibility for the message; concurrent publishes are pipelined on the channel.
+    Messages are encoded by ``codec`` and labelled with its content type.
+    """
+    def __init__(self, host: str, port: int = 5672, confirm_timeout: float = 5.0, codec: Codec = JSON_CODEC) -> None:
+        self.host = host
+        self.port = port
+        self.confirm_timeout = confirm_timeout
+        self.codec = codec
+        self.connection: Optional[AbstractRobustConnection] = None
+        self.channel: Optional[AbstractChannel] = None
+        self._declared_queues: dict[str, asyncio.Future[Any]] = {}
+
+    @retry(wait=wait_exponential(multiplier=1, min=1, max=10))
+    async def connect(self) -> None:
+        """Opens the connection and a channel with publisher confirms, retrying until the broker is available."""
+        logger.info("Connecting to RabbitMQ on %s:%d ...", self.host, self.port)
+        self.connection = await aio_pika.connect_robust(host=self.host, port=self.port)
+        self.channel = await self.connection.channel(publisher_confirms=True)
+        logger.info("Connected to RabbitMQ on %s:%d successfully", self.host, self.port)
+
+    async def close(self) -> None:
+        if self.connection is not None:
+            await self.connection.close()
+            logger.info("Closed connection to RabbitMQ on %s:%d successfully", self.host, self.port)
+        self.connection = self.channel = None
+        self._declared_queues.clear()
+
+    async def _declare_queue(
+        self, channel: AbstractChannel, queue_name: str, arguments: Optional[dict[str, Any]] = None,
+    ) -> None:
+        """
+        Declares a durable queue once, concurrent callers wait for the same declaration. Queue ``arguments`` must be the
+        same on every call for the queue, the broker refuses to redeclare a queue with different ones.
+        """
+        if queue_name not in self._declared_queues:
+            self._declared_queues[queue_name] = asyncio.ensure_future(
+                channel.declare_queue(queue_name, durable=True, arguments=arguments)
+            )
+        try:
+            await self._declared_queues[queue_name]
+        except BaseException:
+            self._declared_queues.pop(queue_name, None)
+            raise
+
+    async def push_message(
+        self,
+        queue_name: str,
+        message: Mapping[str, Any],
+        arguments: Optional[dict[str, Any]] = None,
+    ) -> None:
+        """
+        Push given message into a given RabbitMQ queue and wait until the broker confirms it.
+
+        The queue is declared with given ``arguments`` on its first use, e.g. with ones of a delay queue.
+        """
+        if self.channel is None:
+            raise RabbitMqConnectionException("Client is not connected to RabbitMQ")
+        started_at = monotonic()
+        try:
+            await self._declare_queue(self.channel, queue_name, arguments)
+            confirmation = await self.channel.default_exchange.publish(
+                aio_pika.Message(
+                    body=self.codec.encode(message),
+                    content_type=self.codec.content_type,
+                    delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                ),
+                routing_key=queue_name,
+                timeout=self.confirm_timeout,
+            )
+        except (AMQPError, DeliveryError, asyncio.TimeoutError) as ex:
+            MESSAGES_PUBLISHED.labels(queue_name, "failed").inc()
+            raise RabbitMqConnectionException(ex)
+        if not isinstance(confirmation, Basic.Ack):
+            MESSAGES_PUBLISHED.labels(queue_name, "rejected").inc()
+            raise RabbitMqConnectionException(f"Message was not confirmed by RabbitMQ: {confirmation}")
+        MESSAGES_PUBLISHED.labels(queue_name, "confirmed").inc()
+        PUBLISH_LATENCY.labels(queue_name).observe(monotonic() - started_at)
+
+    async def push_messages(self, queue_name: str, messages: Sequence[Mapping[str, Any]]) -> list[bool]:
+        """
+        Push given messages into a given RabbitMQ queue and wait until the broker confirms them.
+
+        All messages are published at once without waiting for each other's confirms, and the broker confirms them in
+        batches. Returns whether each message was confirmed, in the order of the messages.
+        """
+        results = await asyncio.gather(
+            *(self.push_message(queue_name, message) for message in messages),
+            return_exceptions=True,
+        )
+        confirmed = []
+        for result in results:
+            if isinstance(result, BaseException) and not isinstance(result, RabbitMqConnectionException):
+                raise result
+            if isinstance(result, RabbitMqConnectionException):
+                logger.warning("Message to queue %s was not confirmed: %s", queue_name, result)
+            confirmed.append(result is None)
+        return confirmed
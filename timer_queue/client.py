@@ -12,23 +12,55 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 """Helper class for interacting with RabbitMQ"""
-import json
+import asyncio
 import logging
-from typing import Any, Mapping, Callable
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from time import monotonic
+from typing import Any, Awaitable, Mapping, Callable, Optional, Sequence, TypeVar
 
 import pika
 from pika.adapters.blocking_connection import (
     BlockingChannel,
     BlockingConnection,
 )
-from pika.delivery_mode import DeliveryMode
-from pika.exceptions import AMQPConnectionError
+from pika.spec import Basic, BasicProperties
+from pika.exceptions import AMQPConnectionError, AMQPError
 from tenacity import retry, wait_exponential
 
+from metrics.registry import BATCH_SIZE, MESSAGES_CONSUMED
+from timer_queue.async_client import AsyncRabbitMQClient
+from timer_queue.codec import JSON_CODEC, Codec
 from timer_queue.exceptions import RabbitMqConnectionException
 
 logger = logging.getLogger(__name__)
 
+Delivery = tuple[Basic.Deliver, BasicProperties, bytes]
+T = TypeVar("T")
+
+
+def ack_threadsafe(channel: BlockingChannel, delivery_tag: int, multiple: bool = False) -> None:
+    """Acknowledges a message from any thread by handing the ack over to the connection thread."""
+    try:
+        channel.connection.add_callback_threadsafe(
+            partial(channel.basic_ack, delivery_tag=delivery_tag, multiple=multiple)
+        )
+    except AMQPError as ex:
+        # The message is redelivered once the consumer reconnects.
+        logger.warning("Failed to acknowledge message %d: %s", delivery_tag, str(ex))
+
+
+def nack_threadsafe(channel: BlockingChannel, delivery_tag: int, requeue: bool = True) -> None:
+    """Rejects a message from any thread by handing the nack over to the connection thread."""
+    try:
+        channel.connection.add_callback_threadsafe(
+            partial(channel.basic_nack, delivery_tag=delivery_tag, requeue=requeue)
+        )
+    except AMQPError as ex:
+        # The message is redelivered once the consumer reconnects anyway.
+        logger.warning("Failed to reject message %d: %s", delivery_tag, str(ex))
+
 
 class RabbitMQChannel:
     """Context manager for rabbitmq channel"""
@@ -49,6 +81,50 @@ class RabbitMQChannel:
         logger.info("Closed connection to RabbitMQ on %s:%d successfully", self.host, self.port)
 
 
+class RabbitMQPublisher:
+    """
+    Publisher with confirms for synchronous code.
+
+    Messages are published over a single long-lived connection in confirm mode, driven by an event loop running in
+    a background thread. A batch of messages is pipelined on the channel and the call returns once the broker has
+    confirmed (or rejected) all of them, so callers only act on the confirmed subset.
+    """
+    def __init__(self, host: str, port: int = 5672, confirm_timeout: float = 5.0, codec: Codec = JSON_CODEC) -> None:
+        self.host = host
+        self.port = port
+        self.client = AsyncRabbitMQClient(host=host, port=port, confirm_timeout=confirm_timeout, codec=codec)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="rabbitmq-publisher", daemon=True)
+        self._thread.start()
+
+    def _run(self, coroutine: Awaitable[T]) -> T:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _push_messages(self, queue_name: str, messages: Sequence[Mapping[str, Any]]) -> list[bool]:
+        if self.client.channel is None:
+            await self.client.connect()
+        return await self.client.push_messages(queue_name, messages)
+
+    def push_messages(self, queue_name: str, messages: Sequence[Mapping[str, Any]]) -> list[bool]:
+        """
+        Push given messages into a given RabbitMQ queue and wait for their confirms.
+
+        Returns whether each message was confirmed by the broker, in the order of the messages.
+        """
+        if not messages:
+            return []
+        logger.info("Attempting to push %d messages to queue: %s", len(messages), queue_name)
+        return self._run(self._push_messages(queue_name, messages))
+
+    def close(self) -> None:
+        """Closes the connection and stops the background event loop."""
+        if not self._loop.is_closed():
+            self._run(self.client.close())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+
+
 class RabbitMQClient:
     """Helper class for interaction with RabbitMQ"""
     def __init__(self, host: str, port: int = 5672) -> None:
@@ -56,29 +132,149 @@ class RabbitMQClient:
         self.port = port
 
     @retry(wait=wait_exponential(multiplier=1, min=1, max=10))
-    def push_message(self, queue_name: str, message: Mapping[str, Any]) -> None:
-        """Push given message into a given RabbitMQ queue"""
+    def consume_messages(
+        self,
+        queue_name: str,
+        call_back: Callable,
+        prefetch_count: Optional[int] = None,
+        auto_ack: bool = True,
+        setup: Optional[Callable[[BlockingChannel], None]] = None,
+        workers: int = 0,
+    ) -> None:
+        """
+        Pull messages from a given RabbitMQ queue and process them by a given callback
+
+        If ``auto_ack`` is disabled, then the callback is responsible for acknowledging messages, and at most
+        ``prefetch_count`` messages are delivered without being acknowledged. If ``setup`` is given, then it's called
+        with the channel before consumption starts, e.g. to declare queues the callback publishes to.
+
+        If ``workers`` is given, then the callback runs in a pool of that many threads, so the connection thread keeps
+        serving heartbeats and deliveries while messages are processed. The callback must then acknowledge messages
+        with ``ack_threadsafe`` / ``nack_threadsafe``, and ``prefetch_count`` bounds the number of messages in flight.
+        """
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rabbitmq-consumer") if workers else None
         try:
             with RabbitMQChannel(host=self.host, port=self.port) as channel:
-                logger.info("Attempting to push message to queue: %s", queue_name)
+                logger.info("Start consuming messages from queue: %s", queue_name)
                 channel.queue_declare(queue=queue_name, durable=True)
-                channel.basic_publish(
-                    exchange='',
-                    routing_key=queue_name,
-                    body=json.dumps(message),
-                    properties=pika.BasicProperties(delivery_mode=DeliveryMode.Persistent),
-                )
+                if setup is not None:
+                    setup(channel)
+                if prefetch_count:
+                    channel.basic_qos(prefetch_count=prefetch_count)
+                on_message = call_back
+                if executor is not None:
+                    on_message = partial(self._dispatch, executor, partial(self._process, call_back, auto_ack))
+                on_message = partial(self._count, MESSAGES_CONSUMED.labels(queue_name), on_message)
+                channel.basic_consume(queue=queue_name, on_message_callback=on_message, auto_ack=auto_ack)
+                channel.start_consuming()
         except AMQPConnectionError as ex:
             raise RabbitMqConnectionException(ex)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+    @staticmethod
+    def _count(counter: Any, on_message: Callable, *delivery: Any) -> None:
+        """Counts a delivered message and hands it over."""
+        counter.inc()
+        on_message(*delivery)
+
+    @staticmethod
+    def _dispatch(executor: ThreadPoolExecutor, process: Callable, channel: BlockingChannel, *delivery: Any) -> None:
+        """Hands a delivered message over to a worker of the pool."""
+        executor.submit(process, channel, *delivery)
+
+    @staticmethod
+    def _process(
+        call_back: Callable,
+        auto_ack: bool,
+        channel: BlockingChannel,
+        method: Basic.Deliver,
+        properties: BasicProperties,
+        body: bytes,
+    ) -> None:
+        """Processes a message in a worker, a message failing to be processed is requeued."""
+        try:
+            call_back(channel, method, properties, body)
+        except Exception as ex:
+            logger.error("Failed to process message %d: %s", method.delivery_tag, str(ex))
+            if not auto_ack:
+                nack_threadsafe(channel, delivery_tag=method.delivery_tag)
 
     @retry(wait=wait_exponential(multiplier=1, min=1, max=10))
-    def consume_messages(self, queue_name: str, call_back: Callable) -> None:
-        """Pull messages from a given RabbitMQ queue and process them by a given callback"""
+    def consume_batches(
+        self,
+        queue_name: str,
+        call_back: Callable[[list[Delivery]], None],
+        batch_size: int,
+        batch_timeout: float,
+        prefetch_count: Optional[int] = None,
+        workers: int = 0,
+    ) -> None:
+        """
+        Pull messages from a given RabbitMQ queue and process them in batches by a given callback.
+
+        A batch is handed over to the callback once it reaches ``batch_size`` messages or once ``batch_timeout``
+        seconds have passed since its first message arrived. The whole batch is acknowledged only after the callback
+        returns, so messages of an unfinished batch are redelivered if the consumer dies.
+
+        If ``workers`` is given, then batches are processed by a pool of that many threads while the connection thread
+        keeps collecting the next ones. At least ``workers`` batches are prefetched, a batch failing to be processed is
+        requeued.
+        """
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rabbitmq-consumer") if workers else None
         try:
             with RabbitMQChannel(host=self.host, port=self.port) as channel:
-                logger.info("Start consuming messages from queue: %s", queue_name)
+                logger.info("Start consuming batches of messages from queue: %s", queue_name)
                 channel.queue_declare(queue=queue_name, durable=True)
-                channel.basic_consume(queue=queue_name, on_message_callback=call_back, auto_ack=True)
-                channel.start_consuming()
+                channel.basic_qos(prefetch_count=max(prefetch_count or 0, batch_size * max(workers, 1)))
+                batch: list[Delivery] = []
+                deadline = 0.0
+                for method, properties, body in channel.consume(queue_name, inactivity_timeout=batch_timeout / 2):
+                    if method is not None:
+                        if not batch:
+                            deadline = monotonic() + batch_timeout
+                        batch.append((method, properties, body))
+                    if batch and (len(batch) >= batch_size or monotonic() >= deadline):
+                        MESSAGES_CONSUMED.labels(queue_name).inc(len(batch))
+                        BATCH_SIZE.labels("consume").observe(len(batch))
+                        if executor is not None:
+                            executor.submit(self._process_batch, call_back, channel, batch)
+                        else:
+                            call_back(batch)
+                            channel.basic_ack(delivery_tag=batch[-1][0].delivery_tag, multiple=True)
+                        batch = []
         except AMQPConnectionError as ex:
             raise RabbitMqConnectionException(ex)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+    @staticmethod
+    def _process_batch(
+        call_back: Callable[[list[Delivery]], None],
+        channel: BlockingChannel,
+        batch: list[Delivery],
+    ) -> None:
+        """
+        Processes a batch in a worker and acknowledges its messages one by one on the connection thread.
+
+        Batches complete out of order, so a multiple ack would also acknowledge messages of batches still in progress.
+        """
+        try:
+            call_back(batch)
+        except Exception as ex:
+            logger.error("Failed to process batch of %d messages: %s", len(batch), str(ex))
+            settle = partial(channel.basic_nack, requeue=True)
+        else:
+            settle = channel.basic_ack
+
+        def settle_batch() -> None:
+            for method, _, _ in batch:
+                settle(delivery_tag=method.delivery_tag)
+
+        try:
+            channel.connection.add_callback_threadsafe(settle_batch)
+        except AMQPError as ex:
+            # Messages are redelivered once the consumer reconnects.
+            logger.warning("Failed to settle batch of %d messages: %s", len(batch), str(ex))
@@ -0,0 +1,233 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Codecs of queue messages.
+
+A publisher encodes messages with its codec and labels them with the codec's AMQP ``content_type``, consumers pick the
+codec by that label, so publishers can switch codecs while older messages are still queued. Messages without a known
+``content_type`` are decoded as JSON.
+
+The binary codec encodes the JSON data model plus ``uuid.UUID`` (16 raw bytes) and ``datetime`` (microseconds since
+the epoch) natively, which makes timer messages about half the size of their JSON form and saves formatting and
+parsing of ids and timestamps on every hop.
+"""
+import json
+import struct
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional, Union
+
+JSON_CONTENT_TYPE = "application/json"
+BINARY_CONTENT_TYPE = "application/x-timer-binary"
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Version byte heading every binary message, bumped on incompatible changes of the format.
+BINARY_VERSION = 1
+
+# Type tags of binary values.
+NONE, FALSE, TRUE, INT, FLOAT, STR, BYTES, LIST, DICT, UUID, DATETIME = range(11)
+
+_DOUBLE = struct.Struct(">d")
+
+
+class JsonCodec:
+    """UTF-8 JSON, ids and timestamps are encoded as strings."""
+    content_type = JSON_CONTENT_TYPE
+
+    @staticmethod
+    def _default(value: Any) -> str:
+        if isinstance(value, (uuid.UUID, datetime)):
+            return str(value)
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    def encode(self, message: Any) -> bytes:
+        return json.dumps(message, default=self._default).encode()
+
+    def decode(self, body: bytes) -> Any:
+        try:
+            return json.loads(body.decode())
+        except RecursionError as ex:
+            raise ValueError("JSON message is nested too deeply") from ex
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(body: bytes, offset: int) -> tuple[int, int]:
+    """Reads a varint at a given offset, returns it with the offset following it."""
+    byte = body[offset]
+    offset += 1
+    value = byte & 0x7F
+    shift = 7
+    while byte > 0x7F:
+        byte = body[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+    return value, offset
+
+
+def _zigzag(value: int) -> int:
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def _epoch_microseconds(value: datetime) -> int:
+    if value.tzinfo is None:
+        raise ValueError("Naive datetimes can't be encoded, attach a timezone")
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+class BinaryCodec:
+    """
+    Compact tagged binary format with native UUIDs and timestamps.
+
+    Every value is a type tag byte followed by its payload: integers as zigzag varints, strings and bytes prefixed with
+    their varint length, lists and dicts with their varint number of items.
+    """
+    content_type = BINARY_CONTENT_TYPE
+
+    def encode(self, message: Any) -> bytes:
+        out = bytearray((BINARY_VERSION,))
+        self._write(out, message)
+        return bytes(out)
+
+    def decode(self, body: bytes) -> Any:
+        if not body or body[0] != BINARY_VERSION:
+            raise ValueError("Unsupported binary message version")
+        try:
+            value, offset = self._read(body, 1)
+        except (IndexError, struct.error) as ex:
+            raise ValueError("Truncated binary message") from ex
+        except OverflowError as ex:
+            raise ValueError("Timestamp out of range in binary message") from ex
+        except RecursionError as ex:
+            raise ValueError("Binary message is nested too deeply") from ex
+        if offset != len(body):
+            raise ValueError("Trailing data in binary message")
+        return value
+
+    def _write(self, out: bytearray, value: Any) -> None:
+        # Checks are ordered by frequency in timer messages, booleans go before integers as they are integers too.
+        if isinstance(value, str):
+            encoded = value.encode()
+            out.append(STR)
+            _write_varint(out, len(encoded))
+            out += encoded
+        elif value is None:
+            out.append(NONE)
+        elif value is False:
+            out.append(FALSE)
+        elif value is True:
+            out.append(TRUE)
+        elif isinstance(value, int):
+            out.append(INT)
+            _write_varint(out, _zigzag(value))
+        elif isinstance(value, uuid.UUID):
+            out.append(UUID)
+            out += value.bytes
+        elif isinstance(value, datetime):
+            micros = _epoch_microseconds(value)
+            out.append(DATETIME)
+            _write_varint(out, _zigzag(micros))
+        elif isinstance(value, dict):
+            out.append(DICT)
+            _write_varint(out, len(value))
+            for key, item in value.items():
+                self._write(out, key)
+                self._write(out, item)
+        elif isinstance(value, (list, tuple)):
+            out.append(LIST)
+            _write_varint(out, len(value))
+            for item in value:
+                self._write(out, item)
+        elif isinstance(value, float):
+            out.append(FLOAT)
+            out += _DOUBLE.pack(value)
+        elif isinstance(value, (bytes, bytearray)):
+            out.append(BYTES)
+            _write_varint(out, len(value))
+            out += value
+        else:
+            raise TypeError(f"Object of type {type(value).__name__} can't be encoded")
+
+    def _read(self, body: bytes, offset: int) -> tuple[Any, int]:
+        """Reads a value at a given offset, returns it with the offset following it."""
+        tag = body[offset]
+        offset += 1
+        if tag == STR or tag == BYTES:
+            size, offset = _read_varint(body, offset)
+            end = offset + size
+            if end > len(body):
+                raise ValueError("Truncated binary message")
+            chunk = body[offset:end]
+            return (chunk.decode() if tag == STR else bytes(chunk)), end
+        if tag == INT:
+            value, offset = _read_varint(body, offset)
+            return _unzigzag(value), offset
+        if tag == DICT:
+            size, offset = _read_varint(body, offset)
+            result = {}
+            for _ in range(size):
+                key, offset = self._read(body, offset)
+                result[key], offset = self._read(body, offset)
+            return result, offset
+        if tag == UUID:
+            if offset + 16 > len(body):
+                raise ValueError("Truncated binary message")
+            return uuid.UUID(bytes=bytes(body[offset:offset + 16])), offset + 16
+        if tag == DATETIME:
+            value, offset = _read_varint(body, offset)
+            return EPOCH + timedelta(microseconds=_unzigzag(value)), offset
+        if tag == LIST:
+            size, offset = _read_varint(body, offset)
+            items = []
+            for _ in range(size):
+                item, offset = self._read(body, offset)
+                items.append(item)
+            return items, offset
+        if tag == NONE:
+            return None, offset
+        if tag == FALSE:
+            return False, offset
+        if tag == TRUE:
+            return True, offset
+        if tag == FLOAT:
+            return _DOUBLE.unpack_from(body, offset)[0], offset + 8
+        raise ValueError(f"Unknown type tag {tag} in binary message")
+
+
+JSON_CODEC = JsonCodec()
+BINARY_CODEC = BinaryCodec()
+Codec = Union[JsonCodec, BinaryCodec]
+CODECS: dict[str, Codec] = {codec.content_type: codec for codec in (JSON_CODEC, BINARY_CODEC)}
+
+
+def get_codec(content_type: Optional[str]) -> Codec:
+    """Retrieves the codec of a given content type, JSON if the content type is missing or unknown."""
+    return CODECS.get(content_type or JSON_CODEC.content_type, JSON_CODEC)
+
+
+def decode_message(properties: Any, body: bytes) -> Any:
+    """Decodes a delivered message by the codec of its ``content_type`` property, raises ValueError if malformed."""
+    return get_codec(getattr(properties, "content_type", None)).decode(body)
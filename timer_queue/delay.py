@@ -0,0 +1,93 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Delayed redelivery of messages through RabbitMQ delay queues.
+
+A delay queue holds messages for a fixed time (its message TTL) and then dead-letters them back into the target
+queue. Since all messages of a delay queue expire after the same time, they expire in order and none of them blocks
+the others, so delays are arranged into tiers with one queue per tier. Delayed messages don't occupy consumers while
+they wait.
+"""
+from typing import Any, Optional
+
+from pika.adapters.blocking_connection import BlockingChannel
+
+# Header counting delivery attempts of a message.
+ATTEMPTS_HEADER = "x-attempts"
+# Field of incoming timer messages marking timers fired through delay queues rather than timers_to_fire.
+FIRED_BY_BROKER_FIELD = "fired_by_broker"
+
+
+def delay_queue_name(queue_name: str, delay_ms: int) -> str:
+    """Retrieves the name of the delay queue redelivering messages into a given queue after a given delay."""
+    return f"{queue_name}.delay.{delay_ms}ms"
+
+
+def dead_letter_queue_name(queue_name: str) -> str:
+    """Retrieves the name of the queue collecting messages of a given queue that can't be processed."""
+    return f"{queue_name}.dead"
+
+
+def backoff_delays(base_ms: int, max_ms: int) -> list[int]:
+    """Retrieves exponentially growing delay tiers, ``base_ms``, ``2 * base_ms``, ... up to ``max_ms``."""
+    if not 0 < base_ms <= max_ms:
+        raise ValueError("Delays must satisfy 0 < base_ms <= max_ms")
+    delays = []
+    delay = base_ms
+    while delay < max_ms:
+        delays.append(delay)
+        delay *= 2
+    delays.append(max_ms)
+    return delays
+
+
+def delay_for_attempt(attempt: int, delays: list[int]) -> int:
+    """Retrieves the delay before the next delivery of a message that has failed ``attempt`` times."""
+    return delays[min(max(attempt, 1), len(delays)) - 1]
+
+
+def delay_tier(delay_ms: float, delays: list[int]) -> Optional[int]:
+    """
+    Retrieves the tier of ascending delay tiers to wait through towards a given delay: the longest one not exceeding
+    the delay, or the shortest one if the delay is at least half of it. Returns None for shorter delays, the message is
+    due then. Waiting tier by tier, a message is off by no more than half of the shortest tier.
+    """
+    if not delays or delay_ms < delays[0] / 2:
+        return None
+    tier = delays[0]
+    for delay in delays:
+        if delay > delay_ms:
+            break
+        tier = delay
+    return tier
+
+
+def delay_queue_arguments(queue_name: str, delay_ms: int) -> dict[str, Any]:
+    """Retrieves arguments of a delay queue."""
+    return {
+        "x-message-ttl": delay_ms,
+        "x-dead-letter-exchange": "",
+        "x-dead-letter-routing-key": queue_name,
+    }
+
+
+def declare_delay_queues(channel: BlockingChannel, queue_name: str, delays: list[int]) -> None:
+    """Declares delay queues of all given tiers and the dead letter queue of a given queue."""
+    for delay in delays:
+        channel.queue_declare(
+            queue=delay_queue_name(queue_name, delay),
+            durable=True,
+            arguments=delay_queue_arguments(queue_name, delay),
+        )
+    channel.queue_declare(queue=dead_letter_queue_name(queue_name), durable=True)
@@ -0,0 +1,108 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""
+Tracing of timers across services.
+
+Every timer message carries a trace: a dict with the trace id and the moments the timer passed each hop of the
+pipeline. The webserver starts it, the consumer stores it along with the timer in ``timers_to_fire``, the timer service
+forwards it in the message to fire and the trigger breaks down how late the hook fired into stages.
+
+Hop moments are datetimes, or strings once the trace went through JSON, so they are read with ``hop_time``. Moments are
+taken by clocks of different hosts, so stages are as accurate as the clocks are in sync.
+"""
+import json
+import uuid
+from datetime import datetime, UTC
+from typing import Any, Optional
+
+# Key of the trace in a timer message.
+TRACE_FIELD = "trace"
+
+# Hops in the order a timer passes them.
+PUBLISHED_AT = "published_at"
+CONSUMED_AT = "consumed_at"
+CLAIMED_AT = "claimed_at"
+DISPATCHED_AT = "dispatched_at"
+RECEIVED_AT = "received_at"
+
+# Stages between hops, the stage takes the time from the first moment to the second one.
+STAGES = {
+    "incoming_queue": (PUBLISHED_AT, CONSUMED_AT),
+    "db_wait": (CONSUMED_AT, CLAIMED_AT),
+    "outgoing_queue": (DISPATCHED_AT, RECEIVED_AT),
+}
+
+
+def new_trace(trace_id: Optional[str] = None) -> dict[str, Any]:
+    """Starts a trace with a given id, or with a random one."""
+    return {"id": trace_id or uuid.uuid4().hex}
+
+
+def load_trace(value: Any) -> dict[str, Any]:
+    """Retrieves a trace from a message field or a database column, a missing or malformed one is started anew."""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            value = None
+    return dict(value) if isinstance(value, dict) and "id" in value else new_trace()
+
+
+def dump_trace(trace: dict[str, Any]) -> str:
+    """Retrieves the JSON form of a trace for a database column."""
+    return json.dumps({key: str(value) if isinstance(value, datetime) else value for key, value in trace.items()})
+
+
+def record_hop(trace: Any, hop: str, at: Optional[datetime] = None) -> dict[str, Any]:
+    """Retrieves a copy of a trace with the moment a given hop was passed, now by default."""
+    trace = load_trace(trace)
+    trace[hop] = at or datetime.now(UTC)
+    return trace
+
+
+def parse_time(value: Any) -> Optional[datetime]:
+    """
+    Retrieves a moment carried by a message either as a datetime or as a string, if it's valid. Moments without a time
+    zone are taken as UTC, so they can be compared with the ones of the services.
+    """
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return value if value.tzinfo is not None else value.replace(tzinfo=UTC)
+
+
+def hop_time(trace: dict[str, Any], hop: str) -> Optional[datetime]:
+    """Retrieves the moment a given hop was passed, if it's known."""
+    return parse_time(trace.get(hop))
+
+
+def firing_stages(trace: dict[str, Any], fire_at: datetime) -> dict[str, float]:
+    """
+    Retrieves durations of stages a timer went through in seconds, stages with unknown moments are left out.
+
+    Apart from the stages between hops, ``poll_delay`` is the time from the firing moment until the timer service
+    dispatched the timer.
+    """
+    stages = {}
+    for stage, (start_hop, end_hop) in STAGES.items():
+        start, end = hop_time(trace, start_hop), hop_time(trace, end_hop)
+        if start is not None and end is not None:
+            stages[stage] = (end - start).total_seconds()
+    if (dispatched_at := hop_time(trace, DISPATCHED_AT)) is not None:
+        stages["poll_delay"] = (dispatched_at - fire_at).total_seconds()
+    return stages
@@ -0,0 +1,160 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""Asynchronous webhook delivery engine"""
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+from time import monotonic
+from typing import Any, AsyncIterator, Callable, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from metrics.registry import observe_webhook
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryResult(NamedTuple):
+    """Outcome of a single webhook delivery."""
+    url: str
+    status_code: Optional[int]
+    error: Optional[str]
+    elapsed: float
+    # Whether the delivery can't succeed whenever it's retried, e.g. because the URL is malformed.
+    permanent: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code is not None and 200 <= self.status_code < 300
+
+    @property
+    def retryable(self) -> bool:
+        """Whether the delivery may succeed later: network errors, timeouts, throttling and server errors."""
+        if self.permanent:
+            return False
+        return self.status_code is None or self.status_code in (408, 429) or self.status_code >= 500
+
+
+class TriggerEngine:
+    """
+    Delivers webhooks from an asyncio event loop running in a background thread.
+
+    All deliveries share a single pooled keep-alive HTTP client. At most ``concurrency`` requests are in flight at once,
+    and at most ``per_host_concurrency`` of them target the same host, so a slow endpoint can't take all of them. The
+    limit of a host is kept only while deliveries to it are pending, so hosts seen once don't accumulate.
+    """
+    def __init__(
+        self,
+        concurrency: int = 100,
+        per_host_concurrency: int = 10,
+        timeout: float = 10.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ) -> None:
+        self.concurrency = concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.timeout = timeout
+        self.transport = transport
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="trigger-engine", daemon=True)
+        self._client: httpx.AsyncClient
+        self._semaphore: asyncio.Semaphore
+        # Semaphore of every host with pending deliveries and the number of these deliveries.
+        self._host_semaphores: dict[str, tuple[asyncio.Semaphore, int]] = {}
+
+    async def _setup(self) -> None:
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.timeout),
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            transport=self.transport,
+        )
+
+    def start(self) -> None:
+        """Starts the event loop thread."""
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._setup(), self._loop).result()
+
+    def stop(self) -> None:
+        """Closes the HTTP client and stops the event loop thread."""
+        asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    @asynccontextmanager
+    async def _host_slot(self, host: str) -> AsyncIterator[None]:
+        """Holds a slot of a given host, the host's semaphore is dropped once no delivery to the host is pending."""
+        semaphore, pending = self._host_semaphores.get(host, (None, 0))
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_host_concurrency)
+        self._host_semaphores[host] = (semaphore, pending + 1)
+        try:
+            async with semaphore:
+                yield
+        finally:
+            semaphore, pending = self._host_semaphores[host]
+            if pending > 1:
+                self._host_semaphores[host] = (semaphore, pending - 1)
+            else:
+                del self._host_semaphores[host]
+
+    async def deliver(self, url: str, payload: Any) -> DeliveryResult:
+        """
+        Posts the payload to the URL, never raising.
+
+        A delivery waits for a slot of its host before taking a global one, so deliveries queued for a slow host don't
+        hold global slots. Deliveries to malformed URLs fail as not retryable.
+        """
+        try:
+            host = urlsplit(url).netloc
+        except ValueError as ex:
+            return DeliveryResult(url=url, status_code=None, error=repr(ex), elapsed=0.0, permanent=True)
+        started_at = monotonic()
+        try:
+            async with self._host_slot(host), self._semaphore:
+                started_at = monotonic()
+                response = await self._client.post(url, json=payload)
+        except httpx.UnsupportedProtocol as ex:
+            result = DeliveryResult(
+                url=url, status_code=None, error=repr(ex), elapsed=monotonic() - started_at, permanent=True,
+            )
+        except httpx.HTTPError as ex:
+            result = DeliveryResult(url=url, status_code=None, error=repr(ex), elapsed=monotonic() - started_at)
+        except Exception as ex:
+            # E.g. httpx.InvalidURL, which isn't an HTTPError, or a payload that can't be serialised.
+            result = DeliveryResult(
+                url=url, status_code=None, error=repr(ex), elapsed=monotonic() - started_at, permanent=True,
+            )
+        else:
+            result = DeliveryResult(
+                url=url, status_code=response.status_code, error=None, elapsed=monotonic() - started_at,
+            )
+        observe_webhook(url, result.status_code, result.elapsed)
+        return result
+
+    def submit(self, url: str, payload: Any, on_done: Callable[[DeliveryResult], None]) -> None:
+        """
+        Schedules delivery from any thread without waiting for it.
+
+        The callback is invoked from the event loop thread once the delivery has finished.
+        """
+        async def run() -> None:
+            result = await self.deliver(url, payload)
+            try:
+                on_done(result)
+            except Exception:
+                logger.exception("Delivery callback for %s failed", url)
+
+        asyncio.run_coroutine_threadsafe(run(), self._loop)
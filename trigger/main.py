@@ -12,39 +12,230 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
-import json
 import logging
 import os
+from datetime import datetime, timedelta, UTC
+from functools import partial
 from time import sleep
+from typing import Any, Optional
 
-import requests
+from pika import BasicProperties
+from pika.exceptions import AMQPError
 
-from timer_queue.client import RabbitMQClient
+from metrics.registry import observe_firing, start_metrics_server
+from trigger.engine import DeliveryResult, TriggerEngine
+from timer_queue.client import RabbitMQClient, ack_threadsafe
+from timer_queue.codec import decode_message
+from timer_queue.delay import (
+    ATTEMPTS_HEADER,
+    backoff_delays,
+    dead_letter_queue_name,
+    declare_delay_queues,
+    delay_for_attempt,
+    delay_queue_name,
+    delay_tier,
+)
 from timer_queue.exceptions import RabbitMqConnectionException
+from timer_queue.trace import RECEIVED_AT, TRACE_FIELD, firing_stages, hop_time, parse_time, record_hop
 
 RABBIT_MQ_HOST = os.environ.get("RABBIT_MQ_HOST", "rabbitmq")
 RABBIT_MQ_PORT = int(os.environ.get("RABBIT_MQ_PORT", "5672"))
 RABBIT_MQ_TO_FIRE = os.environ.get("RABBIT_MQ_TO_FIRE", "unknown_incoming")
 RABBIT_MQ_RECONNECTING_INTERVAL = int(os.environ.get("RABBIT_MQ_RECONNECTING_INTERVAL", "2"))
+# Maximum number of messages being delivered at once, the broker doesn't send more until some of them are acked.
+RABBIT_MQ_PREFETCH = int(os.environ.get("RABBIT_MQ_PREFETCH", "1000"))
+
+TRIGGER_CONCURRENCY = int(os.environ.get("TRIGGER_CONCURRENCY", "500"))
+TRIGGER_PER_HOST_CONCURRENCY = int(os.environ.get("TRIGGER_PER_HOST_CONCURRENCY", "50"))
+TRIGGER_TIMEOUT_SECONDS = float(os.environ.get("TRIGGER_TIMEOUT_SECONDS", "10"))
+# Failed deliveries are retried after exponentially growing delays, the hook is dead-lettered after the last attempt.
+TRIGGER_MAX_ATTEMPTS = int(os.environ.get("TRIGGER_MAX_ATTEMPTS", "5"))
+TRIGGER_RETRY_BASE_DELAY_MS = int(os.environ.get("TRIGGER_RETRY_BASE_DELAY_MS", "1000"))
+TRIGGER_RETRY_MAX_DELAY_MS = int(os.environ.get("TRIGGER_RETRY_MAX_DELAY_MS", "300000"))
+# Delay tiers of timers fired through the broker by the webserver, the same settings as the webserver's ones.
+TIMER_FAST_PATH_THRESHOLD_SECONDS = int(os.environ.get("TIMER_FAST_PATH_THRESHOLD_SECONDS", "0"))
+TIMER_FAST_PATH_RESOLUTION_MS = int(os.environ.get("TIMER_FAST_PATH_RESOLUTION_MS", "100"))
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9100"))
 
 
 logger = logging.getLogger(__name__)
 
 
+def republish(
+    ch,
+    queue_name: str,
+    body: bytes,
+    attempts: int,
+    delivery_tag: int,
+    content_type: Optional[str] = None,
+) -> None:
+    """Moves a message to another queue: publishes its copy with a number of attempts made, then acks the original."""
+    ch.basic_publish(
+        exchange="",
+        routing_key=queue_name,
+        body=body,
+        properties=BasicProperties(
+            content_type=content_type, delivery_mode=2, headers={ATTEMPTS_HEADER: attempts},
+        ),
+    )
+    ch.basic_ack(delivery_tag=delivery_tag)
+
+
+def republish_threadsafe(
+    ch,
+    queue_name: str,
+    body: bytes,
+    attempts: int,
+    delivery_tag: int,
+    content_type: Optional[str] = None,
+) -> None:
+    """Moves a message to another queue from any thread by handing it over to the connection thread."""
+    try:
+        ch.connection.add_callback_threadsafe(partial(
+            republish,
+            ch,
+            queue_name=queue_name,
+            body=body,
+            attempts=attempts,
+            delivery_tag=delivery_tag,
+            content_type=content_type,
+        ))
+    except AMQPError as ex:
+        # The message stays unacknowledged, so it's redelivered once the consumer reconnects.
+        logger.warning("Failed to move message %d to %s: %s", delivery_tag, queue_name, str(ex))
+
+
+def delivery_attempt(properties) -> int:
+    """Retrieves the number of the current delivery attempt of a message, starting with 1."""
+    headers = getattr(properties, "headers", None) or {}
+    try:
+        return int(headers.get(ATTEMPTS_HEADER, 0)) + 1
+    except (TypeError, ValueError):
+        return 1
+
+
+def waiting_delays(retry_delays: list[int]) -> list[int]:
+    """Retrieves all delay tiers of the queue: retry ones and ones of the fast path, if it's enabled."""
+    delays = set(retry_delays)
+    if TIMER_FAST_PATH_THRESHOLD_SECONDS > 0:
+        delays.update(backoff_delays(TIMER_FAST_PATH_RESOLUTION_MS, TIMER_FAST_PATH_THRESHOLD_SECONDS * 1000))
+    return sorted(delays)
+
+
+def report_firing(timer_id: str, fire_at: datetime, trace: dict[str, Any], result: DeliveryResult) -> None:
+    """
+    Records how late a hook was sent compared with the firing moment of its timer, and the stages that took the time,
+    as metrics and a log line of ``key=value`` pairs.
+    """
+    sent_at = datetime.now(UTC) - timedelta(seconds=result.elapsed)
+    lateness = (sent_at - fire_at).total_seconds()
+    stages = firing_stages(trace, fire_at)
+    if (received_at := hop_time(trace, RECEIVED_AT)) is not None:
+        stages["trigger_wait"] = (sent_at - received_at).total_seconds()
+    stages["http"] = result.elapsed
+    observe_firing(lateness, stages)
+    logger.info(
+        "Timer fired: id=%s trace=%s status=%s lateness=%.3fs %s",
+        timer_id,
+        trace["id"],
+        result.status_code,
+        lateness,
+        " ".join(f"{stage}={seconds:.3f}s" for stage, seconds in stages.items()),
+    )
+
 
 def fire_hooks():
-    """Callback for saving incoming messages to database."""
+    """
+    Consumes timers ready to fire and delivers their webhooks without blocking the consumer.
+
+    A failed delivery is retried through a delay queue: the message is acked and its copy waits in the broker for the
+    backoff delay of the attempt, so pending retries hold neither a prefetch slot nor a connection of the engine.
+    Hooks failing permanently or ``TRIGGER_MAX_ATTEMPTS`` times end up in the dead letter queue.
+
+    The lateness of the first attempt is reported, retries are late by design.
+
+    Timers fired by the broker arrive through delay tiers and may arrive before they are due, such messages are passed
+    on to the next tier as they are, without counting an attempt.
+    """
+    retry_delays = backoff_delays(TRIGGER_RETRY_BASE_DELAY_MS, TRIGGER_RETRY_MAX_DELAY_MS)
+    delays = waiting_delays(retry_delays)
+    engine = TriggerEngine(
+        concurrency=TRIGGER_CONCURRENCY,
+        per_host_concurrency=TRIGGER_PER_HOST_CONCURRENCY,
+        timeout=TRIGGER_TIMEOUT_SECONDS,
+    )
+    engine.start()
+    start_metrics_server(METRICS_PORT)
+
     def callback(ch, method, properties, body):
         logger.info("Received %r" % body)
-        body = json.loads(body.decode())
-        response = requests.post(url=body["url"], json={"id": body["id"]})
-        logger.info(f"Firing hook {body}. Response status code: {response.status_code}")
+        raw_body = body
+        attempt = delivery_attempt(properties)
+        received_at = datetime.now(UTC)
+        try:
+            body = decode_message(properties, body)
+            url, payload = body["url"], {"id": str(body["id"])}
+            fire_at = parse_time(body.get("fire_at"))
+            trace = record_hop(body.get(TRACE_FIELD), RECEIVED_AT, at=received_at)
+        except (ValueError, KeyError, TypeError, AttributeError) as ex:
+            logger.error("Skipping malformed message %r: %s", body, str(ex))
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            return
+        if fire_at is not None:
+            tier = delay_tier((fire_at - received_at).total_seconds() * 1000, delays)
+            if tier is not None:
+                logger.info(f"Hook {body} isn't due yet, waiting {tier} ms more")
+                republish(
+                    ch,
+                    queue_name=delay_queue_name(RABBIT_MQ_TO_FIRE, tier),
+                    body=raw_body,
+                    attempts=attempt - 1,
+                    delivery_tag=method.delivery_tag,
+                    content_type=getattr(properties, "content_type", None),
+                )
+                return
+
+        def on_done(result: DeliveryResult) -> None:
+            if attempt == 1 and fire_at is not None:
+                report_firing(payload["id"], fire_at, trace, result)
+            if result.ok:
+                logger.info(f"Firing hook {body}. Response status code: {result.status_code}")
+                ack_threadsafe(ch, delivery_tag=method.delivery_tag)
+                return
+            logger.warning(
+                f"Firing hook {body} failed (attempt {attempt}). Status code: {result.status_code}, "
+                f"error: {result.error}"
+            )
+            if result.retryable and attempt < TRIGGER_MAX_ATTEMPTS:
+                delay = delay_for_attempt(attempt, retry_delays)
+                logger.info(f"Retrying hook {body} in {delay} ms")
+                queue_name = delay_queue_name(RABBIT_MQ_TO_FIRE, delay)
+            else:
+                logger.error(f"Giving up firing hook {body} after {attempt} attempt(s)")
+                queue_name = dead_letter_queue_name(RABBIT_MQ_TO_FIRE)
+            republish_threadsafe(
+                ch,
+                queue_name=queue_name,
+                body=raw_body,
+                attempts=attempt,
+                delivery_tag=method.delivery_tag,
+                content_type=getattr(properties, "content_type", None),
+            )
+
+        engine.submit(url=url, payload=payload, on_done=on_done)
 
     while True:
         queue_client = RabbitMQClient(host=RABBIT_MQ_HOST, port=RABBIT_MQ_PORT)
         try:
-            queue_client.consume_messages(queue_name=RABBIT_MQ_TO_FIRE, call_back=callback)
+            queue_client.consume_messages(
+                queue_name=RABBIT_MQ_TO_FIRE,
+                call_back=callback,
+                prefetch_count=RABBIT_MQ_PREFETCH,
+                auto_ack=False,
+                setup=partial(declare_delay_queues, queue_name=RABBIT_MQ_TO_FIRE, delays=delays),
+            )
         except KeyboardInterrupt:
+            engine.stop()
             return
         except RabbitMqConnectionException as ex:
             logger.warning(
@@ -56,4 +247,4 @@ def fire_hooks():
 
 
 if __name__ == "__main__":
-    fire_hooks()
\ No newline at end of file
+    fire_hooks()
@@ -0,0 +1,42 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+from typing import Annotated
+
+from fastapi import Depends
+
+from timer_queue.async_client import AsyncRabbitMQClient
+from timer_queue.codec import JSON_CONTENT_TYPE, get_codec
+
+RABBIT_MQ_HOST = os.environ.get("RABBIT_MQ_HOST", "0.0.0.0")
+RABBIT_MQ_PORT = int(os.environ.get("RABBIT_MQ_PORT", "5672"))
+RABBIT_MQ_CONFIRM_TIMEOUT = float(os.environ.get("RABBIT_MQ_CONFIRM_TIMEOUT", "5"))
+# Content type of published messages, "application/x-timer-binary" is more compact than the default JSON.
+RABBIT_MQ_CONTENT_TYPE = os.environ.get("RABBIT_MQ_CONTENT_TYPE", JSON_CONTENT_TYPE)
+
+
+queue_client = AsyncRabbitMQClient(
+    host=RABBIT_MQ_HOST,
+    port=RABBIT_MQ_PORT,
+    confirm_timeout=RABBIT_MQ_CONFIRM_TIMEOUT,
+    codec=get_codec(RABBIT_MQ_CONTENT_TYPE),
+)
+
+
+def get_queue_client() -> AsyncRabbitMQClient:
+    return queue_client
+
+
+QueueClientDep = Annotated[AsyncRabbitMQClient, Depends(get_queue_client)]
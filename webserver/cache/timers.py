@@ -0,0 +1,73 @@
+#  Copyright (c) [2024] [Maksim Moiseenkov]
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+"""In-process read-through cache of timer firing moments"""
+import os
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Annotated, Optional
+
+from fastapi import Depends
+
+from webserver.utils.timer import utc_now
+
+# Maximum number of timers kept in the cache of every webserver instance, 0 disables the cache.
+TIMER_CACHE_SIZE = int(os.environ.get("TIMER_CACHE_SIZE", "100000"))
+
+
+class TimerCache:
+    """
+    LRU cache mapping timer ids to their ``fire_at``.
+
+    A timer never changes once created, so cached entries are never stale. An entry is dropped as soon as its timer
+    has fired, or when the cache holds more than ``max_size`` timers, the least recently used one is dropped.
+    """
+    def __init__(self, max_size: int) -> None:
+        if max_size < 0:
+            raise ValueError("Cache size must not be negative")
+        self.max_size = max_size
+        self._fire_at: OrderedDict[uuid.UUID, datetime] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._fire_at)
+
+    def put(self, timer_id: uuid.UUID, fire_at: datetime) -> None:
+        """Caches the firing moment of a timer unless it has already fired."""
+        if not self.max_size or fire_at <= utc_now():
+            return
+        self._fire_at[timer_id] = fire_at
+        self._fire_at.move_to_end(timer_id)
+        while len(self._fire_at) > self.max_size:
+            self._fire_at.popitem(last=False)
+
+    def get(self, timer_id: uuid.UUID) -> Optional[datetime]:
+        """Retrieves the firing moment of a cached timer, or None if the timer isn't cached or has already fired."""
+        fire_at = self._fire_at.get(timer_id)
+        if fire_at is None:
+            return None
+        if fire_at <= utc_now():
+            del self._fire_at[timer_id]
+            return None
+        self._fire_at.move_to_end(timer_id)
+        return fire_at
+
+
+timer_cache = TimerCache(max_size=TIMER_CACHE_SIZE)
+
+
+def get_timer_cache() -> TimerCache:
+    return timer_cache
+
+
+TimerCacheDep = Annotated[TimerCache, Depends(get_timer_cache)]
@@ -12,19 +12,35 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+import logging
 import os
-from typing import Annotated
+from time import perf_counter
+from typing import Annotated, Any, AsyncIterator
 
 from fastapi import Depends
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from metrics.registry import DB_QUERY_LATENCY
 
 POSTGRES_HOST = os.environ.get("POSTGRES_HOST", "postgres")
 POSTGRES_PORT = int(os.environ.get("POSTGRES_PORT", "5432"))
 POSTGRES_USER = os.environ.get("POSTGRES_USER", "postgres")
 POSTGRES_PASSWORD =os.environ.get("POSTGRES_PASSWORD", "postgres")
 POSTGRES_DB = os.environ.get("POSTGRES_DB", "postgres")
+POSTGRES_POOL_SIZE = int(os.environ.get("POSTGRES_POOL_SIZE", "10"))
+POSTGRES_MAX_OVERFLOW = int(os.environ.get("POSTGRES_MAX_OVERFLOW", "20"))
+POSTGRES_POOL_RECYCLE = int(os.environ.get("POSTGRES_POOL_RECYCLE", "1800"))
+POSTGRES_STATEMENT_CACHE_SIZE = int(os.environ.get("POSTGRES_STATEMENT_CACHE_SIZE", "500"))
+SQL_ECHO = os.environ.get("SQL_ECHO", "false").lower() == "true"
+# Queries running longer than this many milliseconds are logged, 0 disables the slow query log.
+SQL_SLOW_QUERY_MS = float(os.environ.get("SQL_SLOW_QUERY_MS", "0"))
+
+logger = logging.getLogger(__name__)
 
 
 postgres_url = "postgresql://{user}:{password}@{host}:{port}/{db}".format(
@@ -34,14 +50,53 @@ postgres_url = "postgresql://{user}:{password}@{host}:{port}/{db}".format(
     port=POSTGRES_PORT,
     db=POSTGRES_DB,
 )
-engine = create_engine(postgres_url, echo=True)
+# asyncpg prepares every statement; prepared statements are cached per connection and reused across requests.
+async_postgres_url = "{url}?prepared_statement_cache_size={cache}".format(
+    url=postgres_url.replace("postgresql://", "postgresql+asyncpg://", 1),
+    cache=POSTGRES_STATEMENT_CACHE_SIZE,
+)
+pool_options: dict[str, Any] = dict(
+    pool_size=POSTGRES_POOL_SIZE,
+    max_overflow=POSTGRES_MAX_OVERFLOW,
+    pool_recycle=POSTGRES_POOL_RECYCLE,
+    pool_pre_ping=True,
+)
+engine = create_engine(postgres_url, echo=SQL_ECHO, **pool_options)
+async_engine = create_async_engine(async_postgres_url, echo=SQL_ECHO, **pool_options)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+def start_query_timer(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("query_started_at", []).append(perf_counter())
+
+
+def record_query(conn, cursor, statement, parameters, context, executemany) -> None:
+    elapsed = perf_counter() - conn.info["query_started_at"].pop()
+    words = statement.split(None, 1)
+    DB_QUERY_LATENCY.labels(words[0].lower() if words else "unknown").observe(elapsed)
+    if SQL_SLOW_QUERY_MS > 0 and elapsed * 1000 >= SQL_SLOW_QUERY_MS:
+        logger.warning("Slow query took %.1f ms: %s", elapsed * 1000, statement)
+
+
+def enable_query_timing(target: Engine) -> None:
+    """Records latency of statements of a given engine and logs the ones running longer than SQL_SLOW_QUERY_MS."""
+    event.listen(target, "before_cursor_execute", start_query_timer)
+    event.listen(target, "after_cursor_execute", record_query)
+
+
+enable_query_timing(engine)
+enable_query_timing(async_engine.sync_engine)
+
+
 def get_session():
     with Session(engine) as session:
         yield session
 
 
-SessionDep = Annotated[Session, Depends(get_session)]
+async def get_async_session() -> AsyncIterator[AsyncSession]:
+    async with AsyncSession(async_engine) as session:
+        yield session
 
+
+SessionDep = Annotated[Session, Depends(get_session)]
+AsyncSessionDep = Annotated[AsyncSession, Depends(get_async_session)]
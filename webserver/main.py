@@ -11,14 +11,27 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 
+from webserver.broker.client import queue_client
 from webserver.routers import (
     health,
+    metrics,
     timer,
 )
 
-app = FastAPI(swagger_ui_parameters={"docExpansion": "list"})
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    """Opens the broker connection shared by all requests for the lifetime of the application."""
+    await queue_client.connect()
+    yield
+    await queue_client.close()
+
+
+app = FastAPI(swagger_ui_parameters={"docExpansion": "list"}, lifespan=lifespan)
 app.include_router(health.router)
+app.include_router(metrics.router)
 app.include_router(timer.router)
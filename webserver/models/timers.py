@@ -13,12 +13,15 @@
 #  limitations under the License.
 import uuid
 from datetime import datetime, timedelta
-from typing import Any
+from typing import Any, Optional
 
 import pydantic
 import sqlmodel
 
-from webserver.utils.timer import utc_now
+from timer_queue.delay import FIRED_BY_BROKER_FIELD
+from timer_queue.trace import PUBLISHED_AT, TRACE_FIELD, record_hop
+
+from webserver.utils.timer import seconds_left, utc_now
 
 
 class Timers(sqlmodel.SQLModel, table=True):
@@ -35,15 +38,12 @@ class Timers(sqlmodel.SQLModel, table=True):
     @property
     def fire_at(self) -> datetime:
         """Retrieves date and time the timer should be fired."""
-        return self.created_at + timedelta(hours=self.hours, minutes=self.minutes, seconds=self.seconds)
+        return self.created_at + self.duration
 
     @property
     def time_left(self) -> int:
         """Retrieves the amount of seconds the timer should run. If it expired, then returns 0"""
-        now = utc_now()
-        if self.fire_at > now:
-            return (self.fire_at - now).seconds
-        return 0
+        return seconds_left(self.fire_at)
 
     def dumps(self, *args, **kwargs) -> dict[str, Any]:
         """Retrieves fully serializable JSON object for the model instance."""
@@ -53,6 +53,29 @@ class Timers(sqlmodel.SQLModel, table=True):
         data["fire_at"] = str(self.fire_at)
         return data
 
+    @property
+    def duration(self) -> timedelta:
+        """Retrieves the time the timer runs."""
+        return timedelta(hours=self.hours, minutes=self.minutes, seconds=self.seconds)
+
+    def to_message(self, trace: Optional[dict[str, Any]] = None, fired_by_broker: bool = False) -> dict[str, Any]:
+        """
+        Retrieves the queue message for the model instance, the id and dates are left for the codec to encode.
+
+        The message carries a given trace, or a new one, with the moment it's published. Timers ``fired_by_broker``
+        are marked, so they are recorded without being scheduled in timers_to_fire.
+        """
+        data = self.model_dump()
+        data["fire_at"] = self.fire_at
+        data[TRACE_FIELD] = record_hop(trace, PUBLISHED_AT)
+        if fired_by_broker:
+            data[FIRED_BY_BROKER_FIELD] = True
+        return data
+
+    def to_fire_message(self, trace: Optional[dict[str, Any]] = None) -> dict[str, Any]:
+        """Retrieves the message firing the timer, the same as the timer service dispatches, with a given trace."""
+        return {"id": self.id, "url": self.url, "fire_at": self.fire_at, TRACE_FIELD: record_hop(trace, PUBLISHED_AT)}
+
 
 class TimerCreateIn(pydantic.BaseModel):
     """Timer input model represents a delayed call for the URL."""
@@ -67,6 +90,11 @@ class TimerCreateOut(pydantic.BaseModel):
     id: uuid.UUID = pydantic.Field(description="The UUID of the timer")
 
 
+class TimerBatchCreateOut(pydantic.BaseModel):
+    """Timer output model for batch create requests, ids follow the order of the requested timers."""
+    ids: list[uuid.UUID] = pydantic.Field(description="The UUIDs of the timers")
+
+
 class TimerGetOut(pydantic.BaseModel):
     """Timer output model for get requests represents a delayed call for the URL."""
     id: uuid.UUID = pydantic.Field(description="The UUID of the timer")
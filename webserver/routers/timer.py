@@ -11,45 +11,168 @@
 #  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
+import asyncio
 import os
+import uuid
+from typing import Annotated, Any, Optional
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Body, Header, HTTPException, Response
 
-from timer_queue.client import RabbitMQClient
-from webserver.database.engine import SessionDep
+from timer_queue.async_client import AsyncRabbitMQClient
+from timer_queue.delay import backoff_delays, delay_queue_arguments, delay_queue_name, delay_tier
+from timer_queue.exceptions import RabbitMqConnectionException
+from timer_queue.trace import new_trace
+from webserver.broker.client import QueueClientDep
+from webserver.cache.timers import TimerCacheDep
+from webserver.database.engine import AsyncSessionDep
 from webserver.models.timers import (
     Timers,
+    TimerBatchCreateOut,
     TimerCreateIn,
     TimerCreateOut,
     TimerGetOut,
 )
+from webserver.utils.timer import seconds_left, utc_now
 
-RABBIT_MQ_HOST = os.environ.get("RABBIT_MQ_HOST", "0.0.0.0")
-RABBIT_MQ_PORT = int(os.environ.get("RABBIT_MQ_PORT", "5672"))
 RABBIT_MQ_INCOMING = os.environ.get("RABBIT_MQ_INCOMING", "unknown_incoming")
+RABBIT_MQ_TO_FIRE = os.environ.get("RABBIT_MQ_TO_FIRE", "unknown_to_fire")
+# Maximum number of timers accepted by a single batch request.
+TIMER_BATCH_MAX_SIZE = int(os.environ.get("TIMER_BATCH_MAX_SIZE", "10000"))
+# Maximum number of timers packed into a single broker message of a batch request.
+TIMER_BATCH_MESSAGE_SIZE = int(os.environ.get("TIMER_BATCH_MESSAGE_SIZE", "1000"))
+# Timers running up to this number of seconds are fired through delay queues of the broker instead of timers_to_fire,
+# 0 disables the fast path. Delay tiers double from the resolution up to the threshold.
+TIMER_FAST_PATH_THRESHOLD_SECONDS = int(os.environ.get("TIMER_FAST_PATH_THRESHOLD_SECONDS", "0"))
+TIMER_FAST_PATH_RESOLUTION_MS = int(os.environ.get("TIMER_FAST_PATH_RESOLUTION_MS", "100"))
+# Header carrying the trace id of a request, all timers created by the request share it.
+TRACE_HEADER = "X-Trace-Id"
 
 
 router = APIRouter(prefix="/timer", tags=["timer"])
 
 
+def fast_path_delays() -> list[int]:
+    """Retrieves delay tiers of the fast path, none if it's disabled."""
+    if TIMER_FAST_PATH_THRESHOLD_SECONDS <= 0:
+        return []
+    return backoff_delays(TIMER_FAST_PATH_RESOLUTION_MS, TIMER_FAST_PATH_THRESHOLD_SECONDS * 1000)
+
+
+def is_fast_path(timer_db: Timers) -> bool:
+    """Checks whether a timer is short enough to be fired by the broker."""
+    duration = timer_db.duration.total_seconds()
+    return 0 < TIMER_FAST_PATH_THRESHOLD_SECONDS and duration <= TIMER_FAST_PATH_THRESHOLD_SECONDS
+
+
+async def fire_by_broker(queue_client: AsyncRabbitMQClient, timer_db: Timers, trace: dict[str, Any]) -> None:
+    """
+    Publishes the firing message of a timer to the delay tier closest to its firing moment, or right to the trigger if
+    it's due. The trigger passes a message arriving early on to the next tier, until the timer is due.
+    """
+    delay_ms = (timer_db.fire_at - utc_now()).total_seconds() * 1000
+    message = timer_db.to_fire_message(trace)
+    if (tier := delay_tier(delay_ms, fast_path_delays())) is None:
+        await queue_client.push_message(queue_name=RABBIT_MQ_TO_FIRE, message=message)
+    else:
+        await queue_client.push_message(
+            queue_name=delay_queue_name(RABBIT_MQ_TO_FIRE, tier),
+            message=message,
+            arguments=delay_queue_arguments(RABBIT_MQ_TO_FIRE, tier),
+        )
+
+
 @router.post("/", response_model=TimerCreateOut)
-def create_timer(timer: TimerCreateIn) -> TimerCreateOut:
+async def create_timer(
+    timer: TimerCreateIn,
+    queue_client: QueueClientDep,
+    timer_cache: TimerCacheDep,
+    response: Response,
+    x_trace_id: Annotated[Optional[str], Header()] = None,
+) -> TimerCreateOut:
     """
     Create a new timer.
 
+    The timer is traced with the id from the X-Trace-Id header, or with a new one returned in that header.
+
+    Timers running up to TIMER_FAST_PATH_THRESHOLD_SECONDS are fired by the broker through delay queues, only their
+    record is saved to the database. The firing message is published first, so a timer recorded as fired by the broker
+    always has one. If the record can't be published afterwards, the request fails though the timer still fires.
+
     Returns:
-        Health: A dictionary containing the status of the application.
+        TimerCreateOut: A dictionary containing the id of the created timer.
     """
     timer_db = Timers(**timer.model_dump())
+    trace = new_trace(x_trace_id)
+    fast_path = is_fast_path(timer_db)
 
-    client = RabbitMQClient(host=RABBIT_MQ_HOST, port=RABBIT_MQ_PORT)
-    client.push_message(queue_name=RABBIT_MQ_INCOMING, message=timer_db.dumps())
+    try:
+        if fast_path:
+            await fire_by_broker(queue_client, timer_db, trace)
+        await queue_client.push_message(
+            queue_name=RABBIT_MQ_INCOMING, message=timer_db.to_message(trace, fired_by_broker=fast_path),
+        )
+    except RabbitMqConnectionException:
+        raise HTTPException(status_code=503, detail="Timer could not be scheduled, try again later")
 
+    # The timer reaches the database only once the consumer has processed it, until then it's served from the cache.
+    timer_cache.put(timer_db.id, timer_db.fire_at)
+    response.headers[TRACE_HEADER] = trace["id"]
     return TimerCreateOut(id=timer_db.id)
 
 
+@router.post("/batch", response_model=TimerBatchCreateOut)
+async def create_timers(
+    timers: Annotated[list[TimerCreateIn], Body(min_length=1, max_length=TIMER_BATCH_MAX_SIZE)],
+    queue_client: QueueClientDep,
+    timer_cache: TimerCacheDep,
+    response: Response,
+    x_trace_id: Annotated[Optional[str], Header()] = None,
+) -> TimerBatchCreateOut:
+    """
+    Create multiple timers at once.
+
+    Timers are published in envelopes of up to TIMER_BATCH_MESSAGE_SIZE timers each. If any envelope could not be
+    confirmed, then the whole request fails with HTTP 503, though timers from the other envelopes may have been
+    scheduled. All timers of the request share the trace, like a single timer does. Short timers take the fast path
+    like single ones, their firing messages are confirmed before any envelope is published.
+
+    Returns:
+        TimerBatchCreateOut: A dictionary containing ids of the created timers in the order of the request.
+    """
+    timers_db = [Timers(**timer.model_dump()) for timer in timers]
+    trace = new_trace(x_trace_id)
+    fast_path = [is_fast_path(timer_db) for timer_db in timers_db]
+    messages = [timer_db.to_message(trace, fired_by_broker=fast) for timer_db, fast in zip(timers_db, fast_path)]
+    envelopes = [
+        {"timers": messages[start:start + TIMER_BATCH_MESSAGE_SIZE]}
+        for start in range(0, len(messages), TIMER_BATCH_MESSAGE_SIZE)
+    ]
+
+    try:
+        await asyncio.gather(*(
+            fire_by_broker(queue_client, timer_db, trace) for timer_db, fast in zip(timers_db, fast_path) if fast
+        ))
+        await asyncio.gather(*(
+            queue_client.push_message(queue_name=RABBIT_MQ_INCOMING, message=envelope) for envelope in envelopes
+        ))
+    except RabbitMqConnectionException:
+        raise HTTPException(status_code=503, detail="Timers could not be scheduled, try again later")
+
+    for timer_db in timers_db:
+        timer_cache.put(timer_db.id, timer_db.fire_at)
+    response.headers[TRACE_HEADER] = trace["id"]
+    return TimerBatchCreateOut(ids=[timer_db.id for timer_db in timers_db])
+
+
 @router.get("/{id}", response_model=TimerGetOut)
-def get_timer(id: str, session: SessionDep) -> TimerGetOut:
-    if timer := session.get(Timers, id):
+async def get_timer(id: str, session: AsyncSessionDep, timer_cache: TimerCacheDep) -> TimerGetOut:
+    try:
+        timer_id = uuid.UUID(id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Timer not found")
+    if fire_at := timer_cache.get(timer_id):
+        return TimerGetOut(id=timer_id, time_left=seconds_left(fire_at))
+    if timer := await session.get(Timers, timer_id):
+        timer_cache.put(timer.id, timer.fire_at)
         return TimerGetOut(id=timer.id, time_left=timer.time_left)
     raise HTTPException(status_code=404, detail="Timer not found")
@@ -18,3 +18,11 @@ from datetime import datetime, UTC
 def utc_now() -> datetime:
     """Helper function returns current UTC timestamp."""
     return datetime.now(UTC)
+
+
+def seconds_left(fire_at: datetime) -> int:
+    """Retrieves the amount of seconds left until a given moment. If it has passed, then returns 0."""
+    now = utc_now()
+    if fire_at > now:
+        return (fire_at - now).seconds
+    return 0